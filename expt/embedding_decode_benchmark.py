@@ -0,0 +1,110 @@
+"""
+Compare the client-side cost of decoding embedding responses as JSON floats vs. base64.
+
+A local stand-in for the embeddings endpoint serves fabricated responses, so this needs no API key and measures
+only HTTP + decode time:
+
+    python expt/embedding_decode_benchmark.py --batch_size 256 --dimensions 1536 --requests 20
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from openai import OpenAI
+
+from repo_gpt.openai_service import decode_embedding
+
+
+def make_handler(batch_size: int, dimensions: int):
+    vectors = np.random.default_rng(0).random((batch_size, dimensions), "float32")
+
+    def response_body(encoding_format: str) -> bytes:
+        data = [
+            {
+                "object": "embedding",
+                "index": index,
+                "embedding": base64.b64encode(vector.astype("<f4").tobytes()).decode()
+                if encoding_format == "base64"
+                else vector.tolist(),
+            }
+            for index, vector in enumerate(vectors)
+        ]
+        return json.dumps(
+            {
+                "object": "list",
+                "data": data,
+                "model": "stand-in",
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        ).encode()
+
+    bodies = {"float": response_body("float"), "base64": response_body("base64")}
+
+    class EmbeddingsHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            body = bodies[request.get("encoding_format", "float")]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return EmbeddingsHandler, {name: len(body) for name, body in bodies.items()}
+
+
+def embed(client: OpenAI, batch_size: int, encoding_format: str):
+    kwargs = {"encoding_format": encoding_format} if encoding_format else {}
+    response = client.embeddings.create(
+        input=["x"] * batch_size, model="stand-in", **kwargs
+    )
+    if encoding_format == "base64":
+        return [decode_embedding(item.embedding) for item in response.data]
+    return [np.asarray(item.embedding, dtype=np.float32) for item in response.data]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    handler, body_sizes = make_handler(args.batch_size, args.dimensions)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OpenAI(
+        api_key="stand-in", base_url=f"http://127.0.0.1:{server.server_port}/v1"
+    )
+
+    variants = [
+        ("JSON floats", "float", body_sizes["float"]),
+        # The client's default: base64 on the wire, expanded back into Python floats
+        ("client default", None, body_sizes["base64"]),
+        ("base64 -> float32 buffer", "base64", body_sizes["base64"]),
+    ]
+    print(
+        f"{args.requests} requests of {args.batch_size} x {args.dimensions}-d embeddings"
+    )
+    for name, encoding_format, body_size in variants:
+        embed(client, args.batch_size, encoding_format)  # warm up
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            embed(client, args.batch_size, encoding_format)
+        per_request = (time.perf_counter() - start) / args.requests
+        print(
+            f"{name:>26}: {per_request * 1000:8.1f} ms/request, "
+            f"{body_size / 1024 / 1024:6.2f} MB/response"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
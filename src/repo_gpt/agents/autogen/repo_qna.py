@@ -11,7 +11,9 @@ from repo_gpt.agents.autogen.user_proxy_function_call_agent import (
 )
 from repo_gpt.agents.repo_comprehender import get_relative_path_directory_structure
 from repo_gpt.code_manager.abstract_extractor import AbstractCodeExtractor
+from repo_gpt.code_manager.index_store import INDEX_FILE_NAME
 from repo_gpt.file_handler.generic_code_file_handler import PythonFileHandler
+from repo_gpt.http_client import autogen_config
 from repo_gpt.openai_service import OpenAIService
 from repo_gpt.search_service import SearchService, convert_search_df_to_json
 
@@ -30,19 +32,17 @@ class RepoQnA:
         self.embedding_path = (
             Path(embedding_path)
             if embedding_path is not None
-            else self.root_path / ".repo_gpt/code_embeddings.pkl"
+            else self.root_path / ".repo_gpt" / INDEX_FILE_NAME
         )
-        self.openai_service = OpenAIService(openai_api_key)
+        self.openai_service = OpenAIService(openai_api_key=openai_api_key)
         self.search_service = SearchService(self.openai_service, self.embedding_path)
         self.openai_api_key = (
             openai_api_key if openai_api_key else os.environ["OPENAI_API_KEY"]
         )
 
         config_list = [
-            {
-                "model": "gpt-3.5-turbo-1106",
-                "api_key": self.openai_api_key,
-            },  # OpenAI API endpoint for gpt-3.5-turbo
+            # OpenAI API endpoint for gpt-3.5-turbo, on the shared connection pool
+            autogen_config("gpt-3.5-turbo-1106", self.openai_api_key),
         ]
         self.config = self.create_function_augmented_config(config_list)
 
@@ -259,7 +259,7 @@ ANSWER: I cannot answer this question.
         def __init__(
             self, root_path, embedding_path, openai_api_key, is_termination_msg_func
         ):
-            self.openai_service = OpenAIService(openai_api_key)
+            self.openai_service = OpenAIService(openai_api_key=openai_api_key)
             self.root_path = root_path
             self.embedding_path = embedding_path
             self.search_service = SearchService(
@@ -1,14 +1,8 @@
 import inspect
 import json
 import logging
-import os
 from abc import ABC, abstractmethod
 
-from openai import OpenAI
-
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
 import tiktoken
 from tenacity import (  # for exponential backoff
     retry,
@@ -17,6 +11,7 @@ from tenacity import (  # for exponential backoff
 )
 
 from repo_gpt.agents.simple_memory_store import MemoryStore
+from repo_gpt.http_client import openai_client
 
 logger = logging.getLogger(__name__)
 
@@ -75,7 +70,7 @@ class BaseAgent(ABC):
     # @retry(wait=wait_random_exponential(multiplier=1, max=40), stop=stop_after_attempt(3))
     def chat_completion_request(self, function_call="auto", model=GPT_MODEL):
         try:
-            response = client.chat.completions.create(
+            response = openai_client().chat.completions.create(
                 model=model,
                 messages=self.memory_store.messages,
                 functions=self.functions,
@@ -35,7 +35,9 @@ Use the two llm agents to complete the user task. Always understand the codebase
         self.embedding_path = embedding_file_path
         self.openai_key = openai_key
         self.openai_service = (
-            OpenAIService() if not openai_key else OpenAIService(openai_key)
+            OpenAIService()
+            if not openai_key
+            else OpenAIService(openai_api_key=openai_key)
         )
         self.functions = self._initialize_functions()
 
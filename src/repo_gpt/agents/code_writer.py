@@ -31,7 +31,9 @@ class CodeWritingAgent(BaseAgent):
         self.root_path = root_path
         self.embedding_path = embedding_path
         self.openai_service = (
-            OpenAIService() if not openai_key else OpenAIService(openai_key)
+            OpenAIService()
+            if not openai_key
+            else OpenAIService(openai_api_key=openai_key)
         )
         self.search_service = SearchService(self.openai_service, self.embedding_path)
         self.codefilehandler = (
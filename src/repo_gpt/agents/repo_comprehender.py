@@ -7,6 +7,7 @@ from pathspec import PathSpec
 from pathspec.patterns import GitWildMatchPattern
 
 from repo_gpt.agents.base_agent import BaseAgent
+from repo_gpt.code_manager.index_store import INDEX_FILE_NAME
 from repo_gpt.file_handler.generic_code_file_handler import PythonFileHandler
 from repo_gpt.openai_service import OpenAIService
 from repo_gpt.search_service import SearchService, convert_search_df_to_json
@@ -136,9 +137,11 @@ class RepoUnderstandingAgent(BaseAgent):
             debug,
         )  # Call ParentAgent constructor
         self.root_path = root_path
-        self.embedding_path = self.root_path / ".repo_gpt/code_embeddings.pkl"
+        self.embedding_path = self.root_path / ".repo_gpt" / INDEX_FILE_NAME
         self.openai_service = (
-            OpenAIService() if not openai_key else OpenAIService(openai_key)
+            OpenAIService()
+            if not openai_key
+            else OpenAIService(openai_api_key=openai_key)
         )
         self.search_service = SearchService(self.openai_service, self.embedding_path)
         self.pythonfilehandler = (
@@ -1,12 +1,6 @@
 import json
 import logging
-import os
 
-from openai import OpenAI
-
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
 import tiktoken
 from tenacity import (  # for exponential backoff
     retry,
@@ -14,6 +8,7 @@ from tenacity import (  # for exponential backoff
     wait_random_exponential,
 )
 
+from repo_gpt.http_client import openai_client
 from repo_gpt.openai_service import num_tokens_from_messages, num_tokens_from_string
 
 
@@ -111,7 +106,7 @@ class MemoryStore:
             },
         ]
         try:
-            response = client.chat.completions.create(
+            response = openai_client().chat.completions.create(
                 model=self.SUMMARY_MODEL, messages=summary_messages
             )
             logging.debug(response)
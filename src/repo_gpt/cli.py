@@ -1,20 +1,61 @@
 #!./venv/bin/python
+import argparse
 import logging
 import os
+import subprocess
+import sys
 from pathlib import Path
-from typing import Union
+from typing import List, Union
 
 import configargparse
+import numpy as np
 
 from repo_gpt import logging_config, utils
 from repo_gpt.agents.autogen.repo_qna import RepoQnA
 from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.dimension_tradeoff import (
+    DEFAULT_NUM_QUERIES,
+    DEFAULT_RECALL_K,
+    DEFAULT_TRADEOFF_DIMENSIONS,
+    measure_dimension_tradeoff,
+    print_dimension_tradeoff,
+)
+from repo_gpt.code_manager.embedding_checkpoint import (
+    CHECKPOINT_EVERY_BLOCKS,
+    CHECKPOINT_EVERY_SECONDS,
+)
+from repo_gpt.code_manager.embedding_migration import split_embedding_spaces
+from repo_gpt.code_manager.index_lock import IndexLock, IndexLockedError
+from repo_gpt.code_manager.index_store import (
+    CODE_COLUMN,
+    EMBEDDING_COLUMN,
+    INDEX_FILE_NAME,
+    LEGACY_INDEX_SUFFIX,
+    IndexSnapshot,
+    compact_index,
+    convert_legacy_index,
+    index_needs_compaction,
+)
+from repo_gpt.code_manager.setup_estimator import (
+    DEFAULT_DIRECTORY_DEPTH,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+)
+from repo_gpt.console import console
+from repo_gpt.embedding_cache import EmbeddingCache
+from repo_gpt.http_client import MAX_CONNECTIONS, configure_http_client
 from repo_gpt.logging_config import VERBOSE_INFO, configure_logging
-from repo_gpt.openai_service import OpenAIService
+from repo_gpt.openai_service import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_PROVIDER,
+    EMBEDDING_PROVIDERS,
+    MAX_CONCURRENCY,
+    OpenAIService,
+)
 from repo_gpt.search_service import SearchService
 from repo_gpt.test_generator import TestGenerator
 
-CODE_EMBEDDING_FILE_PATH = str(Path.cwd() / ".repo_gpt" / "code_embeddings.pkl")
+CODE_EMBEDDING_FILE_PATH = str(Path.cwd() / ".repo_gpt" / INDEX_FILE_NAME)
 
 
 logger = logging.getLogger(__name__)
@@ -29,8 +70,9 @@ def main():
     )
     parser.add_argument(
         "--pickle_path",
+        "--index_path",
         type=str,
-        help="Path of the pickled DataFrame to search in",
+        help="Path of the index to search in: a Parquet file, or an older pickled DataFrame if it ends in .pkl",
         default=CODE_EMBEDDING_FILE_PATH,
     )
     parser.add_argument(
@@ -45,6 +87,64 @@ def main():
         help="Package/library GPT should use to write tests (e.g. pytest, unittest, etc.)",
     )
 
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        help="Upper bound on concurrent OpenAI requests. The effective limit adapts to the API's rate limit headers.",
+        default=MAX_CONCURRENCY,
+    )
+
+    parser.add_argument(
+        "--openai_base_url",
+        type=str,
+        help="Send OpenAI requests to this base URL instead, e.g. a local stand-in server for load testing "
+        "(default: OPENAI_BASE_URL or the OpenAI API)",
+    )
+    parser.add_argument(
+        "--max_connections",
+        type=int,
+        help="Size of the HTTP connection pool shared by all OpenAI requests",
+        default=MAX_CONNECTIONS,
+    )
+
+    parser.add_argument(
+        "--embedding_provider",
+        choices=sorted(EMBEDDING_PROVIDERS),
+        help="Where embeddings come from: the OpenAI API, or a local CPU model that needs no network access. "
+        "An index can only be searched with the provider that built it.",
+        default=EMBEDDING_PROVIDER,
+    )
+    parser.add_argument(
+        "--embedding_dimensions",
+        type=int,
+        help="Shorten embeddings to this many dimensions for a smaller index and faster search (default: the "
+        "model's native dimension). Use `repo-gpt dimensions` to see the recall cost on your repo.",
+        default=EMBEDDING_DIMENSIONS,
+    )
+    parser.add_argument(
+        "--embedding_cache_dir",
+        type=str,
+        help="Directory of the embedding cache shared across repos and runs (default: ~/.cache/repo_gpt)",
+    )
+    parser.add_argument(
+        "--embedding_cache_max_mb",
+        type=float,
+        help="Evict least recently used embeddings once the cache grows past this size",
+    )
+    parser.add_argument(
+        "--no_embedding_cache",
+        action="store_true",
+        help="Don't read or write the shared embedding cache",
+    )
+    parser.add_argument(
+        "--code_by_reference",
+        action="store_true",
+        help="Store each block's file checksum and byte range in the index instead of its code, and read the code "
+        "from the working tree, or a compressed copy of the indexed file once it has changed, when it's shown",
+    )
+    # Searches index changed files too, so they take the setup options as well
+    _add_checkpoint_arguments(parser, CHECKPOINT_EVERY_BLOCKS, CHECKPOINT_EVERY_SECONDS)
+
     # For some reason no -v returns 2, -v returns 1, -vv returns 3, -vvv returns 5
     parser.add_argument(
         "--verbose",
@@ -63,6 +163,88 @@ def main():
     parser_run = subparsers.add_parser(
         "setup", help="Run code extraction and processing"
     )
+    # Also accepted after `setup`; left unset there so they don't override the ones given before it
+    _add_checkpoint_arguments(parser_run, argparse.SUPPRESS, argparse.SUPPRESS)
+    parser_run.add_argument(
+        "--dry_run",
+        "--dry-run",
+        action="store_true",
+        help="Estimate the blocks, tokens, requests, cost and time setup would need without calling the API",
+    )
+    parser_run.add_argument(
+        "--batch_export",
+        "--batch-export",
+        type=str,
+        metavar="REQUESTS_FILE",
+        help="Write the pending embedding requests as OpenAI Batch API JSONL instead of calling the API",
+    )
+    parser_run.add_argument(
+        "--batch_ingest",
+        "--batch-ingest",
+        type=str,
+        metavar="RESULTS_FILE",
+        help="Merge the results JSONL of a batch job created with --batch_export into the index",
+    )
+    parser_run.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=DEFAULT_REQUESTS_PER_MINUTE,
+        help="Your embedding requests-per-minute limit, used by --dry_run to estimate time",
+    )
+    parser_run.add_argument(
+        "--tokens_per_minute",
+        type=int,
+        default=DEFAULT_TOKENS_PER_MINUTE,
+        help="Your embedding tokens-per-minute limit, used by --dry_run to estimate time",
+    )
+    parser_run.add_argument(
+        "--directory_depth",
+        type=int,
+        default=DEFAULT_DIRECTORY_DEPTH,
+        help="How many directory levels --dry_run groups totals by",
+    )
+
+    # Sub-command to measure what smaller embeddings would cost in search quality
+    parser_dimensions = subparsers.add_parser(
+        "dimensions",
+        help="Measure search recall and index size of the current index at reduced embedding dimensions",
+    )
+    parser_dimensions.add_argument(
+        "--dimensions",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_TRADEOFF_DIMENSIONS),
+        help="Embedding dimensions to compare",
+    )
+    parser_dimensions.add_argument(
+        "--k",
+        type=int,
+        default=DEFAULT_RECALL_K,
+        help="Number of nearest neighbours recall is measured over",
+    )
+    parser_dimensions.add_argument(
+        "--num_queries",
+        type=int,
+        default=DEFAULT_NUM_QUERIES,
+        help="Number of indexed blocks sampled as queries",
+    )
+
+    # Sub-command to convert an index from older versions
+    parser_convert = subparsers.add_parser(
+        "convert-index",
+        help="Convert a pickled DataFrame index from older versions to the Parquet index format",
+    )
+    parser_convert.add_argument(
+        "--legacy_path",
+        type=str,
+        help="Pickled index to convert (default: the index path with a .pkl suffix)",
+    )
+
+    # Sub-command to compact the index
+    subparsers.add_parser(
+        "compact",
+        help="Rewrite the index and the segments appended to it since as one file",
+    )
 
     # Sub-command to search in the pickled DataFrame
     parser_search = subparsers.add_parser(
@@ -113,11 +295,28 @@ def main():
     args = parser.parse_args()
 
     # Services
-    openai_service = OpenAIService()
+    embedding_cache = (
+        EmbeddingCache(args.embedding_cache_dir, args.embedding_cache_max_mb)
+        if not args.no_embedding_cache
+        else None
+    )
+    configure_http_client(
+        base_url=args.openai_base_url,
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_connections,
+    )
+    openai_service = OpenAIService(
+        max_concurrency=args.max_concurrency,
+        embedding_cache=embedding_cache,
+        use_embedding_cache=not args.no_embedding_cache,
+        embedding_provider=args.embedding_provider,
+        embedding_dimensions=args.embedding_dimensions,
+    )
 
     search_service = (
         SearchService(openai_service, args.pickle_path)
-        if args.command not in ["setup", "explain"]
+        if args.command
+        not in ["setup", "explain", "dimensions", "convert-index", "compact"]
         else None
     )
     if int(args.verbose) >= 1:
@@ -126,21 +325,67 @@ def main():
     if args.command == "setup":
         code_root_path = Path(args.code_root_path)
         pickle_path = Path(args.pickle_path)
-        manager = CodeManager(pickle_path, code_root_path)
-        manager.setup()
+        manager = CodeManager(
+            pickle_path,
+            code_root_path,
+            checkpoint_every_blocks=args.checkpoint_every_blocks,
+            checkpoint_every_seconds=args.checkpoint_every_seconds,
+            code_by_reference=args.code_by_reference,
+        )
+        if args.batch_export:
+            manager.batch_export(args.batch_export)
+        elif args.batch_ingest:
+            manager.batch_ingest(args.batch_ingest)
+        elif args.dry_run:
+            manager.dry_run(
+                requests_per_minute=args.requests_per_minute,
+                tokens_per_minute=args.tokens_per_minute,
+                directory_depth=args.directory_depth,
+            )
+        else:
+            manager.setup()
+    elif args.command == "dimensions":
+        # An index being re-embedded holds vectors of two lengths; measure the ones searches use
+        with IndexSnapshot(args.pickle_path) as snapshot:
+            code_df = split_embedding_spaces(
+                snapshot.read(exclude_columns=[CODE_COLUMN, EMBEDDING_COLUMN]),
+                openai_service,
+            ).serving
+            embeddings = np.concatenate(
+                [
+                    matrix[rows]
+                    for matrix, rows, _ in snapshot.embedding_matrices(code_df)
+                ]
+            )
+        print_dimension_tradeoff(
+            measure_dimension_tradeoff(
+                embeddings, args.dimensions, args.k, args.num_queries
+            )
+        )
+    elif args.command == "convert-index":
+        with IndexLock(args.pickle_path):
+            convert_legacy_index(
+                args.legacy_path
+                or Path(args.pickle_path).with_suffix(LEGACY_INDEX_SUFFIX),
+                args.pickle_path,
+            )
+    elif args.command == "compact":
+        with IndexLock(args.pickle_path):
+            num_rows = compact_index(args.pickle_path)
+        logger.verbose_info(f"Compacted the index into {num_rows} rows")
     elif args.command == "search":
-        update_code_embedding_file(args.pickle_path, args.code_root_path)
+        update_code_embedding_file(args, search_service)
         # search_service.simple_search(args.query) # simple search
         search_service.semantic_search(args.query)  # semantic search
     elif args.command == "query":
-        update_code_embedding_file(args.pickle_path, args.code_root_path)
+        update_code_embedding_file(args, search_service)
         repo_qna = RepoQnA(args.question, args.code_root_path)
         repo_qna.initiate_chat()
     elif args.command == "explain":
-        update_code_embedding_file(args.pickle_path, args.code_root_path)
+        update_code_embedding_file(args)
         search_service.explain(args.question)
     elif args.command == "analyze":  # TODO change to explain function
-        update_code_embedding_file(args.pickle_path, args.code_root_path)
+        update_code_embedding_file(args, search_service)
         file_to_analyze = Path(args.file_path)
         if not file_to_analyze.is_absolute():
             file_to_analyze = Path(args.code_root_path) / file_to_analyze
@@ -149,7 +394,11 @@ def main():
         search_service = SearchService(openai_service, language=args.language)
         return search_service.explain(args.code)
     elif args.command == "add-test":
-        code_manager = CodeManager(args.pickle_path, args.code_root_path)
+        code_manager = CodeManager(
+            args.pickle_path,
+            args.code_root_path,
+            code_by_reference=args.code_by_reference,
+        )
         # Look for the function name in the embedding file
         add_tests(
             search_service,
@@ -162,12 +411,121 @@ def main():
         parser.print_help()
 
 
-def update_code_embedding_file(
-    code_embedding_file_path, code_root_path
-) -> Union[None, str]:
-    print(f"Code embedding file path: {code_embedding_file_path}")
-    manager = CodeManager(code_embedding_file_path, code_root_path)
-    manager.setup()
+def _add_checkpoint_arguments(parser, every_blocks, every_seconds):
+    parser.add_argument(
+        "--checkpoint_every_blocks",
+        type=int,
+        default=every_blocks,
+        help="Save embedding progress after this many blocks so an interrupted setup can resume",
+    )
+    parser.add_argument(
+        "--checkpoint_every_seconds",
+        type=float,
+        default=every_seconds,
+        help="Save embedding progress at least this often (in seconds)",
+    )
+
+
+def update_code_embedding_file(args, search_service=None) -> Union[None, str]:
+    """
+    Bring the index up to date before a search. On a cold or large update, commit the first, most recently changed
+    part of the index and leave the rest to a setup running in the background, so the search can start right away.
+    """
+    print(f"Code embedding file path: {args.pickle_path}")
+    # Compacting rewrites the whole index, so it never holds up a search
+    manager = CodeManager(
+        args.pickle_path,
+        args.code_root_path,
+        checkpoint_every_blocks=args.checkpoint_every_blocks,
+        checkpoint_every_seconds=args.checkpoint_every_seconds,
+        auto_compact=False,
+        code_by_reference=args.code_by_reference,
+    )
+    if not manager.progress.is_running():
+        try:
+            complete = manager.setup(max_commits=1, wait=False)
+        except IndexLockedError as e:
+            # Search the index as last committed rather than wait
+            logger.verbose_info(f"{e}; searching the index as it is")
+        else:
+            if not complete:
+                background_setup = _start_in_background(
+                    background_command(args, "setup")
+                )
+                progress = manager.progress.read()
+                manager.progress.update(
+                    progress["indexed_blocks"],
+                    progress["total_blocks"],
+                    background_setup.pid,
+                )
+            elif index_needs_compaction(args.pickle_path):
+                _start_in_background(background_command(args, "compact"))
+
+    if search_service is not None and Path(args.pickle_path).exists():
+        search_service.refresh_df()
+    banner = manager.progress.banner()
+    if banner is not None:
+        console.print(banner, style="yellow")
+    if (
+        search_service is not None
+        and search_service.embedding_provider
+        is not search_service.openai_service.embedding_provider
+    ):
+        console.print(
+            f"Searching the existing {_describe_embeddings(search_service.embedding_provider)} until the index "
+            f"has been re-embedded with {_describe_embeddings(search_service.openai_service.embedding_provider)}",
+            style="yellow",
+        )
+
+
+def _describe_embeddings(provider) -> str:
+    return f"{provider.model} embeddings ({provider.output_dimensions} dimensions)"
+
+
+def _start_in_background(command: List[str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def background_command(args, command_name: str) -> List[str]:
+    """A `repo-gpt <command_name>` command line, e.g. one finishing the index, with the same settings as this run."""
+    command = [
+        sys.executable,
+        "-m",
+        "repo_gpt.cli",
+        "--pickle_path",
+        str(Path(args.pickle_path).absolute()),
+        "--code_root_path",
+        str(Path(args.code_root_path).absolute()),
+        "--max_concurrency",
+        str(args.max_concurrency),
+        "--embedding_provider",
+        args.embedding_provider,
+        "--max_connections",
+        str(args.max_connections),
+        "--checkpoint_every_blocks",
+        str(args.checkpoint_every_blocks),
+        "--checkpoint_every_seconds",
+        str(args.checkpoint_every_seconds),
+    ]
+    if args.openai_base_url is not None:
+        command += ["--openai_base_url", args.openai_base_url]
+    if args.embedding_dimensions is not None:
+        command += ["--embedding_dimensions", str(args.embedding_dimensions)]
+    if args.embedding_cache_dir is not None:
+        command += ["--embedding_cache_dir", args.embedding_cache_dir]
+    if args.embedding_cache_max_mb is not None:
+        command += ["--embedding_cache_max_mb", str(args.embedding_cache_max_mb)]
+    if args.no_embedding_cache:
+        command.append("--no_embedding_cache")
+    if args.code_by_reference:
+        command.append("--code_by_reference")
+    return command + [command_name]
 
 
 def update_code_embedding_file_and_search_service(
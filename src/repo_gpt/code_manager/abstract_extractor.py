@@ -1,7 +1,7 @@
 import os
 from abc import ABC
 from enum import Enum
-from typing import Set, Type
+from typing import Set, Type, Union
 
 from pathspec import PathSpec
 from pathspec.patterns import GitWildMatchPattern
@@ -40,6 +40,19 @@ class AbstractCodeExtractor(ABC):
         ".tsx": TypeScriptFileHandler,
     }
 
+    LANGUAGE_MAPPING = {
+        ".py": Language.PYTHON,
+        ".sql": Language.SQL,
+        ".php": Language.PHP,
+        ".ts": Language.TYPESCRIPT,
+        ".tsx": Language.TYPESCRIPT,
+    }
+
+    @staticmethod
+    def get_language(filepath: str) -> Union[Language, None]:
+        _, file_extension = os.path.splitext(filepath)
+        return AbstractCodeExtractor.LANGUAGE_MAPPING.get(file_extension)
+
     @staticmethod
     def get_file_extensions_with_handlers() -> Set[str]:
         return AbstractCodeExtractor.HANDLER_MAPPING.keys()
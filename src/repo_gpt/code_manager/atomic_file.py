@@ -0,0 +1,70 @@
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+
+TEMP_FILE_SUFFIX = ".tmp"
+
+
+def fsync_directory(directory: Union[Path, str]):
+    """Make renames in `directory` durable. Windows can't open directories, and doesn't need to."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _file_mode(path: Path) -> int:
+    """The permissions a write to `path` should leave: those of the file it replaces, or the umask's for new files."""
+    try:
+        return stat.S_IMODE(path.stat().st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_write(path: Union[Path, str], mode: str = "wb", encoding: str = None):
+    """
+    Open a temporary file next to `path` for writing, and once the block completes, flush it to disk and rename it
+    over `path`. Readers see either the old file or the complete new one, never a partial write, even if the process
+    or the machine dies midway; a failed write leaves the old file as it was.
+    """
+    path = Path(path)
+    file = tempfile.NamedTemporaryFile(
+        mode,
+        encoding=encoding,
+        dir=path.parent,
+        prefix=f".{path.name}.",
+        suffix=TEMP_FILE_SUFFIX,
+        delete=False,
+    )
+    try:
+        with file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        # Temporary files are created readable by their owner only
+        os.chmod(file.name, _file_mode(path))
+        os.replace(file.name, path)
+    except BaseException:
+        Path(file.name).unlink(missing_ok=True)
+        raise
+    fsync_directory(path.parent)
+
+
+def remove_temp_files(directory: Union[Path, str]):
+    """Delete the temporary files of writes that were interrupted; only safe while no other write is running."""
+    directory = Path(directory)
+    if directory.is_dir():
+        for path in directory.glob(f".*{TEMP_FILE_SUFFIX}"):
+            path.unlink(missing_ok=True)
@@ -2,7 +2,7 @@ import hashlib
 import logging
 import os
 from pathlib import Path
-from typing import Dict, List, Set, Union
+from typing import Dict, List, Optional, Set, Union
 
 import pandas as pd
 from pathspec import PathSpec
@@ -10,9 +10,11 @@ from pathspec.patterns import GitWildMatchPattern
 from tqdm.auto import tqdm
 
 from ..console import verbose_print
+from ..embedding_provider import EmbeddingProvider
 from ..file_handler.abstract_handler import ParsedCode
 from ..openai_service import EMBEDDING_MODEL
 from .abstract_extractor import AbstractCodeExtractor
+from .index_catalog import IndexCatalog
 
 logger = logging.getLogger(__name__)
 
@@ -23,11 +25,16 @@ class CodeDirectoryExtractor(AbstractCodeExtractor):
         root_directory_path: Path,
         output_filepath: Path,
         code_df: Union[pd.DataFrame, None] = None,
+        catalog: Optional[IndexCatalog] = None,
+        embedding_provider: Optional[EmbeddingProvider] = None,
     ):
         self.root_directory_path = root_directory_path
         self.output_filepath = output_filepath
         self.all_code_files = self._find_all_code_files()
         self.code_df = code_df
+        # Looks up the indexed files in `embedding_provider`'s space, the ones `code_df` holds, without scanning it
+        self.catalog = catalog
+        self.embedding_provider = embedding_provider
 
     def generate_md5_checksum(self, file_path: str, chunk_size: int = 4096) -> str:
         file_hash = hashlib.md5()
@@ -57,7 +64,17 @@ class CodeDirectoryExtractor(AbstractCodeExtractor):
                 all_code_files.append(self.root_directory_path / full_file_path)
         return all_code_files
 
+    def _uses_catalog(self) -> bool:
+        return self.catalog is not None and self.output_filepath.exists()
+
     def _map_checksum_to_filepath(self) -> Dict[str, str]:  # checksum : filepath
+        if self._uses_catalog():
+            return {
+                checksum: filepath
+                for filepath, checksum in self.catalog.checksums_by_filepath(
+                    self.embedding_provider
+                ).items()
+            }
         return (
             self.code_df.drop_duplicates(subset=["file_checksum"])[
                 ["filepath", "file_checksum"]
@@ -67,6 +84,9 @@ class CodeDirectoryExtractor(AbstractCodeExtractor):
         )
 
     def _map_filepath_to_checksum(self) -> Dict[str, str]:  # filepath : checksum
+        if self._uses_catalog():
+            return self.catalog.checksums_by_filepath(self.embedding_provider)
+
         # Return empty dict if DataFrame is None or empty
         if self.code_df is None or self.code_df.empty:
             return {}
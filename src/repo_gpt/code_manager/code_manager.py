@@ -1,18 +1,73 @@
 import logging
 import os
-import pickle
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Union
+from typing import List, Union
 
 import pandas as pd
 
 from ..console import verbose_print
-from ..openai_service import EMBEDDING_MODEL, OpenAIService
+from ..embedding_provider import embedding_space_mismatch
+from ..file_handler.abstract_handler import ParsedCode
+from ..openai_service import OpenAIService
 from .code_dir_extractor import CodeDirectoryExtractor
 from .code_processor import CodeProcessor
+from .embedding_batch_job import BatchIngestReport, read_batch_results
+from .embedding_checkpoint import (
+    CHECKPOINT_EVERY_BLOCKS,
+    CHECKPOINT_EVERY_SECONDS,
+    EmbeddingCheckpoint,
+)
+from .embedding_migration import split_embedding_spaces
+from .index_catalog import IndexCatalog
+from .index_lock import IndexLock, IndexLockedError
+from .index_progress import IndexProgress
+from .index_store import (
+    LEGACY_INDEX_SUFFIX,
+    append_index_segment,
+    can_append_segments,
+    convert_legacy_index,
+    index_needs_compaction,
+    index_state,
+    is_legacy_index,
+    read_index,
+    remove_interrupted_writes,
+    write_index,
+)
+from .indexing_priority import prioritise_files
+from .setup_estimator import (
+    DEFAULT_DIRECTORY_DEPTH,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+    SetupEstimate,
+    print_setup_estimate,
+)
+from .source_store import SourceStore, store_code_by_reference
 
 logger = logging.getLogger(__name__)
 
+# Blocks embedded before the first index commit; later commits double in size up to MAX_COMMIT_BLOCKS
+FIRST_COMMIT_BLOCKS = 100
+MAX_COMMIT_BLOCKS = 2_000
+
+
+def _concat_rows(updated_df, processed_dataframe):
+    """
+    `updated_df` followed by `processed_dataframe`. Missing or empty frames are left out rather than passed to
+    `pd.concat`, which warns about them; the other frame is then returned as is.
+    """
+    frames = [
+        df
+        for df in (updated_df, processed_dataframe)
+        if df is not None and not df.empty
+    ]
+    if len(frames) == 2:
+        return pd.concat(frames)
+    if frames:
+        return frames[0]
+    return processed_dataframe if processed_dataframe is not None else updated_df
+
 
 class CodeManager:
     def __init__(
@@ -20,6 +75,12 @@ class CodeManager:
         output_filepath: Union[Path, str],
         root_directory: Union[Path, str],
         openai_service: OpenAIService = None,
+        checkpoint_every_blocks: int = CHECKPOINT_EVERY_BLOCKS,
+        checkpoint_every_seconds: float = CHECKPOINT_EVERY_SECONDS,
+        first_commit_blocks: int = FIRST_COMMIT_BLOCKS,
+        max_commit_blocks: int = MAX_COMMIT_BLOCKS,
+        auto_compact: bool = True,
+        code_by_reference: bool = False,
     ):
         self.root_directory = (
             root_directory if isinstance(root_directory, Path) else Path(root_directory)
@@ -33,10 +94,39 @@ class CodeManager:
             openai_service if openai_service is not None else OpenAIService()
         )
         self.code_processor = CodeProcessor(self.root_directory, openai_service)
+        self.checkpoint_filepath = self.output_filepath.with_suffix(".checkpoint")
+        self.checkpoint_every_blocks = checkpoint_every_blocks
+        self.checkpoint_every_seconds = checkpoint_every_seconds
+        self.progress = IndexProgress(
+            self.output_filepath.with_suffix(".progress.json")
+        )
+        self.first_commit_blocks = first_commit_blocks
+        self.max_commit_blocks = max_commit_blocks
+        # Rows from the previous embedding space, kept until the configured one covers every file
+        self.previous_df = None
+        # Ids of stored rows in neither embedding space, deleted by the next write
+        self.stale_rows = pd.Index([], dtype="int64")
+        # Rewrite the index as one file when enough segments have piled up; otherwise that's left to `compact`
+        self.auto_compact = auto_compact
+        # Store each block's file checksum and byte range instead of its code, which is read back when needed
+        self.code_by_reference = code_by_reference
 
+        # The state of the stored index `code_df` reflects, to notice writes by other processes
+        self.loaded_state = None
+        self._convert_legacy_index()
         self.code_df = self.load_code_dataframe()
+        # Indexed lookups of stored rows; pickled indexes are only ever scanned
+        self.catalog = (
+            None
+            if is_legacy_index(self.output_filepath)
+            else IndexCatalog(self.output_filepath)
+        )
         self.directory_extractor = CodeDirectoryExtractor(
-            self.root_directory, self.output_filepath, self.code_df
+            self.root_directory,
+            self.output_filepath,
+            self.code_df,
+            self.catalog,
+            self.openai_service.embedding_provider,
         )
 
     def display_directory_structure(self):
@@ -51,14 +141,34 @@ class CodeManager:
 
         return "\n".join(structured_output)
 
+    def _convert_legacy_index(self):
+        """Convert a pickled index from older versions next to the index, unless the index already exists."""
+        legacy_filepath = self.output_filepath.with_suffix(LEGACY_INDEX_SUFFIX)
+        if (
+            self.output_filepath.exists()
+            or is_legacy_index(self.output_filepath)
+            or not legacy_filepath.exists()
+        ):
+            return
+        with IndexLock(self.output_filepath):
+            # Another process may have converted it while we waited for the lock
+            if self.output_filepath.exists():
+                return
+            try:
+                convert_legacy_index(legacy_filepath, self.output_filepath)
+            except Exception as e:
+                logger.error(f"Failed to convert {legacy_filepath}: {e}")
+
     def load_code_dataframe(self):
+        self.previous_df = None
+        self.stale_rows = pd.Index([], dtype="int64")
+        # Read before the index, so a write that lands in between is picked up the next time
+        self.loaded_state = index_state(self.output_filepath)
         if not self.output_filepath.exists():
             return None
 
         try:
-            with open(self.output_filepath, "rb") as file:
-                loaded_data = pickle.load(file)
-            df = pd.DataFrame(loaded_data)
+            df = read_index(self.output_filepath)
         except Exception as e:
             logger.error(
                 f"Failed to repogpt generated data for this repo. Try a hard reset by deleting your `.repo_gpt` "
@@ -67,40 +177,254 @@ class CodeManager:
             return None
 
         # TODO: move this logic into one place where we decide if the particular file's data needs to be rewritten
-        if (
-            "embedding_model" not in df.columns
-            or not df["embedding_model"].eq(EMBEDDING_MODEL).all()
-        ):
-            return None
+        mismatch = embedding_space_mismatch(df, self.openai_service.embedding_provider)
+        if mismatch is None:
+            return df
 
-        return df
+        # Keep the old vectors searchable while the code is re-embedded, and switch over once it all has been
+        spaces = split_embedding_spaces(df, self.openai_service)
+        self.previous_df = spaces.previous
+        # Rows in neither space are deleted from the stored index with the first change
+        kept_rows = df.index[:0]
+        for space in (spaces.current, spaces.previous):
+            if space is not None:
+                kept_rows = kept_rows.append(space.index)
+        self.stale_rows = df.index.difference(kept_rows)
+        if spaces.migrating:
+            logger.verbose_info(
+                f"Existing index was built with {mismatch}; re-embedding all code while searches use the "
+                f"existing {spaces.previous_provider.model} embeddings"
+            )
+        else:
+            logger.verbose_info(
+                f"Existing index was built with {mismatch}; re-embedding all code"
+            )
+        return spaces.current
+
+    @contextmanager
+    def _writing(self, wait: bool = True):
+        """
+        Hold the index's write lock, so no other process embeds or writes at the same time, and catch up with what
+        other writers committed since the index was loaded. Without `wait`, raise `IndexLockedError` rather than
+        wait for another writer to finish.
+        """
+        lock = IndexLock(self.output_filepath)
+        if not lock.acquire(blocking=False):
+            message = (
+                f"Another repo-gpt process (pid {lock.holder()}) is updating the index"
+            )
+            if not wait:
+                raise IndexLockedError(message)
+            logger.verbose_info(f"{message}; waiting for it to finish")
+            lock.acquire()
+        try:
+            remove_interrupted_writes(self.output_filepath)
+            if index_state(self.output_filepath) != self.loaded_state:
+                self.code_df = self.load_code_dataframe()
+                self.directory_extractor.code_df = self.code_df
+            yield
+        finally:
+            lock.release()
 
-    def setup(self):
-        self._extract_process_and_save_code()
+    def setup(self, max_commits: int = None, wait: bool = True) -> bool:
+        """
+        Embed new and changed code, committing the index in increments. With `max_commits`, stop after that many
+        commits; returns whether the index is complete. Only one process sets up an index at a time: without `wait`,
+        raise `IndexLockedError` if another one is.
+        """
+        with self._writing(wait):
+            complete = self._extract_process_and_save_code(max_commits)
 
-        logger.verbose_info("All done! ✨ 🦄 ✨")
+        if complete:
+            logger.verbose_info("All done! ✨ 🦄 ✨")
+        return complete
 
-    def _store_code_dataframe(self, dataframe):
+    def dry_run(
+        self,
+        requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+        directory_depth: int = DEFAULT_DIRECTORY_DEPTH,
+    ) -> SetupEstimate:
+        """Scan, detect changes, extract and tokenise like `setup`, but only estimate the embedding work."""
+        (
+            extracted_code_blocks,
+            _,
+        ) = self.directory_extractor.extract_code_blocks_from_files()
+        estimate = self.code_processor.estimate(
+            extracted_code_blocks,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            directory_depth=directory_depth,
+        )
+        print_setup_estimate(estimate)
+        return estimate
+
+    def batch_export(self, requests_filepath: Union[Path, str]) -> int:
+        """Write the embedding inputs setup would send as an OpenAI Batch API input file instead of calling the API."""
+        (
+            extracted_code_blocks,
+            _,
+        ) = self.directory_extractor.extract_code_blocks_from_files()
+        num_requests = self.code_processor.export_batch(
+            extracted_code_blocks, requests_filepath
+        )
+        logger.verbose_info(
+            f"Wrote {num_requests} embedding requests to {requests_filepath}. Once the batch job has finished, run "
+            f"`repo-gpt setup --batch-ingest <results file>`"
+        )
+        return num_requests
+
+    def batch_ingest(self, results_filepath: Union[Path, str]) -> BatchIngestReport:
+        """Merge the results of a batch job created by `batch_export` into the index."""
+        with self._writing():
+            (
+                extracted_code_blocks,
+                _,
+            ) = self.directory_extractor.extract_code_blocks_from_files()
+            processed_dataframe, report = self.code_processor.ingest_batch(
+                extracted_code_blocks, read_batch_results(results_filepath)
+            )
+            if processed_dataframe is not None:
+                # Files left out as incomplete keep their old rows until a later setup or ingest replaces them
+                self._merge_and_store(
+                    processed_dataframe,
+                    outdated_checksums=(),
+                    filepaths=set(processed_dataframe["filepath"]),
+                )
+
+        if report.missing or report.failed:
+            logger.warning(str(report))
+        else:
+            logger.verbose_info(str(report))
+        return report
+
+    def _merge_and_store(self, processed_dataframe, outdated_checksums, filepaths=()):
+        """
+        Replace the rows of `filepaths` and of `outdated_checksums` with `processed_dataframe`. The change is
+        appended to the stored index as a segment, which is compacted once enough have piled up.
+        """
+        if self.code_by_reference and processed_dataframe is not None:
+            processed_dataframe = store_code_by_reference(
+                processed_dataframe, SourceStore(self.output_filepath)
+            )
+        updated_df = self.code_df
+        if not can_append_segments(self.output_filepath):
+            if updated_df is not None:
+                # Remove checksums of updated code
+                updated_df = updated_df[
+                    ~updated_df["file_checksum"].isin(outdated_checksums)
+                    & ~updated_df["filepath"].isin(filepaths)
+                ]
+            self.code_df = _concat_rows(updated_df, processed_dataframe)
+            if self.code_df is not None:
+                self._store_code_dataframe()
+            return
+
+        deleted_rows = self.stale_rows.append(
+            self.catalog.rows_for_files(
+                filepaths, outdated_checksums, self.openai_service.embedding_provider
+            )
+        )
+        processed_dataframe = append_index_segment(
+            self.output_filepath, processed_dataframe, deleted_rows
+        )
+        self.stale_rows = pd.Index([], dtype="int64")
+        if updated_df is not None:
+            updated_df = updated_df.drop(deleted_rows, errors="ignore")
+        self.code_df = _concat_rows(updated_df, processed_dataframe)
+        if self.auto_compact and index_needs_compaction(self.output_filepath):
+            logger.verbose_info("Compacting the index")
+            self._store_code_dataframe()
+
+    def _store_code_dataframe(self):
+        """
+        Write the index in full: the previous embedding space's rows while a re-embedding is in progress, then the
+        current ones. Rows are renumbered by their new positions.
+        """
         output_directory = Path(self.output_filepath).parent
 
         if not output_directory.exists():
             output_directory.mkdir(parents=True)
             print(f"Directory created: {output_directory}")
 
-        # Save DataFrame as a pickle file
-        with open(self.output_filepath, "wb") as file:
-            pickle.dump(dataframe, file)
+        previous_rows = 0 if self.previous_df is None else len(self.previous_df)
+        dataframe = pd.concat([self.previous_df, self.code_df], ignore_index=True)
+        if self.code_by_reference:
+            # Also moves the code of rows written before, while their files are unchanged, out of the index
+            dataframe = store_code_by_reference(
+                dataframe, SourceStore(self.output_filepath)
+            )
+        write_index(dataframe, self.output_filepath)
+        self.stale_rows = pd.Index([], dtype="int64")
+        if self.previous_df is not None:
+            self.previous_df = dataframe.iloc[:previous_rows]
+        self.code_df = dataframe.iloc[previous_rows:]
 
-    def _extract_process_and_save_code(self):
+    def _extract_process_and_save_code(self, max_commits: int = None) -> bool:
         (
             extracted_code_blocks,
             outdated_checksums,
         ) = self.directory_extractor.extract_code_blocks_from_files()
-        processed_dataframe = self.code_processor.process(extracted_code_blocks)
+        provider = self.openai_service.embedding_provider
+        checkpoint = EmbeddingCheckpoint(
+            self.checkpoint_filepath,
+            provider.model,
+            provider.dimensions,
+            every_blocks=self.checkpoint_every_blocks,
+            every_seconds=self.checkpoint_every_seconds,
+        )
 
-        updated_df = pd.concat([self.code_df, processed_dataframe], ignore_index=True)
+        total_blocks = len(extracted_code_blocks)
+        indexed_blocks = 0
+        commits = 0
+        for increment in self._commit_increments(extracted_code_blocks):
+            if max_commits is not None and commits >= max_commits:
+                return False
+            processed_dataframe = self.code_processor.process(increment, checkpoint)
+            self._merge_and_store(
+                processed_dataframe,
+                outdated_checksums=(),
+                filepaths={block.filepath for block in increment},
+            )
+            indexed_blocks += len(increment)
+            commits += 1
+            if indexed_blocks < total_blocks:
+                self.progress.update(indexed_blocks, total_blocks)
+                logger.verbose_info(
+                    f"Committed {indexed_blocks}/{total_blocks} blocks to the index"
+                )
+
+        # Changed files that no longer have any blocks
+        if outdated_checksums and self.code_df is not None:
+            self._merge_and_store(None, outdated_checksums)
+        if self.previous_df is not None:
+            # Every file now has vectors in the configured embedding space: drop the old ones in a single write
+            self.previous_df = None
+            if self.code_df is not None:
+                self._store_code_dataframe()
+            logger.verbose_info(
+                f"Switched the index to {self.openai_service.embedding_provider.model} embeddings"
+            )
+        self.progress.clear()
+        checkpoint.clear()
+        return True
 
-        # Remove checksums of updated code
-        updated_df = updated_df[~updated_df["file_checksum"].isin(outdated_checksums)]
+    def _commit_increments(self, code_blocks: List[ParsedCode]):
+        """
+        Yield the blocks in priority order, in whole-file increments that start small, so something is searchable
+        quickly, and double up to `max_commit_blocks` so rewriting the index stays a small share of the work.
+        """
+        blocks_by_file = defaultdict(list)
+        for block in code_blocks:
+            blocks_by_file[Path(block.filepath)].append(block)
 
-        self._store_code_dataframe(updated_df)
+        increment = []
+        increment_size = self.first_commit_blocks
+        for filepath in prioritise_files(self.root_directory, blocks_by_file):
+            increment.extend(blocks_by_file[filepath])
+            if len(increment) >= increment_size:
+                yield increment
+                increment = []
+                increment_size = min(increment_size * 2, self.max_commit_blocks)
+        if increment:
+            yield increment
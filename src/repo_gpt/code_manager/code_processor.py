@@ -1,58 +1,516 @@
+import dataclasses
 import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import islice
-from typing import List
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
-import tiktoken
 from tqdm.auto import tqdm
 
 from ..console import verbose_print
+from ..embedding_cache import text_sha256
+from ..embedding_provider import EmbeddingProvider
 from ..file_handler.abstract_handler import ParsedCode
-from ..openai_service import OpenAIService, tokens_from_string
+from ..openai_service import OpenAIEmbeddingProvider, OpenAIService, tokens_from_string
+from .abstract_extractor import AbstractCodeExtractor
+from .embedding_batch_job import (
+    BatchIngestReport,
+    BatchResults,
+    batch_request,
+    batch_request_id,
+    result_embedding,
+    write_batch_requests,
+)
+from .embedding_batcher import (
+    EmbeddingBatch,
+    EmbeddingInput,
+    pack_embedding_inputs,
+    packing_report,
+)
+from .embedding_checkpoint import EmbeddingCheckpoint
+from .setup_estimator import (
+    DEFAULT_DIRECTORY_DEPTH,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    DEFAULT_TOKENS_PER_MINUTE,
+    SetupEstimate,
+    directory_key,
+)
 
 logger = logging.getLogger(__name__)
 
+# Blocks longer than this are embedded as overlapping windows, each stored as a sub-row of the block
+WINDOW_TOKENS = 2048
+WINDOW_OVERLAP_TOKENS = 256
+# `window_index` of the row holding a whole block, as opposed to one of its windows
+BLOCK_WINDOW_INDEX = -1
+
+
+def block_id(filepath, code: str) -> str:
+    """Links a block's row to the rows of its windows."""
+    return text_sha256(f"{filepath}\0{code}")
+
+
+def _normalise_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale each row of `matrix` to length 1 in place, leaving zero rows as they are."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
 
 class CodeProcessor:
-    def __init__(self, code_root, openai_service: OpenAIService = None):
+    def __init__(
+        self,
+        code_root,
+        openai_service: OpenAIService = None,
+        window_tokens: int = WINDOW_TOKENS,
+        window_overlap_tokens: int = WINDOW_OVERLAP_TOKENS,
+    ):
         # Todo: add code root
         self.code_root = code_root
         self.openai_service = openai_service if openai_service else OpenAIService()
+        self.window_tokens = window_tokens
+        self.window_overlap_tokens = window_overlap_tokens
+
+    @property
+    def embedding_provider(self) -> EmbeddingProvider:
+        return self.openai_service.embedding_provider
 
-    def process(self, code_blocks: List[ParsedCode]):
+    def process(
+        self,
+        code_blocks: List[ParsedCode],
+        checkpoint: Optional[EmbeddingCheckpoint] = None,
+    ):
         if len(code_blocks) == 0:
             logger.verbose_info("No code blocks to process")
             return None
+        provider = self.embedding_provider
         df = pd.DataFrame(code_blocks)
         logger.verbose_info(
-            f"Generating openai embeddings for {len(df)} code blocks. This may take a while because of rate limiting..."
-        )
-
-        def len_safe_get_embedding(text):
-            max_tokens = 8191
-            encoding_name = "cl100k_base"
-
-            chunk_embeddings = []
-            chunk_lens = []
-            for chunk in CodeProcessor._chunked_tokens(
-                text, encoding_name=encoding_name, chunk_length=max_tokens
-            ):
-                chunk_embeddings.append(self.openai_service.get_embedding(chunk))
-                chunk_lens.append(len(chunk))
-
-            chunk_embedding = np.average(chunk_embeddings, axis=0, weights=chunk_lens)
-            return chunk_embedding / np.linalg.norm(
-                chunk_embedding
-            )  # normalizes length to 1
-
-        if logger.getEffectiveLevel() < logging.INFO:
-            tqdm.pandas(desc="Processing")
-            df["code_embedding"] = df["code"].progress_apply(len_safe_get_embedding)
-        else:
-            df["code_embedding"] = df["code"].apply(len_safe_get_embedding)
+            f"Generating {provider.name} embeddings for {len(df)} code blocks. This may take a while because of rate limiting..."
+        )
+
+        codes = df["code"].tolist()
+        cache = self.openai_service.embedding_cache
+        embedding_inputs = self._plan_embedding_inputs(codes, provider.tokenize(codes))
+        embeddings = self._cached_embeddings(embedding_inputs)
+
+        if checkpoint is not None:
+            recovered = 0
+            for embedding_input in self._pending_inputs(embedding_inputs, embeddings):
+                embedding = checkpoint.get(embedding_input.key)
+                if embedding is not None:
+                    embeddings[embedding_input.key] = embedding
+                    recovered += 1
+            if recovered:
+                logger.verbose_info(
+                    f"♻️  Recovered {recovered}/{len(embedding_inputs)} inputs from the checkpoint of an interrupted run"
+                )
+
+        pending_inputs = self._pending_inputs(embedding_inputs, embeddings)
+        num_duplicates = sum(
+            embedding_input.key not in embeddings
+            for embedding_input in embedding_inputs
+        ) - len(pending_inputs)
+        if num_duplicates:
+            logger.verbose_info(
+                f"Coalesced {num_duplicates} duplicate inputs into the requests for identical code"
+            )
+
+        try:
+            for batch_embeddings in self._embed_inputs(pending_inputs):
+                embeddings.update(batch_embeddings)
+                if cache is not None:
+                    # One cache write per request rather than per input
+                    cache.put_many(
+                        provider.model,
+                        provider.dimensions,
+                        batch_embeddings.items(),
+                    )
+                if checkpoint is not None:
+                    for key, embedding in batch_embeddings.items():
+                        checkpoint.add(key, embedding)
+        finally:
+            if checkpoint is not None:
+                checkpoint.save()
+
+        if cache is not None:
+            logger.verbose_info(f"Embedding cache: {cache.stats()}")
+
+        return self._with_embeddings(df, embedding_inputs, embeddings)
+
+    def _cached_embeddings(
+        self, embedding_inputs: List[EmbeddingInput]
+    ) -> Dict[str, np.ndarray]:
+        """Embeddings of the inputs that are already in the embedding cache, by input key."""
+        provider = self.embedding_provider
+        cache = self.openai_service.embedding_cache
+        if cache is None:
+            return {}
+        keys = list({embedding_input.key: None for embedding_input in embedding_inputs})
+        embeddings = {
+            key: embedding
+            for key, embedding in zip(
+                keys, cache.get_many(provider.model, provider.dimensions, keys)
+            )
+            if embedding is not None
+        }
+        if embeddings:
+            logger.verbose_info(f"Reusing {len(embeddings)} cached embeddings")
+        return embeddings
+
+    @staticmethod
+    def _pending_inputs(
+        embedding_inputs: List[EmbeddingInput], embeddings: Dict[str, np.ndarray]
+    ) -> List[EmbeddingInput]:
+        """Inputs without an embedding yet, each distinct key once so duplicated blocks are embedded once."""
+        return list(
+            {
+                embedding_input.key: embedding_input
+                for embedding_input in embedding_inputs
+                if embedding_input.key not in embeddings
+            }.values()
+        )
+
+    def _with_embeddings(
+        self,
+        df: pd.DataFrame,
+        embedding_inputs: List[EmbeddingInput],
+        embeddings: Dict[str, np.ndarray],
+    ) -> pd.DataFrame:
+        """
+        Attach one normalised embedding per block to `df`, and append a sub-row per window of each windowed block.
+        A windowed block's own embedding is the token-weighted average of its windows, so every row stays
+        searchable on its own.
+        """
+        provider = self.embedding_provider
+        dimensions = (
+            len(embeddings[embedding_inputs[0].key])
+            if embedding_inputs
+            else provider.output_dimensions or 0
+        )
+        # One contiguous (inputs x dimensions) matrix, so averaging and normalising are a few whole-array passes
+        chunk_matrix = np.zeros((len(embedding_inputs), dimensions), dtype=np.float32)
+        for row, embedding_input in enumerate(embedding_inputs):
+            chunk_matrix[row] = embeddings[embedding_input.key]
+        block_indices = np.fromiter(
+            (embedding_input.block_index for embedding_input in embedding_inputs),
+            dtype=np.int64,
+            count=len(embedding_inputs),
+        )
+        chunk_tokens = np.fromiter(
+            (embedding_input.num_tokens for embedding_input in embedding_inputs),
+            dtype=np.float32,
+            count=len(embedding_inputs),
+        )
+        block_matrix = self._combine_chunks(
+            chunk_matrix, block_indices, chunk_tokens, len(df)
+        )
+
+        df["block_id"] = [
+            block_id(filepath, code)
+            for filepath, code in zip(df["filepath"], df["code"])
+        ]
+        df["window_index"] = BLOCK_WINDOW_INDEX
+        # Rows are views into the matrix rather than separately allocated vectors
+        df["code_embedding"] = list(block_matrix)
+
+        inputs_per_block = np.bincount(block_indices, minlength=len(df))
+        is_window = inputs_per_block[block_indices] > 1
+        if is_window.any():
+            window_matrix = _normalise_rows(chunk_matrix[is_window])
+            window_blocks = df.iloc[block_indices[is_window]]
+            window_df = pd.DataFrame(
+                {
+                    "filepath": window_blocks["filepath"].to_numpy(),
+                    "file_checksum": window_blocks["file_checksum"].to_numpy(),
+                    "block_id": window_blocks["block_id"].to_numpy(),
+                    "window_index": [
+                        embedding_input.window_index
+                        for embedding_input, windowed in zip(
+                            embedding_inputs, is_window
+                        )
+                        if windowed
+                    ],
+                    "code_embedding": list(window_matrix),
+                }
+            )
+            df = pd.concat([df, window_df], ignore_index=True)
+
+        # Tag every vector with what produced it, so indexes never mix embedding spaces
+        df["embedding_provider"] = provider.name
+        df["embedding_model"] = provider.model
+        df["embedding_dimensions"] = dimensions
         return df
 
+    def export_batch(
+        self, code_blocks: List[ParsedCode], path: Union[Path, str]
+    ) -> int:
+        """
+        Write every embedding input not already cached to `path`, as requests for the OpenAI Batch API, and return
+        how many were written. Each input's ID is derived from its block's content, so `ingest_batch` can match
+        results to blocks even after a re-extraction.
+        """
+        provider = self.embedding_provider
+        if not isinstance(provider, OpenAIEmbeddingProvider):
+            raise ValueError(
+                f"Batch export needs the {OpenAIEmbeddingProvider.name} embedding provider, not {provider.name}"
+            )
+
+        codes = [block.code for block in code_blocks]
+        embedding_inputs = self._plan_embedding_inputs(codes, provider.tokenize(codes))
+        pending_inputs = self._pending_inputs(
+            embedding_inputs, self._cached_embeddings(embedding_inputs)
+        )
+        return write_batch_requests(
+            path,
+            (
+                batch_request(
+                    batch_request_id(
+                        codes[embedding_input.block_index], embedding_input.window_index
+                    ),
+                    provider.request_params([embedding_input.tokens]),
+                )
+                for embedding_input in pending_inputs
+            ),
+        )
+
+    def ingest_batch(
+        self, code_blocks: List[ParsedCode], results: BatchResults
+    ) -> Tuple[Optional[pd.DataFrame], BatchIngestReport]:
+        """
+        Build index rows for `code_blocks` from cached embeddings and the results of a batch job created by
+        `export_batch`. Files with any block whose embedding is missing or failed are left out entirely, so the next
+        setup or export picks them up again.
+        """
+        report = BatchIngestReport(num_blocks=len(code_blocks))
+        if not code_blocks:
+            return None, report
+
+        provider = self.embedding_provider
+        cache = self.openai_service.embedding_cache
+        df = pd.DataFrame(code_blocks)
+        codes = df["code"].tolist()
+        embedding_inputs = self._plan_embedding_inputs(codes, provider.tokenize(codes))
+        embeddings = self._cached_embeddings(embedding_inputs)
+
+        ingested = {}
+        for embedding_input in self._pending_inputs(embedding_inputs, embeddings):
+            embedding = result_embedding(
+                batch_request_id(
+                    codes[embedding_input.block_index], embedding_input.window_index
+                ),
+                results,
+                report,
+            )
+            if embedding is not None:
+                ingested[embedding_input.key] = embedding
+        embeddings.update(ingested)
+        if cache is not None:
+            cache.put_many(provider.model, provider.dimensions, ingested.items())
+
+        complete = np.ones(len(df), dtype=bool)
+        for embedding_input in embedding_inputs:
+            if embedding_input.key not in embeddings:
+                complete[embedding_input.block_index] = False
+        report.num_embedded = int(complete.sum())
+        incomplete_files = set(df.loc[~complete, "filepath"])
+        report.skipped_files = sorted(str(filepath) for filepath in incomplete_files)
+
+        keep = ~df["filepath"].isin(incomplete_files).to_numpy()
+        if not keep.any():
+            return None, report
+        # Renumber the kept blocks' inputs to match the filtered frame
+        new_block_indices = np.cumsum(keep) - 1
+        kept_inputs = [
+            dataclasses.replace(
+                embedding_input,
+                block_index=int(new_block_indices[embedding_input.block_index]),
+            )
+            for embedding_input in embedding_inputs
+            if keep[embedding_input.block_index]
+        ]
+        return (
+            self._with_embeddings(
+                df[keep].reset_index(drop=True), kept_inputs, embeddings
+            ),
+            report,
+        )
+
+    @staticmethod
+    def _combine_chunks(
+        chunk_matrix: np.ndarray,
+        block_indices: np.ndarray,
+        chunk_tokens: np.ndarray,
+        num_blocks: int,
+    ) -> np.ndarray:
+        """
+        Average each block's chunk embeddings weighted by their token counts, normalised to length 1, as a
+        (num_blocks x dimensions) float32 matrix. Blocks without chunks get a zero row.
+        """
+        block_matrix = np.zeros((num_blocks, chunk_matrix.shape[1]), dtype=np.float32)
+        if len(chunk_matrix) == 0:
+            return block_matrix
+
+        # Weighted sums per block, added one chunk position at a time: the nth chunks of all blocks go to distinct
+        # rows, so each pass is a single gather and scatter. Dividing by the total weight is left out as
+        # normalising undoes it.
+        order = np.argsort(block_indices, kind="stable")
+        is_first = np.diff(block_indices[order], prepend=-1) != 0
+        segment_starts = np.flatnonzero(is_first)
+        positions = np.arange(len(order)) - segment_starts[np.cumsum(is_first) - 1]
+        for position in range(positions.max() + 1):
+            chunks = order[positions == position]
+            weighted = chunk_matrix[chunks] * chunk_tokens[chunks, np.newaxis]
+            if position == 0:
+                block_matrix[block_indices[chunks]] = weighted
+            else:
+                block_matrix[block_indices[chunks]] += weighted
+        return _normalise_rows(block_matrix)
+
+    def _embed_inputs(self, embedding_inputs: List[EmbeddingInput]):
+        """
+        Bin-pack the inputs into as few requests as the embedding limits allow and, as each request completes, yield
+        the embeddings of its inputs by input key.
+        """
+        if not embedding_inputs:
+            return
+
+        provider = self.embedding_provider
+        batches = pack_embedding_inputs(
+            embedding_inputs, provider.max_batch_tokens, provider.max_batch_inputs
+        )
+        logger.verbose_info(
+            str(
+                packing_report(
+                    batches, provider.max_batch_tokens, provider.max_batch_inputs
+                )
+            )
+        )
+        for batch, batch_embeddings in self._embed_concurrently(batches):
+            yield {
+                embedding_input.key: embedding
+                for embedding_input, embedding in zip(batch.inputs, batch_embeddings)
+            }
+
+    def _plan_embedding_inputs(
+        self,
+        codes: List[str],
+        tokens_per_block: List[Sequence[int]],
+    ) -> List[EmbeddingInput]:
+        """
+        Turn each block into embedding inputs: the whole block, or overlapping windows if it is longer than the
+        window size. Blocks without tokens get no input.
+        """
+        window_tokens = min(
+            self.window_tokens, self.embedding_provider.max_input_tokens
+        )
+        overlap_tokens = min(self.window_overlap_tokens, window_tokens // 2)
+        embedding_inputs = []
+        for block_index, (code, tokens) in enumerate(zip(codes, tokens_per_block)):
+            if len(tokens) == 0:
+                continue
+            if len(tokens) <= window_tokens:
+                embedding_inputs.append(EmbeddingInput(block_index, tokens, key=code))
+                continue
+            embedding_inputs.extend(
+                EmbeddingInput(
+                    block_index,
+                    window,
+                    window_index,
+                    # Window keys depend on the windowing so changing it never reuses stale windows
+                    key=f"{code}\0window {window_index}, {window_tokens} tokens, {overlap_tokens} overlap",
+                )
+                for window_index, window in enumerate(
+                    self._windowed_tokens(tokens, window_tokens, overlap_tokens)
+                )
+            )
+        return embedding_inputs
+
+    def estimate(
+        self,
+        code_blocks: List[ParsedCode],
+        requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+        directory_depth: int = DEFAULT_DIRECTORY_DEPTH,
+    ) -> SetupEstimate:
+        """
+        Work out what `process` would send to the API for these blocks, without sending anything. Blocks already
+        in the embedding cache are counted separately since they wouldn't be embedded again.
+        """
+        provider = self.embedding_provider
+        estimate = SetupEstimate(
+            embedding_model=provider.model,
+            price_per_million_tokens=provider.price_per_million_tokens,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        codes = [block.code for block in code_blocks]
+        embedding_inputs = self._plan_embedding_inputs(codes, provider.tokenize(codes))
+        pending_inputs = self._pending_inputs(
+            embedding_inputs, self._cached_embeddings(embedding_inputs)
+        )
+        tokens_to_embed = defaultdict(int)
+        for embedding_input in pending_inputs:
+            tokens_to_embed[embedding_input.block_index] += embedding_input.num_tokens
+        estimate.num_blocks = len(tokens_to_embed)
+        estimate.num_cached_blocks = len(
+            {embedding_input.block_index for embedding_input in embedding_inputs}
+            - set(tokens_to_embed)
+        )
+
+        for block_index, num_tokens in tokens_to_embed.items():
+            block = code_blocks[block_index]
+            language = AbstractCodeExtractor.get_language(block.filepath)
+            estimate.by_language[
+                language.value if language else Path(block.filepath).suffix
+            ].add(num_tokens)
+            estimate.by_directory[
+                directory_key(block.filepath, Path(self.code_root), directory_depth)
+            ].add(num_tokens)
+
+        estimate.num_tokens = sum(tokens_to_embed.values())
+        estimate.num_requests = len(
+            pack_embedding_inputs(
+                pending_inputs, provider.max_batch_tokens, provider.max_batch_inputs
+            )
+        )
+        return estimate
+
+    def _embed_concurrently(self, batches: List[EmbeddingBatch]):
+        """
+        Embed packed batches on a thread pool and yield (batch, embeddings) as they complete. The pool is sized to
+        the limiter's ceiling; the adaptive limiter decides how many of those workers actually have a request in
+        flight at any time.
+        """
+        limiter = self.openai_service.concurrency_limiter
+        executor = ThreadPoolExecutor(max_workers=limiter.max_limit)
+        try:
+            futures = {
+                executor.submit(
+                    self.embedding_provider.embed,
+                    [embedding_input.tokens for embedding_input in batch.inputs],
+                ): batch
+                for batch in batches
+            }
+            with tqdm(
+                total=sum(len(batch.inputs) for batch in batches),
+                desc="Processing",
+                disable=logger.getEffectiveLevel() >= logging.INFO,
+            ) as progress_bar:
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    yield batch, future.result()
+                    progress_bar.set_postfix(concurrency=limiter.limit, refresh=False)
+                    progress_bar.update(len(batch.inputs))
+        finally:
+            # On Ctrl-C or a failed request, drop the queued batches instead of sending them all first
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        logger.verbose_info(f"Effective embedding concurrency limit: {limiter.limit}")
+
     @staticmethod
     def _batched(iterable, n):
         """Batch data into tuples of length n. The last batch may be shorter."""
@@ -64,8 +522,11 @@ class CodeProcessor:
             yield batch
 
     @staticmethod
-    def _chunked_tokens(text, encoding_name, chunk_length):
-        encoding = tiktoken.get_encoding(encoding_name)
-        tokens = encoding.encode(text)
-        chunks_iterator = CodeProcessor._batched(tokens, chunk_length)
-        yield from chunks_iterator
+    def _windowed_tokens(tokens: Sequence[int], window_length: int, overlap: int):
+        """Overlapping windows covering `tokens`; consecutive windows share `overlap` tokens."""
+        # windowed('ABCDEFG', 4, 2) --> ABCD CDEF EFG
+        if overlap >= window_length:
+            raise ValueError("overlap must be shorter than the window")
+        stride = window_length - overlap
+        for start in range(0, max(len(tokens) - overlap, 1), stride):
+            yield tokens[start : start + window_length]
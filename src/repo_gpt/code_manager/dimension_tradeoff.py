@@ -0,0 +1,122 @@
+from dataclasses import dataclass
+from typing import Iterable, List
+
+import numpy as np
+from rich.table import Table
+
+from ..console import console
+
+DEFAULT_TRADEOFF_DIMENSIONS = (64, 128, 256, 512, 768, 1024)
+DEFAULT_RECALL_K = 10
+DEFAULT_NUM_QUERIES = 200
+
+
+@dataclass
+class DimensionTradeoff:
+    method: str
+    dimensions: int
+    k: int
+    recall: float
+    index_bytes: int
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def truncate_embeddings(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+    """
+    Keep the first `dimensions` components and renormalise. This is what the API's `dimensions` parameter does for
+    text-embedding-3 models, so it previews an index built with `--embedding_dimensions` without re-embedding.
+    """
+    return _normalize_rows(embeddings[:, :dimensions])
+
+
+def pca_rotate(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Rotate the embeddings onto their own principal components, ordered by explained variance, so truncating the
+    result keeps the most informative directions.
+    """
+    centered = embeddings - embeddings.mean(axis=0)
+    _, _, components = np.linalg.svd(centered, full_matrices=False)
+    return centered @ components.T
+
+
+def _top_k(embeddings: np.ndarray, query_indices: np.ndarray, k: int) -> np.ndarray:
+    similarities = embeddings[query_indices] @ embeddings.T
+    # A block is always its own nearest neighbour, which would inflate recall
+    similarities[np.arange(len(query_indices)), query_indices] = -np.inf
+    return np.argpartition(-similarities, k, axis=1)[:, :k]
+
+
+def recall_at_k(
+    full: np.ndarray, reduced: np.ndarray, query_indices: np.ndarray, k: int
+) -> float:
+    """Fraction of each query's true top-k neighbours (in `full`) that are also its top-k in `reduced`."""
+    expected = _top_k(full, query_indices, k)
+    actual = _top_k(reduced, query_indices, k)
+    hits = sum(len(np.intersect1d(e, a)) for e, a in zip(expected, actual))
+    return hits / expected.size
+
+
+def measure_dimension_tradeoff(
+    embeddings: np.ndarray,
+    dimensions: Iterable[int] = DEFAULT_TRADEOFF_DIMENSIONS,
+    k: int = DEFAULT_RECALL_K,
+    num_queries: int = DEFAULT_NUM_QUERIES,
+    seed: int = 0,
+) -> List[DimensionTradeoff]:
+    """
+    Measure search recall and float32 index size when the index's embeddings are reduced to each of `dimensions`,
+    by truncation and by PCA. Sampled blocks act as queries and their neighbours at full dimension are the ground
+    truth, so no API calls are made.
+    """
+    embeddings = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    num_blocks, full_dimensions = embeddings.shape
+    k = min(k, num_blocks - 1)
+    if k < 1:
+        raise ValueError("Need at least two embedded blocks to measure recall")
+    query_indices = np.random.default_rng(seed).choice(
+        num_blocks, size=min(num_queries, num_blocks), replace=False
+    )
+
+    results = [
+        DimensionTradeoff("full", full_dimensions, k, 1.0, embeddings.nbytes),
+    ]
+    sources = {"truncate": embeddings, "pca": pca_rotate(embeddings)}
+    for d in sorted(set(dimensions)):
+        if d >= full_dimensions:
+            continue
+        for method, source in sources.items():
+            if d > source.shape[1]:
+                # PCA can't produce more components than there are blocks
+                continue
+            reduced = truncate_embeddings(source, d).astype(np.float32)
+            results.append(
+                DimensionTradeoff(
+                    method,
+                    d,
+                    k,
+                    recall_at_k(embeddings, reduced, query_indices, k),
+                    reduced.nbytes,
+                )
+            )
+    return results
+
+
+def print_dimension_tradeoff(results: List[DimensionTradeoff]):
+    k = results[0].k
+    table = Table(title=f"Recall@{k} against full-dimension search")
+    table.add_column("Method")
+    table.add_column("Dimensions", justify="right")
+    table.add_column(f"Recall@{k}", justify="right")
+    table.add_column("Embeddings size", justify="right")
+    for result in results:
+        table.add_row(
+            result.method,
+            f"{result.dimensions:,}",
+            f"{result.recall:.1%}",
+            f"{result.index_bytes / 1024 / 1024:,.2f} MB",
+        )
+    console.print(table)
@@ -0,0 +1,128 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from ..embedding_cache import text_sha256
+from ..openai_service import decode_embedding
+
+logger = logging.getLogger(__name__)
+
+BATCH_EMBEDDINGS_URL = "/v1/embeddings"
+
+
+def batch_request_id(code: str, window_index: int) -> str:
+    """
+    Identify one embedding input by the content of its block and its position among the block's windows, so the
+    same pending block gets the same ID however often it is exported.
+    """
+    return f"{text_sha256(code)}-{window_index}"
+
+
+def batch_request(request_id: str, body: dict) -> dict:
+    """One line of an OpenAI Batch API input file."""
+    return {
+        "custom_id": request_id,
+        "method": "POST",
+        "url": BATCH_EMBEDDINGS_URL,
+        "body": body,
+    }
+
+
+def write_batch_requests(path: Union[Path, str], requests: Iterable[dict]) -> int:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(path, "w") as file:
+        for request in requests:
+            file.write(json.dumps(request))
+            file.write("\n")
+            count += 1
+    return count
+
+
+@dataclass
+class BatchResults:
+    embeddings: Dict[str, np.ndarray] = field(default_factory=dict)
+    # request id -> why it has no embedding
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+def read_batch_results(path: Union[Path, str]) -> BatchResults:
+    """
+    Read an OpenAI Batch API output (or error) file of embedding responses. Lines that can't be parsed are logged
+    and skipped; requests that failed are recorded in `errors`.
+    """
+    results = BatchResults()
+    with open(path) as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+                request_id = result["custom_id"]
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping unreadable line {line_number} of {path}: {e}")
+                continue
+
+            response = result.get("response") or {}
+            error = result.get("error")
+            if error or response.get("status_code") != 200:
+                body = response.get("body") or {}
+                error = error or body.get("error") or response.get("status_code")
+                results.errors[request_id] = (
+                    error.get("message", str(error))
+                    if isinstance(error, dict)
+                    else str(error)
+                )
+                continue
+
+            try:
+                results.embeddings[request_id] = decode_embedding(
+                    response["body"]["data"][0]["embedding"]
+                )
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                results.errors[request_id] = f"malformed response: {e}"
+    return results
+
+
+@dataclass
+class BatchIngestReport:
+    num_blocks: int = 0
+    num_embedded: int = 0
+    # request ids of pending blocks with no line in the results file
+    missing: List[str] = field(default_factory=list)
+    # request id -> error reported for it
+    failed: Dict[str, str] = field(default_factory=dict)
+    skipped_files: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        lines = [
+            f"Ingested embeddings for {self.num_embedded}/{self.num_blocks} pending blocks"
+        ]
+        if self.missing:
+            lines.append(f"{len(self.missing)} inputs missing from the results")
+        for request_id, error in sorted(self.failed.items()):
+            lines.append(f"{request_id} failed: {error}")
+        if self.skipped_files:
+            lines.append(
+                f"Left {len(self.skipped_files)} files out of the index until all their blocks are embedded: "
+                + ", ".join(self.skipped_files)
+            )
+        return "\n".join(lines)
+
+
+def result_embedding(
+    request_id: str, results: BatchResults, report: BatchIngestReport
+) -> Optional[np.ndarray]:
+    """Look up one input's embedding, recording it in the report if it is missing or failed."""
+    if request_id in results.embeddings:
+        return results.embeddings[request_id]
+    if request_id in results.errors:
+        report.failed[request_id] = results.errors[request_id]
+    else:
+        report.missing.append(request_id)
+    return None
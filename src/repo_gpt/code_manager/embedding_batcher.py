@@ -0,0 +1,102 @@
+import math
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+
+@dataclass(frozen=True)
+class EmbeddingInput:
+    block_index: int
+    tokens: Sequence[int]
+    # Position among the overlapping windows of an oversized block, 0 for blocks embedded whole
+    window_index: int = 0
+    # Identifies the input in the embedding cache, the checkpoint and batch job files
+    key: str = ""
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.tokens)
+
+
+@dataclass
+class EmbeddingBatch:
+    inputs: List[EmbeddingInput] = field(default_factory=list)
+    num_tokens: int = 0
+
+    def add(self, embedding_input: EmbeddingInput):
+        self.inputs.append(embedding_input)
+        self.num_tokens += embedding_input.num_tokens
+
+
+@dataclass(frozen=True)
+class PackingReport:
+    num_inputs: int
+    num_tokens: int
+    num_requests: int
+    min_requests: int
+    max_batch_tokens: int
+
+    @property
+    def fill_ratio(self) -> float:
+        """Average fraction of the per-request token ceiling used."""
+        if self.num_requests == 0:
+            return 0.0
+        return self.num_tokens / (self.num_requests * self.max_batch_tokens)
+
+    @property
+    def efficiency(self) -> float:
+        """How close the packing is to the fewest possible requests (1.0 is optimal)."""
+        if self.num_requests == 0:
+            return 1.0
+        return self.min_requests / self.num_requests
+
+    def __str__(self):
+        return (
+            f"Packed {self.num_inputs} inputs ({self.num_tokens} tokens) into {self.num_requests} requests: "
+            f"{self.fill_ratio:.1%} of the per-request token ceiling filled on average, "
+            f"{self.efficiency:.0%} packing efficiency (at least {self.min_requests} requests needed)"
+        )
+
+
+def pack_embedding_inputs(
+    inputs: List[EmbeddingInput], max_batch_tokens: int, max_batch_inputs: int
+) -> List[EmbeddingBatch]:
+    """
+    Bin-pack inputs into as few embedding requests as possible using first-fit decreasing.
+
+    Every input must already fit in a single request, i.e. oversized blocks have to be chunked beforehand.
+    """
+    batches: List[EmbeddingBatch] = []
+    for embedding_input in sorted(inputs, key=lambda i: i.num_tokens, reverse=True):
+        if embedding_input.num_tokens > max_batch_tokens:
+            raise ValueError(
+                f"Input with {embedding_input.num_tokens} tokens exceeds the {max_batch_tokens} token request limit"
+            )
+        for batch in batches:
+            if (
+                len(batch.inputs) < max_batch_inputs
+                and batch.num_tokens + embedding_input.num_tokens <= max_batch_tokens
+            ):
+                batch.add(embedding_input)
+                break
+        else:
+            batch = EmbeddingBatch()
+            batch.add(embedding_input)
+            batches.append(batch)
+    return batches
+
+
+def packing_report(
+    batches: List[EmbeddingBatch], max_batch_tokens: int, max_batch_inputs: int
+) -> PackingReport:
+    num_inputs = sum(len(batch.inputs) for batch in batches)
+    num_tokens = sum(batch.num_tokens for batch in batches)
+    return PackingReport(
+        num_inputs=num_inputs,
+        num_tokens=num_tokens,
+        num_requests=len(batches),
+        min_requests=max(
+            math.ceil(num_tokens / max_batch_tokens),
+            math.ceil(num_inputs / max_batch_inputs),
+        ),
+        max_batch_tokens=max_batch_tokens,
+    )
@@ -0,0 +1,137 @@
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from ..embedding_cache import text_sha256
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_EVERY_BLOCKS = 500
+CHECKPOINT_EVERY_SECONDS = 30.0
+
+
+class EmbeddingCheckpoint:
+    """
+    Block embeddings from an in-progress `setup`, saved to disk every `every_blocks` blocks or `every_seconds`
+    seconds, whichever comes first.
+
+    If the run dies before the index is written, the next run finds the checkpoint and reuses every block embedded
+    so far instead of starting over. The checkpoint is deleted once the index has been stored.
+
+    The file is a stream of pickled frames: a header naming the embedding model, followed by one frame per save
+    holding only the embeddings added since the previous save, so checkpointing cost stays proportional to the new
+    work. A frame truncated by a crash mid-write is ignored on load.
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, str],
+        embedding_model: str,
+        embedding_dimensions: Optional[int] = None,
+        every_blocks: int = CHECKPOINT_EVERY_BLOCKS,
+        every_seconds: float = CHECKPOINT_EVERY_SECONDS,
+    ):
+        self.path = Path(path)
+        self.embedding_model = embedding_model
+        self.embedding_dimensions = embedding_dimensions
+        self.every_blocks = every_blocks
+        self.every_seconds = every_seconds
+
+        # Set when the file on disk can't simply be appended to: stale, unreadable or ending in a torn frame
+        self._needs_rewrite = False
+        self._embeddings: Dict[str, np.ndarray] = self._load()
+        self._unsaved: Dict[str, np.ndarray] = {}
+        self._last_saved = time.monotonic()
+
+    def __len__(self):
+        return len(self._embeddings)
+
+    def _load(self) -> Dict[str, np.ndarray]:
+        if not self.path.exists():
+            return {}
+
+        embeddings = {}
+        with open(self.path, "rb") as file:
+            try:
+                header = pickle.load(file)
+            except Exception as e:
+                logger.warning(
+                    f"Ignoring unreadable embedding checkpoint {self.path}: {e}"
+                )
+                self._needs_rewrite = True
+                return {}
+
+            if header != self._header():
+                logger.verbose_info(
+                    "Ignoring embedding checkpoint created with a different embedding model"
+                )
+                self._needs_rewrite = True
+                return {}
+
+            while True:
+                try:
+                    embeddings.update(pickle.load(file))
+                except EOFError:
+                    break
+                except Exception:
+                    # The last frame was cut short by a crash; everything before it is intact
+                    self._needs_rewrite = True
+                    break
+        return embeddings
+
+    def _header(self) -> dict:
+        return {
+            "embedding_model": self.embedding_model,
+            "embedding_dimensions": self.embedding_dimensions,
+        }
+
+    def get(self, code: str) -> Optional[np.ndarray]:
+        return self._embeddings.get(text_sha256(code))
+
+    def add(self, code: str, embedding: np.ndarray):
+        key = text_sha256(code)
+        self._embeddings[key] = embedding
+        self._unsaved[key] = embedding
+        if (
+            len(self._unsaved) >= self.every_blocks
+            or time.monotonic() - self._last_saved >= self.every_seconds
+        ):
+            self.save()
+
+    def save(self):
+        if not self._unsaved:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self._needs_rewrite or not self.path.exists():
+            # Start a fresh file via a temporary file so a crash never leaves a half-written header behind
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, "wb") as file:
+                pickle.dump(self._header(), file)
+                pickle.dump(self._embeddings, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+            self._needs_rewrite = False
+        else:
+            with open(self.path, "ab") as file:
+                pickle.dump(self._unsaved, file)
+                file.flush()
+                os.fsync(file.fileno())
+
+        logger.debug(
+            f"Checkpointed {len(self._unsaved)} embeddings ({len(self._embeddings)} total) to {self.path}"
+        )
+        self._unsaved = {}
+        self._last_saved = time.monotonic()
+
+    def clear(self):
+        self._embeddings = {}
+        self._unsaved = {}
+        self._needs_rewrite = False
+        self.path.unlink(missing_ok=True)
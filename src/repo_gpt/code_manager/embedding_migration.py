@@ -0,0 +1,88 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+
+from ..embedding_provider import EmbeddingProvider, in_embedding_space
+from ..openai_service import OpenAIService, create_embedding_provider
+from .code_processor import BLOCK_WINDOW_INDEX
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SPACE_COLUMNS = [
+    "embedding_provider",
+    "embedding_model",
+    "embedding_dimensions",
+]
+
+
+@dataclass
+class IndexEmbeddingSpaces:
+    """
+    An index split by embedding space. While an index is re-embedded for a new provider, model or dimension, it holds
+    rows for both: `current` for the configured provider, possibly covering only some files, and `previous`, which
+    keeps serving searches, with the provider that can embed queries for it, until `current` covers every file.
+    """
+
+    current: Optional[pd.DataFrame]
+    previous: Optional[pd.DataFrame] = None
+    previous_provider: Optional[EmbeddingProvider] = None
+
+    @property
+    def migrating(self) -> bool:
+        return self.previous is not None
+
+    @property
+    def serving(self) -> Optional[pd.DataFrame]:
+        return self.previous if self.migrating else self.current
+
+
+def _num_files(df: Optional[pd.DataFrame]) -> int:
+    return 0 if df is None or df.empty else df["filepath"].nunique()
+
+
+def _num_blocks(df: pd.DataFrame) -> int:
+    if "window_index" not in df.columns:
+        return len(df)
+    return int(df["window_index"].fillna(BLOCK_WINDOW_INDEX).lt(0).sum())
+
+
+def split_embedding_spaces(
+    df: pd.DataFrame, openai_service: OpenAIService
+) -> IndexEmbeddingSpaces:
+    """
+    Split an index into rows for the configured provider and the most complete other embedding space that is still
+    worth searching. Rows in any other space, or in a space no provider can be created for (like indexes from
+    before the embedding model was recorded), are dropped.
+    """
+    is_current = in_embedding_space(df, openai_service.embedding_provider)
+    current = df[is_current] if is_current.any() else None
+    others = df[~is_current]
+    if others.empty or not set(EMBEDDING_SPACE_COLUMNS) <= set(others.columns):
+        return IndexEmbeddingSpaces(current)
+
+    spaces = others.dropna(subset=EMBEDDING_SPACE_COLUMNS[:2]).groupby(
+        EMBEDDING_SPACE_COLUMNS, dropna=False, observed=True
+    )
+    if not spaces.ngroups:
+        return IndexEmbeddingSpaces(current)
+    (name, model, dimensions), previous = max(
+        spaces, key=lambda space: _num_blocks(space[1])
+    )
+    if _num_files(previous) <= _num_files(current):
+        return IndexEmbeddingSpaces(current)
+
+    try:
+        # Ask for the model's native vectors the way the index was built, unless it holds shortened ones
+        previous_provider = create_embedding_provider(name, openai_service, model=model)
+        if not pd.isna(dimensions) and previous_provider.output_dimensions != int(
+            dimensions
+        ):
+            previous_provider = create_embedding_provider(
+                name, openai_service, int(dimensions), model
+            )
+    except ValueError as e:
+        logger.warning(f"Can't search the existing {model} embeddings: {e}")
+        return IndexEmbeddingSpaces(current)
+    return IndexEmbeddingSpaces(current, previous, previous_provider)
@@ -0,0 +1,287 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+from ..embedding_provider import LEGACY_INDEX_PROVIDER, EmbeddingProvider
+from .index_segments import segments_directory
+from .index_store import IndexSnapshot, index_write_id, read_index_file
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SUFFIX = ".sqlite3"
+# Block metadata copied into the catalog, each with an index of its own except the embedding space columns
+INDEXED_COLUMNS = [
+    "filepath",
+    "file_checksum",
+    "function_name",
+    "class_name",
+    "code_type",
+]
+EMBEDDING_SPACE_COLUMNS = [
+    "embedding_provider",
+    "embedding_model",
+    "embedding_dimensions",
+]
+CATALOG_COLUMNS = INDEXED_COLUMNS + EMBEDDING_SPACE_COLUMNS
+# Bumped when the way catalogs map onto their index changes, so older catalogs are rebuilt; 2 follows segments
+# moving to a directory per base file
+CATALOG_FORMAT = "2"
+# SQLite limits the number of parameters in one statement
+MAX_PARAMETERS = 500
+
+
+def catalog_path(index_path: Union[Path, str]) -> Path:
+    return Path(index_path).with_suffix(CATALOG_SUFFIX)
+
+
+def _sql_value(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, Path):
+        return str(value)
+    return getattr(value, "value", value)
+
+
+class IndexCatalog:
+    """
+    Block metadata of a Parquet index in SQLite, with indexes on file path, checksum, function name, class name and
+    code type, so lookups don't scan the index. Each block is keyed by its row id in the index, which references its
+    embedding and code there.
+
+    The catalog is derived from the index: once per lookup it catches up with the segments appended since it last
+    looked, in the version of the index pinned by the lookup's snapshot if given, and rebuilds itself once the index
+    has been rewritten in full. A catalog that is deleted, or left behind by a crash, is therefore never out of date.
+    """
+
+    def __init__(self, index_path: Union[Path, str]):
+        self.index_path = Path(index_path)
+        self.path = catalog_path(self.index_path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS blocks (
+                row_id INTEGER PRIMARY KEY,
+                filepath TEXT,
+                file_checksum TEXT,
+                function_name TEXT,
+                class_name TEXT,
+                code_type TEXT,
+                embedding_provider TEXT,
+                embedding_model TEXT,
+                embedding_dimensions INTEGER
+            )"""
+        )
+        for column in INDEXED_COLUMNS:
+            # Listing every file's checksum reads just the file path index
+            indexed = "filepath, file_checksum" if column == "filepath" else column
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS blocks_{column} ON blocks ({indexed})"
+            )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS catalog_state (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def close(self):
+        self._connection.close()
+
+    def index_version(self, snapshot: Optional[IndexSnapshot] = None) -> Optional[str]:
+        """Identifies the full write of the index, or of `snapshot`; row ids are stable until it changes."""
+        if not self.index_path.exists():
+            return None
+        write_id = (
+            snapshot.write_id
+            if snapshot is not None
+            else index_write_id(self.index_path)
+        )
+        if write_id is not None:
+            return write_id
+        # Indexes from before write ids were recorded
+        stat = self.index_path.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _state(self) -> Dict[str, str]:
+        return dict(
+            self._connection.execute("SELECT key, value FROM catalog_state").fetchall()
+        )
+
+    def _insert_rows(self, df: pd.DataFrame, first_row: int):
+        columns = [column for column in CATALOG_COLUMNS if column in df.columns]
+        values = [
+            [_sql_value(value) for value in row]
+            for row in df[columns].itertuples(index=False)
+        ]
+        self._connection.executemany(
+            f"INSERT OR REPLACE INTO blocks (row_id, {', '.join(columns)}) "
+            f"VALUES (?, {', '.join('?' * len(columns))})",
+            [(first_row + i, *row) for i, row in enumerate(values)],
+        )
+
+    def sync(self, snapshot: Optional[IndexSnapshot] = None) -> Optional[str]:
+        """
+        Bring the catalog up to date with the index, or with `snapshot` of it; returns the index version it now
+        reflects.
+        """
+        if snapshot is not None or not self.index_path.exists():
+            return self._sync(snapshot)
+        with IndexSnapshot(self.index_path) as snapshot:
+            return self._sync(snapshot)
+
+    def _sync(self, snapshot: Optional[IndexSnapshot]) -> Optional[str]:
+        version = self.index_version(snapshot)
+        manifest = None if snapshot is None else snapshot.manifest
+        with self._lock:
+            # Take the write lock first, so concurrent processes don't apply the same segment twice
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._state()
+                if (
+                    state.get("version") != version
+                    or state.get("format") != CATALOG_FORMAT
+                ):
+                    self._connection.execute("DELETE FROM blocks")
+                    if snapshot is not None:
+                        self._insert_rows(
+                            read_index_file(snapshot.base_path, CATALOG_COLUMNS), 0
+                        )
+                    state = {"version": version, "segments": "0"}
+
+                applied = int(state.get("segments", 0))
+                if manifest is not None and applied < len(manifest.segments):
+                    directory = segments_directory(self.index_path, snapshot.write_id)
+                    first_row = manifest.base_rows + sum(
+                        segment.rows for segment in manifest.segments[:applied]
+                    )
+                    for segment in manifest.segments[applied:]:
+                        if segment.name is not None:
+                            self._insert_rows(
+                                read_index_file(
+                                    directory / segment.name, CATALOG_COLUMNS
+                                ),
+                                first_row,
+                            )
+                        self._delete_rows(segment.tombstones)
+                        first_row += segment.rows
+                    applied = len(manifest.segments)
+
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO catalog_state VALUES (?, ?)",
+                    [
+                        ("version", version),
+                        ("segments", str(applied)),
+                        ("format", CATALOG_FORMAT),
+                    ],
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return version
+
+    def _delete_rows(self, rows: List[int]):
+        self._connection.executemany(
+            "DELETE FROM blocks WHERE row_id = ?", [(row,) for row in rows]
+        )
+
+    def _query(self, sql: str, parameters: Iterable = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, tuple(parameters)).fetchall()
+
+    @staticmethod
+    def _space_condition(provider: Optional[EmbeddingProvider]):
+        """SQL matching rows whose vectors queries from `provider` can be compared against, like `in_embedding_space`."""
+        if provider is None:
+            return "1", []
+        condition = "COALESCE(embedding_provider, ?) = ? AND embedding_model = ?"
+        parameters = [LEGACY_INDEX_PROVIDER, provider.name, provider.model]
+        if provider.output_dimensions is not None:
+            # Older rows always hold the model's native dimension
+            condition += " AND (embedding_dimensions = ? OR (embedding_dimensions IS NULL AND ?))"
+            parameters += [provider.output_dimensions, provider.dimensions is None]
+        return condition, parameters
+
+    def _rows_where(
+        self,
+        column: str,
+        values: Iterable,
+        provider: Optional[EmbeddingProvider] = None,
+    ) -> List[int]:
+        values = list({_sql_value(value) for value in values})
+        space, space_parameters = self._space_condition(provider)
+        rows = []
+        for start in range(0, len(values), MAX_PARAMETERS):
+            batch = values[start : start + MAX_PARAMETERS]
+            rows += [
+                row_id
+                for (row_id,) in self._query(
+                    f"SELECT row_id FROM blocks WHERE {column} IN ({', '.join('?' * len(batch))}) AND {space}",
+                    [*batch, *space_parameters],
+                )
+            ]
+        return rows
+
+    def rows_for_files(
+        self,
+        filepaths: Iterable = (),
+        checksums: Iterable[str] = (),
+        provider: Optional[EmbeddingProvider] = None,
+        snapshot: Optional[IndexSnapshot] = None,
+    ) -> pd.Index:
+        """Ids of the rows of the given files, identified by path or by checksum, in `provider`'s embedding space."""
+        self.sync(snapshot)
+        rows = self._rows_where("filepath", filepaths, provider)
+        rows += self._rows_where("file_checksum", checksums, provider)
+        return pd.Index(sorted(set(rows)), dtype="int64")
+
+    def checksums_by_filepath(
+        self,
+        provider: Optional[EmbeddingProvider] = None,
+        snapshot: Optional[IndexSnapshot] = None,
+    ) -> Dict[Path, str]:
+        """Each indexed file's checksum, for files with rows in `provider`'s embedding space."""
+        self.sync(snapshot)
+        space, parameters = self._space_condition(provider)
+        rows = self._query(
+            f"SELECT DISTINCT filepath, file_checksum FROM blocks "
+            f"WHERE filepath IS NOT NULL AND file_checksum IS NOT NULL AND {space}",
+            parameters,
+        )
+        return {Path(filepath): checksum for filepath, checksum in rows}
+
+    def rows_named(
+        self,
+        function_name: Optional[str] = None,
+        class_name: Optional[str] = None,
+        code_type: Optional[str] = None,
+        snapshot: Optional[IndexSnapshot] = None,
+    ) -> pd.Index:
+        """
+        Ids of the rows of blocks with the given names, e.g. the methods of a class. An empty name matches blocks
+        without one, like functions outside any class.
+        """
+        self.sync(snapshot)
+        conditions, parameters = [], []
+        for column, value in [
+            ("function_name", function_name),
+            ("class_name", class_name),
+            ("code_type", _sql_value(code_type)),
+        ]:
+            if value is not None:
+                # Comparing the column itself, rather than COALESCE(column, ''), lets SQLite use its index
+                conditions.append(
+                    f"{column} = ?" if value else f"({column} IS NULL OR {column} = '')"
+                )
+                parameters += [value] if value else []
+        rows = self._query(
+            f"SELECT row_id FROM blocks WHERE {' AND '.join(conditions) or '1'} ORDER BY row_id",
+            parameters,
+        )
+        return pd.Index([row_id for (row_id,) in rows], dtype="int64")
@@ -0,0 +1,150 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+LOCK_SUFFIX = ".lock"
+# How often a waiting writer retries on platforms without blocking locks
+POLL_SECONDS = 0.1
+
+
+class IndexLockedError(Exception):
+    pass
+
+
+def lock_path(index_path: Union[Path, str]) -> Path:
+    return Path(index_path).with_suffix(LOCK_SUFFIX)
+
+
+class IndexLock:
+    """
+    The single-writer lock of an index, so only one process embeds changes and writes the index at a time. Readers
+    never take it: they keep reading the last index committed.
+
+    The lock is an OS file lock, so it is released when its process exits however that happens, and a crashed
+    writer never leaves the index locked. The lock file records the pid of its holder for messages.
+    """
+
+    def __init__(self, index_path: Union[Path, str]):
+        self.path = lock_path(index_path)
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Take the lock, waiting for its holder to release it if `blocking`; returns whether it was taken."""
+        if self._file is not None:
+            raise RuntimeError(f"{self.path} is already held")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a+")
+        if not self._try_lock():
+            if not blocking:
+                self._file.close()
+                self._file = None
+                return False
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                while not self._try_lock():
+                    time.sleep(POLL_SECONDS)
+        # Only the holder writes the file, after taking the lock
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(os.getpid()))
+        self._file.flush()
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+    def holder(self) -> Optional[int]:
+        """Pid of the process that last took the lock."""
+        try:
+            return int(self.path.read_text().strip())
+        except (OSError, ValueError):
+            return None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def pin_version(base_path: Union[Path, str]) -> Optional[BinaryIO]:
+    """
+    Pin the version of an index whose base file is `base_path` for reading: until the returned file is closed,
+    `collect_version` leaves the version alone. Returns None if the version has already been collected.
+
+    On POSIX systems readers share a lock on the base file, which the collector must take exclusively. Windows
+    refuses to delete a file that is open, so there the open file is the pin.
+    """
+    try:
+        file = open(base_path, "rb")
+    except FileNotFoundError:
+        return None
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+        # Collected while we were waiting for the lock
+        if os.fstat(file.fileno()).st_nlink == 0:
+            file.close()
+            return None
+    return file
+
+
+def collect_version(
+    base_path: Union[Path, str], remove_version: Callable[[], None]
+) -> bool:
+    """
+    Delete the version of an index whose base file is `base_path`, calling `remove_version` to delete its other
+    files, unless a reader has it pinned. Returns whether it was deleted.
+    """
+    base_path = Path(base_path)
+    if fcntl is None:
+        try:
+            base_path.unlink()
+        except PermissionError:
+            return False
+        remove_version()
+        return True
+
+    try:
+        file = open(base_path, "rb")
+    except FileNotFoundError:
+        remove_version()
+        return True
+    with file:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        remove_version()
+        base_path.unlink(missing_ok=True)
+    return True
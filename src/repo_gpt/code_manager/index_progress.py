@@ -0,0 +1,67 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from .atomic_file import atomic_write
+
+
+class IndexProgress:
+    """
+    How far an in-progress `setup` has got, written next to the index after every commit so other commands can
+    tell a partial index from a complete one. The file is removed once setup finishes.
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+
+    def update(self, indexed_blocks: int, total_blocks: int, pid: int = None):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path, "w") as file:
+            json.dump(
+                {
+                    "indexed_blocks": indexed_blocks,
+                    "total_blocks": total_blocks,
+                    "pid": pid or os.getpid(),
+                    "updated_at": time.time(),
+                },
+                file,
+            )
+
+    def read(self) -> Optional[dict]:
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def is_running(self) -> bool:
+        """Whether the setup that last reported progress is still alive."""
+        progress = self.read()
+        if progress is None:
+            return False
+        try:
+            os.kill(progress["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except (KeyError, TypeError, PermissionError, OverflowError):
+            # A process we may not signal still exists; a malformed file doesn't
+            return isinstance(progress.get("pid"), int)
+        return True
+
+    def banner(self) -> Optional[str]:
+        """A one-line warning for commands reading a partial index, or None if the index is complete."""
+        progress = self.read()
+        if progress is None:
+            return None
+        indexed, total = progress["indexed_blocks"], progress["total_blocks"]
+        status = (
+            "the rest is being embedded in the background"
+            if self.is_running()
+            else "setup was interrupted; run `repo-gpt setup` to finish it"
+        )
+        return f"⏳ Partial index: {indexed:,}/{total:,} changed blocks embedded ({indexed / max(total, 1):.0%}), {status}"
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,113 @@
+import json
+import shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional, Set, Union
+
+from .atomic_file import atomic_write
+
+MANIFEST_FILE_NAME = "manifest.json"
+SEGMENT_FILE_PREFIX = "segment-"
+# Compact once this many segments have been appended, or once segments hold COMPACTION_RATIO times the base's rows
+MAX_SEGMENTS = 16
+COMPACTION_RATIO = 1.0
+
+
+@dataclass
+class Segment:
+    """
+    An immutable file of rows appended to an index, and the ids of earlier rows it deletes. A segment that only
+    deletes rows has no file.
+    """
+
+    name: Optional[str]
+    rows: int
+    tombstones: List[int] = field(default_factory=list)
+
+
+@dataclass
+class SegmentManifest:
+    """
+    The segments appended to an index since it was last written in full, in order. Rows are identified by their
+    position in the base file followed by every segment, so ids never change until the next full write.
+
+    The manifest names the write of the base file it extends, and lives in a directory of its own per base write:
+    a compaction starts a new one, and the old one is deleted along with the version of the index it belongs to.
+    """
+
+    base_write_id: str
+    base_rows: int
+    segments: List[Segment] = field(default_factory=list)
+
+    @property
+    def num_rows(self) -> int:
+        """Rows ever written to the index since its base, including deleted ones; the next row's id."""
+        return self.base_rows + sum(segment.rows for segment in self.segments)
+
+    @property
+    def segment_rows(self) -> int:
+        return sum(segment.rows + len(segment.tombstones) for segment in self.segments)
+
+    @property
+    def tombstones(self) -> Set[int]:
+        return {row for segment in self.segments for row in segment.tombstones}
+
+    def needs_compaction(self) -> bool:
+        return (
+            len(self.segments) >= MAX_SEGMENTS
+            or self.segment_rows > COMPACTION_RATIO * self.base_rows
+        )
+
+    def next_segment_name(self, suffix: str) -> str:
+        return f"{SEGMENT_FILE_PREFIX}{len(self.segments) + 1:06d}{suffix}"
+
+
+def segments_directory(index_path: Union[Path, str], base_write_id: str) -> Path:
+    """Where the segments appended to the write `base_write_id` of an index's base file live."""
+    index_path = Path(index_path)
+    return index_path.with_name(f"{index_path.stem}.{base_write_id}.segments")
+
+
+def read_manifest(
+    index_path: Union[Path, str], base_write_id: Optional[str]
+) -> Optional[SegmentManifest]:
+    """The manifest of segments extending the base file written as `base_write_id`, if there is one."""
+    if base_write_id is None:
+        return None
+    try:
+        with open(
+            segments_directory(index_path, base_write_id) / MANIFEST_FILE_NAME
+        ) as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if data.get("base_write_id") != base_write_id:
+        return None
+    return SegmentManifest(
+        base_write_id=data["base_write_id"],
+        base_rows=data["base_rows"],
+        segments=[Segment(**segment) for segment in data["segments"]],
+    )
+
+
+def write_manifest(index_path: Union[Path, str], manifest: SegmentManifest):
+    """Replace the manifest in one step; a segment only becomes part of the index once the manifest lists it."""
+    directory = segments_directory(index_path, manifest.base_write_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    with atomic_write(directory / MANIFEST_FILE_NAME, "w") as file:
+        json.dump(asdict(manifest), file)
+
+
+def remove_segments(index_path: Union[Path, str], base_write_id: str):
+    shutil.rmtree(segments_directory(index_path, base_write_id), ignore_errors=True)
+
+
+def remove_unused_segments(index_path: Union[Path, str], base_write_ids: Set[str]):
+    """Delete the segments of every base file but `base_write_ids`, including those of the unversioned layout."""
+    index_path = Path(index_path)
+    directories = [index_path.with_name(f"{index_path.stem}.segments")]
+    directories += index_path.parent.glob(f"{index_path.stem}.*.segments")
+    used = {segments_directory(index_path, write_id) for write_id in base_write_ids}
+    for directory in directories:
+        if directory not in used:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,841 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+from ..file_handler.abstract_handler import CodeType
+from .atomic_file import (
+    TEMP_FILE_SUFFIX,
+    atomic_write,
+    fsync_directory,
+    remove_temp_files,
+)
+from .index_lock import collect_version, pin_version
+from .index_segments import (
+    Segment,
+    SegmentManifest,
+    read_manifest,
+    remove_segments,
+    remove_unused_segments,
+    segments_directory,
+    write_manifest,
+)
+from .source_store import (
+    CODE_COLUMN,
+    CODE_END_COLUMN,
+    CODE_START_COLUMN,
+    SourceStore,
+    sources_directory,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "code_embeddings.parquet"
+LEGACY_INDEX_FILE_NAME = "code_embeddings.pkl"
+LEGACY_INDEX_SUFFIX = ".pkl"
+
+EMBEDDING_COLUMN = "code_embedding"
+# Embeddings live outside the Parquet file in float32 .npy matrices, one per embedding length. Each row records the
+# matrix file holding its embedding and its row in that matrix.
+EMBEDDING_MATRIX_COLUMN = "embedding_matrix"
+EMBEDDING_ROW_COLUMN = "embedding_row"
+EMBEDDING_MATRIX_SUFFIX = ".npy"
+# Parquet metadata naming each write of an index file, which the segments appended to it refer to
+WRITE_ID_METADATA_KEY = b"repo_gpt.write_id"
+# Columns holding Python objects Parquet has no type for; stored as their string or JSON form
+PATH_COLUMNS = ("filepath",)
+ENUM_COLUMNS = {"code_type": CodeType}
+JSON_COLUMNS = ("inputs", "outputs")
+# Columns whose few distinct values repeat across rows, held as categoricals: each row is a small integer code and
+# each distinct value one Python object, rather than an object pointer per row
+CATEGORICAL_COLUMNS = (
+    "filepath",
+    "file_checksum",
+    "class_name",
+    "code_type",
+    "embedding_provider",
+    "embedding_model",
+)
+# Integer columns pandas turns into floats when some rows have no value
+NULLABLE_INT_COLUMNS = (CODE_START_COLUMN, CODE_END_COLUMN)
+# Block text, zstd-compressed in frames of a few consecutive rows: small enough that reading a row decompresses little
+# besides its own text, and large enough to compress far better than each block on its own. A frame is stored on
+# its first row and holds the UTF-8 text of its rows back to back; each row records the length of its text in a
+# column of its own. Indexes written before store plain strings.
+COMPRESSED_TEXT_COLUMNS = (CODE_COLUMN, "summary")
+TEXT_LENGTH_SUFFIX = "_length"
+TEXT_FRAME_ROWS = 32
+TEXT_CODEC = pa.Codec("zstd", compression_level=3)
+# Small row groups let a handful of rows, like the code of the top search results, be read on their own
+ROW_GROUP_ROWS = 4096
+
+
+def is_legacy_index(path: Union[Path, str]) -> bool:
+    return Path(path).suffix == LEGACY_INDEX_SUFFIX
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _encode_json(value):
+    return None if _is_missing(value) else json.dumps(value)
+
+
+def _decode_json(value):
+    if value is None:
+        return None
+    value = json.loads(value)
+    # Tuples come back from JSON as lists
+    return tuple(value) if isinstance(value, list) else value
+
+
+def embedding_matrix_paths(path: Union[Path, str]) -> List[Path]:
+    """Every embedding matrix file of the index at `path`, including ones left behind by interrupted writes."""
+    path = Path(path)
+    return sorted(path.parent.glob(f"{path.stem}.*{EMBEDDING_MATRIX_SUFFIX}"))
+
+
+def _write_embedding_matrices(
+    embeddings: pd.Series, path: Path, write_id: str
+) -> Tuple[List[Optional[str]], np.ndarray]:
+    """
+    Write `embeddings` as one contiguous float32 matrix per embedding length, under names no earlier write used, so
+    processes still mapping the previous matrices keep reading them. Returns each row's matrix file name and row.
+    """
+    lengths = np.fromiter(
+        (-1 if _is_missing(e) else len(e) for e in embeddings),
+        dtype=np.int64,
+        count=len(embeddings),
+    )
+    names: List[Optional[str]] = [None] * len(embeddings)
+    rows = np.full(len(embeddings), -1, dtype=np.int64)
+    for length in np.unique(lengths[lengths >= 0]).tolist():
+        (positions,) = np.nonzero(lengths == length)
+        name = f"{path.stem}.{write_id}.{length}d{EMBEDDING_MATRIX_SUFFIX}"
+        matrix = np.empty((len(positions), length), dtype=np.float32)
+        for row, position in enumerate(positions.tolist()):
+            matrix[row] = embeddings.iat[position]
+        with atomic_write(path.parent / name) as file:
+            np.save(file, matrix)
+        for position in positions.tolist():
+            names[position] = name
+        rows[positions] = np.arange(len(positions))
+    return names, rows
+
+
+def _matrix_write_id(path: Path, matrix_path: Path) -> str:
+    return matrix_path.name[len(path.stem) + 1 :].split(".")[0]
+
+
+def _remove_unused_matrices(path: Path, write_ids: Iterable[Optional[str]]):
+    """Delete the embedding matrices of the file at `path` other than those of the writes `write_ids`."""
+    write_ids = set(write_ids)
+    for matrix_path in embedding_matrix_paths(path):
+        if _matrix_write_id(path, matrix_path) not in write_ids:
+            try:
+                matrix_path.unlink()
+            except OSError as e:
+                # Windows refuses to delete a file another process has mapped; the next write retries
+                logger.debug(f"Could not remove {matrix_path}: {e}")
+
+
+_open_matrices: Dict[Path, np.ndarray] = {}
+
+
+def open_embedding_matrix(matrix_path: Union[Path, str]) -> np.ndarray:
+    """
+    Memory-map an embedding matrix. Opening it is instant whatever its size, and its pages are shared through the OS
+    page cache by every process searching the same index. Matrix files are never rewritten in place, so a mapping
+    stays valid for as long as it is used.
+    """
+    matrix_path = Path(matrix_path)
+    matrix = _open_matrices.get(matrix_path)
+    if matrix is None:
+        # Forget matrices that later writes replaced; rows still using them keep their mapping alive
+        for stale_path in [p for p in _open_matrices if not p.exists()]:
+            del _open_matrices[stale_path]
+        # A plain ndarray view of the mapping: slicing an np.memmap makes a memmap object per row
+        matrix = np.asarray(np.load(matrix_path, mmap_mode="r"))
+        _open_matrices[matrix_path] = matrix
+    return matrix
+
+
+def _mapped_embedding_rows(
+    directory: Path, names: pd.Series, rows: pd.Series
+) -> List[Optional[np.ndarray]]:
+    """Each row's embedding as a read-only view into its memory-mapped matrix."""
+    embeddings: List[Optional[np.ndarray]] = [None] * len(names)
+    for position, (name, row) in enumerate(zip(names.tolist(), rows.tolist())):
+        if name is not None:
+            embeddings[position] = open_embedding_matrix(directory / name)[row]
+    return embeddings
+
+
+def _embedding_rows(column: pa.ChunkedArray) -> List[np.ndarray]:
+    """Rows of an embedding column, as indexes written before the embedding matrices moved to .npy files hold them."""
+    array = column.combine_chunks()
+    if len(array) == 0:
+        return []
+    values = array.flatten().to_numpy(zero_copy_only=True)
+    if pa.types.is_fixed_size_list(array.type):
+        return list(values.reshape(len(array), array.type.list_size))
+    offsets = array.offsets.to_numpy() - array.offsets[0].as_py()
+    return np.split(values, offsets[1:-1])
+
+
+def _text_length_column(column: str) -> str:
+    return f"{column}{TEXT_LENGTH_SUFFIX}"
+
+
+def _compress_text_frames(column: pd.Series) -> Tuple[List[Optional[bytes]], pd.array]:
+    """The frames of a text column, on the first row of each, and the length of each row's text."""
+    texts = [None if _is_missing(value) else value.encode("utf-8") for value in column]
+    frames: List[Optional[bytes]] = [None] * len(texts)
+    for start in range(0, len(texts), TEXT_FRAME_ROWS):
+        frame = b"".join(t for t in texts[start : start + TEXT_FRAME_ROWS] if t)
+        frames[start] = TEXT_CODEC.compress(frame, asbytes=True)
+    lengths = [None if text is None else len(text) for text in texts]
+    return frames, pd.array(lengths, dtype="Int32")
+
+
+def _decompress_text_frames(
+    frames: pd.Series, lengths: pd.Series
+) -> List[Optional[str]]:
+    """The text of each row of a text column; the rows must start with a frame and hold whole frames."""
+    lengths = [None if pd.isna(length) else int(length) for length in lengths]
+    heads = np.flatnonzero(frames.notna().to_numpy()).tolist() + [len(frames)]
+    texts = []
+    for head, end in zip(heads[:-1], heads[1:]):
+        size = sum(length for length in lengths[head:end] if length is not None)
+        frame = (
+            TEXT_CODEC.decompress(frames.iat[head], size, asbytes=True) if size else b""
+        )
+        offset = 0
+        for length in lengths[head:end]:
+            if length is None:
+                texts.append(None)
+                continue
+            texts.append(frame[offset : offset + length].decode("utf-8"))
+            offset += length
+    return texts
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """The metadata and code of an index; embeddings are written separately by `write_index`."""
+    metadata = df.drop(
+        columns=[EMBEDDING_COLUMN, EMBEDDING_MATRIX_COLUMN, EMBEDDING_ROW_COLUMN],
+        errors="ignore",
+    ).copy()
+    # So the conversions below run once per distinct value
+    for column in CATEGORICAL_COLUMNS:
+        if column in metadata.columns and metadata[column].notna().any():
+            metadata[column] = metadata[column].astype("category")
+    for column in PATH_COLUMNS:
+        if column in metadata.columns:
+            metadata[column] = metadata[column].map(
+                lambda path: None if _is_missing(path) else str(path)
+            )
+    for column in ENUM_COLUMNS:
+        if column in metadata.columns:
+            metadata[column] = metadata[column].map(
+                lambda member: None
+                if _is_missing(member)
+                else getattr(member, "value", member)
+            )
+    for column in JSON_COLUMNS:
+        if column in metadata.columns:
+            metadata[column] = metadata[column].map(_encode_json)
+    for column in NULLABLE_INT_COLUMNS:
+        if column in metadata.columns:
+            metadata[column] = metadata[column].astype("Int64")
+    for column in COMPRESSED_TEXT_COLUMNS:
+        if column in metadata.columns:
+            (
+                metadata[column],
+                metadata[_text_length_column(column)],
+            ) = _compress_text_frames(metadata[column])
+    table = pa.Table.from_pandas(metadata, preserve_index=False)
+    # Parquet dictionary-encodes each row group with just the values it holds; Arrow dictionaries would be written
+    # whole into every row group
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(
+                i, field.name, table.column(i).cast(field.type.value_type)
+            )
+    return table
+
+
+def _decode_distinct(column: pd.Series, decode) -> pd.Series:
+    """Decode each distinct value once; most rows share their file path, code type and signature types with others."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.rename_categories(decode)
+    decoded = {value: decode(value) for value in column.dropna().unique()}
+    return column.map(lambda value: decoded.get(value))
+
+
+def _read_dictionary(columns: Sequence[str]) -> List[str]:
+    """The columns to read as Parquet stores them, dictionary-encoded, rather than as a string per row."""
+    return [column for column in columns if column in CATEGORICAL_COLUMNS]
+
+
+def _concat_layers(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate the layers of an index, keeping the columns that are categorical in each layer categorical."""
+    frames = list(frames)
+    for column in CATEGORICAL_COLUMNS:
+        columns = [frame[column] for frame in frames if column in frame.columns]
+        if len(columns) < len(frames) or not all(
+            isinstance(c.dtype, pd.CategoricalDtype) for c in columns
+        ):
+            continue
+        categories = union_categoricals(columns).categories
+        frames = [
+            frame.assign(**{column: frame[column].cat.set_categories(categories)})
+            for frame in frames
+        ]
+    return pd.concat(frames)
+
+
+def from_arrow(
+    table: pa.Table, matrix_directory: Optional[Path] = None
+) -> pd.DataFrame:
+    """An index DataFrame from `table`, with embeddings mapped from the matrices in `matrix_directory` if given."""
+    embeddings = None
+    if EMBEDDING_COLUMN in table.column_names:
+        embeddings = _embedding_rows(table.column(EMBEDDING_COLUMN))
+        table = table.drop_columns([EMBEDDING_COLUMN])
+    df = table.to_pandas()
+    for column in PATH_COLUMNS:
+        if column in df.columns:
+            df[column] = _decode_distinct(df[column], Path)
+    for column, enum in ENUM_COLUMNS.items():
+        if column in df.columns:
+            df[column] = _decode_distinct(df[column], enum)
+    for column in JSON_COLUMNS:
+        if column in df.columns:
+            df[column] = _decode_distinct(df[column], _decode_json)
+    for column in COMPRESSED_TEXT_COLUMNS:
+        if _text_length_column(column) in df.columns:
+            df[column] = _decompress_text_frames(
+                df[column], df.pop(_text_length_column(column))
+            )
+    if matrix_directory is not None and EMBEDDING_MATRIX_COLUMN in df.columns:
+        embeddings = _mapped_embedding_rows(
+            matrix_directory, df[EMBEDDING_MATRIX_COLUMN], df[EMBEDDING_ROW_COLUMN]
+        )
+    if embeddings is not None:
+        df[EMBEDDING_COLUMN] = embeddings
+    return df
+
+
+def _columns_to_read(
+    schema: pa.Schema, columns: Sequence[str]
+) -> Tuple[List[str], bool]:
+    """The stored columns holding `columns`, and whether embeddings are to be mapped from their matrices."""
+    columns = list(columns) + [
+        _text_length_column(column)
+        for column in columns
+        if column in COMPRESSED_TEXT_COLUMNS
+        and _text_length_column(column) in schema.names
+        and _text_length_column(column) not in columns
+    ]
+    if EMBEDDING_COLUMN not in columns or EMBEDDING_COLUMN in schema.names:
+        return list(columns), False
+    mapping_columns = [EMBEDDING_MATRIX_COLUMN, EMBEDDING_ROW_COLUMN]
+    return [c for c in columns if c != EMBEDDING_COLUMN] + [
+        c for c in mapping_columns if c not in columns
+    ], True
+
+
+def version_path(path: Union[Path, str], write_id: str) -> Path:
+    """The base file of the version of an index written as `write_id`, which `path` links to while it's current."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{write_id}{path.suffix}")
+
+
+def _link_current(version_file: Path, path: Path):
+    """Make `version_file` the current version of the index at `path`, in one step."""
+    tmp_path = path.with_name(f".{path.name}.{version_file.stem}{TEMP_FILE_SUFFIX}")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(version_file, tmp_path)
+    except OSError:
+        # File systems without hard links
+        shutil.copyfile(version_file, tmp_path)
+    os.replace(tmp_path, path)
+    fsync_directory(path.parent)
+
+
+def _write_parquet(df: pd.DataFrame, path: Path, versioned: bool = False) -> str:
+    """
+    Write one Parquet file of an index along with its embedding matrices; returns the id of the write. A
+    `versioned` file is written as a new version of the index, which `path` then links to; otherwise `path` is
+    replaced.
+    """
+    write_id = uuid.uuid4().hex[:12]
+    table = to_arrow(df)
+    if EMBEDDING_COLUMN in df.columns:
+        matrix_names, matrix_rows = _write_embedding_matrices(
+            df[EMBEDDING_COLUMN], path, write_id
+        )
+        table = table.append_column(
+            EMBEDDING_MATRIX_COLUMN, pa.array(matrix_names, type=pa.string())
+        ).append_column(EMBEDDING_ROW_COLUMN, pa.array(matrix_rows))
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), WRITE_ID_METADATA_KEY: write_id.encode()}
+    )
+    # The matrices are durable before the file referring to them replaces the old one
+    with atomic_write(version_path(path, write_id) if versioned else path) as file:
+        pq.write_table(
+            table,
+            file,
+            row_group_size=ROW_GROUP_ROWS,
+            # Compressed text gains nothing from Parquet's own compression and dictionaries
+            compression={
+                name: "none" if name in COMPRESSED_TEXT_COLUMNS else "snappy"
+                for name in table.column_names
+            },
+            use_dictionary=[
+                name
+                for name in table.column_names
+                if name not in COMPRESSED_TEXT_COLUMNS
+            ],
+        )
+    if versioned:
+        _link_current(version_path(path, write_id), path)
+    else:
+        _remove_unused_matrices(path, [write_id])
+    return write_id
+
+
+def write_index(df: pd.DataFrame, path: Union[Path, str]):
+    """
+    Write an index in full, replacing the old file in one step so readers never see a partial write, even after a
+    crash. The new file is a new version of the index, superseding the old one and the segments appended to it,
+    which are deleted once no reader has them pinned. Call while holding the index's write lock.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if is_legacy_index(path):
+        with atomic_write(path) as file:
+            pickle.dump(df, file)
+        retained_versions = 0
+    else:
+        _write_parquet(df, path, versioned=True)
+        retained_versions = collect_versions(path)
+    # Copies of files kept for code stored by reference that no row refers to any more; older versions still being
+    # read may refer to them, so wait until they're gone
+    if "file_checksum" in df.columns and not retained_versions:
+        SourceStore(path).remove_unused(df["file_checksum"].dropna().unique())
+
+
+def _remove_version(path: Path, write_id: str):
+    remove_segments(path, write_id)
+    for matrix_path in embedding_matrix_paths(path):
+        if _matrix_write_id(path, matrix_path) == write_id:
+            matrix_path.unlink(missing_ok=True)
+
+
+def collect_versions(path: Union[Path, str]) -> int:
+    """
+    Delete the versions of the index at `path` that are neither current nor pinned by a reader, and the files of
+    writes that never completed. Returns how many old versions are still being read. Call while holding the
+    index's write lock.
+    """
+    path = Path(path)
+    current_write_id = index_write_id(path) if path.exists() else None
+    retained = set()
+    for version_file in path.parent.glob(f"{path.stem}.*{path.suffix}"):
+        write_id = version_file.name[len(path.stem) + 1 : -len(path.suffix)]
+        if write_id == current_write_id:
+            continue
+        if not collect_version(
+            version_file, lambda write_id=write_id: _remove_version(path, write_id)
+        ):
+            retained.add(write_id)
+    _remove_unused_matrices(path, retained | {current_write_id})
+    remove_unused_segments(path, retained | {current_write_id})
+    return len(retained)
+
+
+def index_write_id(path: Union[Path, str]) -> Optional[str]:
+    write_id = (pq.read_schema(path).metadata or {}).get(WRITE_ID_METADATA_KEY)
+    return None if write_id is None else write_id.decode()
+
+
+def index_state(path: Union[Path, str]) -> Optional[str]:
+    """Identifies the index as it stands; changes with every write to it, whether in full or an appended segment."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    write_id = None if is_legacy_index(path) else index_write_id(path)
+    if write_id is None:
+        stat = path.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    manifest = read_manifest(path, write_id)
+    return f"{write_id}+{0 if manifest is None else len(manifest.segments)}"
+
+
+def remove_interrupted_writes(path: Union[Path, str]):
+    """Clean up after writers of the index at `path` that died midway; call while holding its write lock."""
+    path = Path(path)
+    directories = [path.parent, sources_directory(path)]
+    if can_append_segments(path):
+        directories.append(segments_directory(path, index_write_id(path)))
+    for directory in directories:
+        remove_temp_files(directory)
+
+
+def can_append_segments(path: Union[Path, str]) -> bool:
+    """Whether changes to the index at `path` can be appended as segments rather than rewriting it."""
+    path = Path(path)
+    return (
+        not is_legacy_index(path) and path.exists() and index_write_id(path) is not None
+    )
+
+
+def _from_layer(
+    table: pa.Table, layer_path: Path, index_path: Path, map_embeddings: bool
+) -> pd.DataFrame:
+    df = from_arrow(table, layer_path.parent if map_embeddings else None)
+    if layer_path.parent != index_path.parent and EMBEDDING_MATRIX_COLUMN in df.columns:
+        # Name segment matrices relative to the index, like the base file's
+        df[EMBEDDING_MATRIX_COLUMN] = (
+            f"{layer_path.parent.name}/" + df[EMBEDDING_MATRIX_COLUMN]
+        )
+    return df
+
+
+def read_index_file(path: Union[Path, str], columns: Sequence[str]) -> pd.DataFrame:
+    """Read the `columns` one Parquet file of an index has, the base file or a segment, in file order."""
+    schema = pq.read_schema(path)
+    stored_columns, _ = _columns_to_read(
+        schema, [c for c in columns if c in schema.names]
+    )
+    return from_arrow(
+        pq.read_table(
+            path,
+            columns=stored_columns,
+            read_dictionary=_read_dictionary(stored_columns),
+        )
+    )
+
+
+def _read_file_rows(
+    layer_path: Path, rows: np.ndarray, columns: Sequence[str], index_path: Path
+) -> pd.DataFrame:
+    """
+    Read `columns` of the given row positions of one file, touching only the row groups that hold them, and
+    decompressing only the text frames that hold them.
+    """
+    schema = pq.read_schema(layer_path)
+    parquet_file = pq.ParquetFile(
+        layer_path, read_dictionary=_read_dictionary(schema.names)
+    )
+    stored_columns, map_embeddings = _columns_to_read(
+        schema, [c for c in columns if c in schema.names or c == EMBEDDING_COLUMN]
+    )
+    # Compressed text is decoded a whole frame at a time
+    wanted_rows = rows
+    if any(_text_length_column(c) in stored_columns for c in COMPRESSED_TEXT_COLUMNS):
+        frame_starts = np.unique(rows - rows % TEXT_FRAME_ROWS)
+        rows = (frame_starts[:, None] + np.arange(TEXT_FRAME_ROWS)).ravel()
+        rows = rows[rows < parquet_file.metadata.num_rows]
+
+    group_sizes = [
+        parquet_file.metadata.row_group(i).num_rows
+        for i in range(parquet_file.num_row_groups)
+    ]
+    group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+    group_of_row = np.searchsorted(group_starts, rows, side="right") - 1
+    row_groups = np.unique(group_of_row)
+    table = parquet_file.read_row_groups(row_groups.tolist(), columns=stored_columns)
+
+    # Where each row group that was read starts in `table`
+    read_group_starts = dict(
+        zip(
+            row_groups.tolist(),
+            np.cumsum([0] + [group_sizes[g] for g in row_groups[:-1]]).tolist(),
+        )
+    )
+    positions = [
+        read_group_starts[group] + row - group_starts[group]
+        for row, group in zip(rows.tolist(), group_of_row.tolist())
+    ]
+    df = _from_layer(
+        table.take(pa.array(positions, type=pa.int64())),
+        layer_path,
+        index_path,
+        map_embeddings,
+    )
+    if len(rows) == len(wanted_rows):
+        return df
+    return df.iloc[np.searchsorted(rows, wanted_rows)].reset_index(drop=True)
+
+
+class IndexSnapshot:
+    """
+    One version of an index, pinned for as long as it is read. Its rows keep their ids and contents, and their
+    code and embedding matrices stay readable, whatever is written to the index meanwhile: segments appended and
+    compactions completed after the snapshot was taken only show up in later snapshots. Old versions are deleted
+    by writers once no snapshot pins them.
+
+    Pickled indexes have no versions, so their snapshots hold the whole DataFrame.
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        self.write_id: Optional[str] = None
+        self.manifest: Optional[SegmentManifest] = None
+        self._pin = None
+        self._legacy_df = None
+        if is_legacy_index(self.path):
+            self._legacy_df = pd.read_pickle(self.path).reset_index(drop=True)
+            return
+
+        while True:
+            self.write_id = index_write_id(self.path)
+            self.base_path = (
+                self.path
+                if self.write_id is None
+                else version_path(self.path, self.write_id)
+            )
+            if self.base_path == self.path or not self.base_path.exists():
+                if index_write_id(self.path) == self.write_id:
+                    # Written before indexes were versioned
+                    self.base_path = self.path
+                    break
+                continue
+            self._pin = pin_version(self.base_path)
+            if self._pin is not None:
+                break
+        # Segments appended from here on belong to later snapshots
+        self.manifest = read_manifest(self.path, self.write_id)
+
+    def release(self):
+        if self._pin is not None:
+            self._pin.close()
+            self._pin = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def layers(self) -> Tuple[List[Tuple[Path, int]], Set[int]]:
+        """
+        The files of the snapshot, its base file followed by the segments appended to it, each with the id of its
+        first row, and the ids of the rows the segments delete.
+        """
+        layers = [(self.base_path, 0)]
+        if self.manifest is None:
+            return layers, set()
+        first_row = self.manifest.base_rows
+        directory = segments_directory(self.path, self.write_id)
+        for segment in self.manifest.segments:
+            if segment.name is not None:
+                layers.append((directory / segment.name, first_row))
+            first_row += segment.rows
+        return layers, self.manifest.tombstones
+
+    def read(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        exclude_columns: Sequence[str] = (),
+    ) -> pd.DataFrame:
+        """
+        Read the snapshot, or only `columns` of it, leaving out `exclude_columns`. Parquet indexes read only the
+        columns asked for, and embeddings come back as views into memory-mapped matrices rather than separately
+        unpickled arrays. Segments are merged in, without the rows they delete. The index of the result is each
+        row's id, its position in the base file followed by the segments.
+        """
+        if self._legacy_df is not None:
+            available = list(self._legacy_df.columns)
+        else:
+            layers, tombstones = self.layers()
+            schemas = [pq.read_schema(layer_path) for layer_path, _ in layers]
+            text_lengths = {_text_length_column(c) for c in COMPRESSED_TEXT_COLUMNS}
+            available = [
+                name
+                for name in dict.fromkeys(name for s in schemas for name in s.names)
+                if name not in text_lengths
+            ]
+            if EMBEDDING_MATRIX_COLUMN in available:
+                available.append(EMBEDDING_COLUMN)
+        selected = [
+            column
+            for column in (available if columns is None else columns)
+            if column in available and column not in exclude_columns
+        ]
+        if self._legacy_df is not None:
+            return self._legacy_df[selected]
+
+        frames = []
+        for (layer_path, first_row), schema in zip(layers, schemas):
+            stored_columns, map_embeddings = _columns_to_read(
+                schema,
+                [c for c in selected if c in schema.names or c == EMBEDDING_COLUMN],
+            )
+            df = _from_layer(
+                pq.read_table(
+                    layer_path,
+                    columns=stored_columns,
+                    read_dictionary=_read_dictionary(stored_columns),
+                ),
+                layer_path,
+                self.path,
+                map_embeddings,
+            )
+            df.index = pd.RangeIndex(first_row, first_row + len(df))
+            frames.append(df)
+        df = frames[0] if len(frames) == 1 else _concat_layers(frames)
+        if tombstones:
+            df = df[~df.index.isin(list(tombstones))]
+        return df.reindex(columns=selected)
+
+    def read_rows(self, rows: Iterable[int], columns: Sequence[str]) -> pd.DataFrame:
+        """Read `columns` of just the rows with the given ids, touching only the row groups that hold them."""
+        rows = np.asarray(sorted(set(rows)), dtype=np.int64)
+        if self._legacy_df is not None or len(rows) == 0:
+            return self.read(columns).loc[rows]
+
+        layers, _ = self.layers()
+        layer_starts = np.asarray([first_row for _, first_row in layers])
+        layer_of_row = np.searchsorted(layer_starts, rows, side="right") - 1
+        frames = []
+        for layer in np.unique(layer_of_row).tolist():
+            layer_path, first_row = layers[layer]
+            layer_rows = rows[layer_of_row == layer]
+            df = _read_file_rows(layer_path, layer_rows - first_row, columns, self.path)
+            df.index = layer_rows
+            frames.append(df)
+        return frames[0] if len(frames) == 1 else _concat_layers(frames)
+
+    def embedding_matrices(
+        self, df: pd.DataFrame
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        The matrices holding the embeddings of `df`'s rows, which must all have one length: for each, the matrix,
+        the rows of it that belong to `df` and their positions in `df`. Rows from matrix files come back as the
+        memory-mapped files themselves, so searching them reads the shared page cache rather than a private copy;
+        other embeddings are stacked into a new matrix.
+        """
+        if {EMBEDDING_MATRIX_COLUMN, EMBEDDING_ROW_COLUMN} <= set(df.columns) and df[
+            EMBEDDING_MATRIX_COLUMN
+        ].notna().all():
+            names = df[EMBEDDING_MATRIX_COLUMN].to_numpy()
+            matrix_rows = df[EMBEDDING_ROW_COLUMN].to_numpy()
+            matrices = []
+            for name in pd.unique(names):
+                (positions,) = np.nonzero(names == name)
+                matrix = open_embedding_matrix(self.path.parent / name)
+                matrices.append((matrix, matrix_rows[positions], positions))
+            return matrices
+
+        embeddings = (
+            df[EMBEDDING_COLUMN]
+            if EMBEDDING_COLUMN in df.columns
+            else self.read_rows(df.index, [EMBEDDING_COLUMN])[EMBEDDING_COLUMN].reindex(
+                df.index
+            )
+        )
+        positions = np.arange(len(df))
+        return [(np.stack(embeddings.to_numpy()), positions, positions)]
+
+
+def read_index(
+    path: Union[Path, str],
+    columns: Optional[Sequence[str]] = None,
+    exclude_columns: Sequence[str] = (),
+) -> pd.DataFrame:
+    """Read the current version of an index; see `IndexSnapshot.read`."""
+    with IndexSnapshot(path) as snapshot:
+        return snapshot.read(columns, exclude_columns)
+
+
+def read_index_rows(
+    path: Union[Path, str], rows: Iterable[int], columns: Sequence[str]
+) -> pd.DataFrame:
+    """Read rows of the current version of an index; see `IndexSnapshot.read_rows`."""
+    with IndexSnapshot(path) as snapshot:
+        return snapshot.read_rows(rows, columns)
+
+
+def read_embedding_matrices(
+    path: Union[Path, str], df: pd.DataFrame
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """The embedding matrices of rows of the current version of an index; see `IndexSnapshot.embedding_matrices`."""
+    with IndexSnapshot(path) as snapshot:
+        return snapshot.embedding_matrices(df)
+
+
+def append_index_segment(
+    path: Union[Path, str],
+    rows: Optional[pd.DataFrame],
+    deleted_rows: Iterable[int] = (),
+) -> Optional[pd.DataFrame]:
+    """
+    Append `rows` to a Parquet index as a new immutable segment that deletes the rows with ids `deleted_rows`, so
+    the cost of the write is proportional to the change rather than to the index. Returns `rows` indexed by the ids
+    they were given. Call while holding the index's write lock.
+    """
+    path = Path(path)
+    write_id = index_write_id(path)
+    manifest = read_manifest(path, write_id) or SegmentManifest(
+        write_id, pq.read_metadata(path).num_rows
+    )
+    deleted_rows = sorted(int(row) for row in deleted_rows)
+    num_rows = 0 if rows is None else len(rows)
+    first_row = manifest.num_rows
+    if num_rows == 0 and not deleted_rows:
+        return rows
+
+    name = None
+    if num_rows:
+        name = manifest.next_segment_name(path.suffix)
+        directory = segments_directory(path, write_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_parquet(rows, directory / name)
+    manifest.segments.append(Segment(name, num_rows, deleted_rows))
+    write_manifest(path, manifest)
+    # Old versions readers have let go of since the last full write
+    collect_versions(path)
+    if rows is None:
+        return None
+    return rows.set_axis(pd.RangeIndex(first_row, first_row + num_rows))
+
+
+def index_needs_compaction(path: Union[Path, str]) -> bool:
+    """Whether enough segments have piled up on the index at `path` that it's worth rewriting as one file."""
+    if is_legacy_index(path) or not Path(path).exists():
+        return False
+    manifest = read_manifest(path, index_write_id(path))
+    return manifest is not None and manifest.needs_compaction()
+
+
+def compact_index(path: Union[Path, str]) -> int:
+    """Rewrite an index and the segments appended to it as one file, dropping deleted rows. Returns its rows."""
+    df = read_index(path)
+    write_index(df, path)
+    return len(df)
+
+
+def convert_legacy_index(
+    pickle_path: Union[Path, str], index_path: Union[Path, str]
+) -> pd.DataFrame:
+    """Convert a pickled DataFrame index from older versions to the Parquet format."""
+    df = pd.read_pickle(pickle_path)
+    write_index(df, index_path)
+    logger.verbose_info(f"Converted {pickle_path} to {index_path}")
+    return df
@@ -0,0 +1,100 @@
+import logging
+import subprocess
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# How far back `git log` is read to find recently changed files
+RECENT_COMMITS = 500
+GIT_TIMEOUT_SECONDS = 10
+
+
+def _git(root_directory: Path, *args: str) -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "-C", str(root_directory), *args],
+            capture_output=True,
+            text=True,
+            timeout=GIT_TIMEOUT_SECONDS,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+
+def git_change_times(root_directory: Path) -> Optional[Dict[Path, float]]:
+    """
+    Last commit time of every file changed in the last RECENT_COMMITS commits, with files that have uncommitted
+    changes counted as changed now. Returns None if `root_directory` isn't in a git work tree.
+    """
+    top_level = _git(root_directory, "rev-parse", "--show-toplevel")
+    log = _git(
+        root_directory,
+        "log",
+        f"-n{RECENT_COMMITS}",
+        "--name-only",
+        "--format=@%ct",
+        "--no-renames",
+    )
+    if top_level is None or log is None:
+        return None
+    top_level = Path(top_level.strip())
+
+    change_times = {}
+    commit_time = 0.0
+    for line in log.splitlines():
+        if line.startswith("@"):
+            commit_time = float(line[1:])
+        elif line:
+            # Newest commits come first, so the first time a file shows up is its last change
+            change_times.setdefault(top_level / line, commit_time)
+
+    status = _git(root_directory, "status", "--porcelain", "--untracked-files=all")
+    for line in (status or "").splitlines():
+        filepath = top_level / line[3:].split(" -> ")[-1].strip('"')
+        try:
+            change_times[filepath] = filepath.stat().st_mtime
+        except OSError:
+            pass
+    return change_times
+
+
+def prioritise_files(
+    root_directory: Union[Path, str], filepaths: Iterable[Union[Path, str]]
+) -> List[Path]:
+    """
+    Order files so the code most likely to be searched is embedded first: files in the most recently changed
+    directories first, and the most recently changed files first within a directory. Recency comes from git history
+    when the root is a git work tree, and from file modification times otherwise.
+    """
+    filepaths = [Path(filepath) for filepath in filepaths]
+    git_times = git_change_times(Path(root_directory))
+    if git_times is not None:
+        git_times = {filepath.resolve(): t for filepath, t in git_times.items()}
+
+    change_times = {}
+    for filepath in filepaths:
+        if git_times is not None:
+            # Files untouched in recent history go last; their checkout mtime says nothing
+            change_times[filepath] = git_times.get(filepath.resolve(), 0.0)
+            continue
+        try:
+            change_times[filepath] = filepath.stat().st_mtime
+        except OSError:
+            change_times[filepath] = 0.0
+
+    directory_change_times = defaultdict(float)
+    for filepath in filepaths:
+        directory_change_times[filepath.parent] = max(
+            directory_change_times[filepath.parent], change_times[filepath]
+        )
+    return sorted(
+        filepaths,
+        key=lambda filepath: (
+            -directory_change_times[filepath.parent],
+            -change_times[filepath],
+            str(filepath),
+        ),
+    )
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from rich.table import Table
+
+from ..console import console
+
+DEFAULT_REQUESTS_PER_MINUTE = 3_000
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+DEFAULT_DIRECTORY_DEPTH = 2
+
+
+@dataclass
+class BlockTotals:
+    blocks: int = 0
+    tokens: int = 0
+
+    def add(self, tokens: int):
+        self.blocks += 1
+        self.tokens += tokens
+
+
+@dataclass
+class SetupEstimate:
+    """What `repo-gpt setup` would embed, what it would cost and how long it would take."""
+
+    embedding_model: str
+    # USD per million input tokens, None when unknown
+    price_per_million_tokens: Optional[float]
+    requests_per_minute: int
+    tokens_per_minute: int
+    num_blocks: int = 0
+    num_cached_blocks: int = 0
+    num_tokens: int = 0
+    num_requests: int = 0
+    by_language: Dict[str, BlockTotals] = field(
+        default_factory=lambda: defaultdict(BlockTotals)
+    )
+    by_directory: Dict[str, BlockTotals] = field(
+        default_factory=lambda: defaultdict(BlockTotals)
+    )
+
+    @property
+    def cost(self) -> Union[float, None]:
+        price = self.price_per_million_tokens
+        return None if price is None else self.num_tokens / 1_000_000 * price
+
+    @property
+    def seconds(self) -> float:
+        """Wall-clock time implied by whichever of the request or token rate limits binds first."""
+        return 60 * max(
+            self.num_requests / self.requests_per_minute,
+            self.num_tokens / self.tokens_per_minute,
+        )
+
+
+def directory_key(
+    filepath: Union[Path, str],
+    root_directory: Path,
+    depth: int = DEFAULT_DIRECTORY_DEPTH,
+) -> str:
+    """Group files by their first `depth` directories below the root."""
+    try:
+        relative_path = Path(filepath).relative_to(root_directory)
+    except ValueError:
+        relative_path = Path(filepath)
+    directories = relative_path.parent.parts[:depth]
+    return str(Path(*directories)) if directories else "."
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+def _totals_table(title: str, column: str, totals: Dict[str, BlockTotals]) -> Table:
+    table = Table(title=title)
+    table.add_column(column)
+    table.add_column("Blocks", justify="right")
+    table.add_column("Tokens", justify="right")
+    for key, total in sorted(totals.items(), key=lambda item: -item[1].tokens):
+        table.add_row(key, f"{total.blocks:,}", f"{total.tokens:,}")
+    return table
+
+
+def print_setup_estimate(estimate: SetupEstimate):
+    console.rule("[bold]Dry run: nothing was sent to the API")
+    console.print(_totals_table("By language", "Language", estimate.by_language))
+    console.print(_totals_table("By directory", "Directory", estimate.by_directory))
+
+    summary: List[str] = [
+        f"Blocks to embed: {estimate.num_blocks:,} ({estimate.num_cached_blocks:,} more already cached)",
+        f"Tokens to embed: {estimate.num_tokens:,}",
+        f"Embedding requests: {estimate.num_requests:,}",
+        "Estimated cost: "
+        + (
+            f"${estimate.cost:,.4f} with {estimate.embedding_model}"
+            if estimate.cost is not None
+            else f"unknown price for {estimate.embedding_model}"
+        ),
+        f"Estimated time: {_format_duration(estimate.seconds)} at "
+        f"{estimate.requests_per_minute:,} RPM / {estimate.tokens_per_minute:,} TPM",
+    ]
+    for line in summary:
+        console.print(line)
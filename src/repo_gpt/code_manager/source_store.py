@@ -0,0 +1,153 @@
+import hashlib
+import io
+import logging
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import pandas as pd
+
+from .atomic_file import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CODE_COLUMN = "code"
+# Where a block's code is in its file, as offsets into the file's text encoded as UTF-8 with universal newlines,
+# the bytes the file handlers parse
+CODE_START_COLUMN = "code_start"
+CODE_END_COLUMN = "code_end"
+SOURCE_FILE_SUFFIX = ".z"
+
+
+def sources_directory(index_path: Union[Path, str]) -> Path:
+    index_path = Path(index_path)
+    return index_path.with_name(f"{index_path.stem}.sources")
+
+
+def _file_text(raw: bytes) -> str:
+    """A file's text as the file handlers read it, with universal newlines."""
+    return io.TextIOWrapper(io.BytesIO(raw), encoding="utf-8").read()
+
+
+class SourceStore:
+    """
+    Compressed copies of indexed files, keyed by file checksum, for indexes that store code by reference: a block
+    row holds its file's checksum and the byte range of its code rather than the code itself. Code is read from the
+    working tree while the file is unchanged, and from the copy taken when it was indexed once it has changed.
+    """
+
+    def __init__(self, index_path: Union[Path, str]):
+        self.directory = sources_directory(index_path)
+
+    def _path(self, checksum: str) -> Path:
+        return self.directory / f"{checksum}{SOURCE_FILE_SUFFIX}"
+
+    def __contains__(self, checksum: str) -> bool:
+        return self._path(checksum).exists()
+
+    def put(self, checksum: str, text: str):
+        path = self._path(checksum)
+        if path.exists():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as file:
+            file.write(zlib.compress(text.encode("utf-8")))
+
+    def get(self, checksum: str) -> Optional[str]:
+        try:
+            with open(self._path(checksum), "rb") as file:
+                return zlib.decompress(file.read()).decode("utf-8")
+        except (OSError, zlib.error):
+            return None
+
+    def read_source(self, filepath: Union[Path, str], checksum: str) -> Optional[str]:
+        """The text of the file with `checksum`: the working tree's while it still matches, else the stored copy."""
+        try:
+            with open(filepath, "rb") as file:
+                raw = file.read()
+            if hashlib.md5(raw).hexdigest() == checksum:
+                return _file_text(raw)
+        except OSError:
+            pass
+        return self.get(checksum)
+
+    def remove_unused(self, checksums: Iterable[str]):
+        """Delete the copies of files no row refers to any more."""
+        if not self.directory.exists():
+            return
+        used = {f"{checksum}{SOURCE_FILE_SUFFIX}" for checksum in checksums}
+        for path in self.directory.iterdir():
+            if path.name not in used:
+                path.unlink(missing_ok=True)
+
+
+def _has_range(df: pd.DataFrame) -> pd.Series:
+    if CODE_START_COLUMN not in df.columns or CODE_END_COLUMN not in df.columns:
+        return pd.Series(False, index=df.index)
+    return df[CODE_START_COLUMN].notna() & df[CODE_END_COLUMN].notna()
+
+
+def store_code_by_reference(df: pd.DataFrame, store: SourceStore) -> pd.DataFrame:
+    """
+    Drop the code text of `df`'s blocks that have a byte range, after storing a copy of their file. Blocks of files
+    that changed since they were extracted, and blocks without a range like a file's global code, keep their text.
+    """
+    by_reference = _has_range(df) & df[CODE_COLUMN].notna()
+    if not by_reference.any():
+        return df
+    stored_files = set()
+    for filepath, checksum in (
+        df.loc[by_reference, ["filepath", "file_checksum"]]
+        .drop_duplicates()
+        .itertuples(index=False)
+    ):
+        if checksum in store:
+            stored_files.add((filepath, checksum))
+            continue
+        try:
+            with open(filepath, "rb") as file:
+                raw = file.read()
+        except OSError:
+            continue
+        if hashlib.md5(raw).hexdigest() == checksum:
+            store.put(checksum, _file_text(raw))
+            stored_files.add((filepath, checksum))
+
+    stored = by_reference & pd.Series(
+        [
+            (filepath, checksum) in stored_files
+            for filepath, checksum in zip(df["filepath"], df["file_checksum"])
+        ],
+        index=df.index,
+    )
+    df = df.copy()
+    df[CODE_COLUMN] = df[CODE_COLUMN].mask(stored)
+    return df
+
+
+def resolve_code(df: pd.DataFrame, store: SourceStore) -> pd.Series:
+    """The code of `df`'s blocks, reading blocks stored by reference from their files, each file once."""
+    code = (
+        df[CODE_COLUMN].astype(object)
+        if CODE_COLUMN in df.columns
+        else pd.Series(None, index=df.index, dtype=object)
+    )
+    missing = _has_range(df) & code.isna()
+    # Each file's text as the UTF-8 bytes the ranges index into
+    sources: Dict[Tuple[str, str], Optional[bytes]] = {}
+    for position in missing.to_numpy().nonzero()[0].tolist():
+        row = df.iloc[position]
+        source_key = (row["filepath"], row["file_checksum"])
+        if source_key not in sources:
+            source = store.read_source(*source_key)
+            if source is None:
+                logger.warning(
+                    f"The indexed version of {row['filepath']} is missing; re-run `repo-gpt setup` to re-index it"
+                )
+            sources[source_key] = None if source is None else source.encode("utf-8")
+        source = sources[source_key]
+        if source is not None:
+            code.iat[position] = source[
+                int(row[CODE_START_COLUMN]) : int(row[CODE_END_COLUMN])
+            ].decode("utf-8")
+    return code
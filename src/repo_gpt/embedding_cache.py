@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILENAME = "embeddings.sqlite3"
+
+
+def default_cache_dir() -> Path:
+    """User-level cache directory, shared by every repo and every run."""
+    if os.environ.get("REPO_GPT_CACHE_DIR"):
+        return Path(os.environ["REPO_GPT_CACHE_DIR"])
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    base_dir = Path(xdg_cache_home) if xdg_cache_home else Path.home() / ".cache"
+    return base_dir / "repo_gpt"
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache stored in SQLite.
+
+    Vectors are keyed by (model, dimensions, sha256 of the input text), so identical code in different repos,
+    branches or `.repo_gpt` directories is only ever embedded once. When `max_size_mb` is set the least recently
+    used vectors are evicted once the cache grows past it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Union[Path, str, None] = None,
+        max_size_mb: Optional[float] = None,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.cache_dir / CACHE_FILENAME
+        self.max_size_bytes = (
+            int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text_sha256 TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, dimensions, text_sha256)
+            )"""
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        # The cache's size is kept as a running total, so eviction doesn't sum every vector after each write.
+        # Replacing a row fires its delete trigger only with recursive triggers on.
+        self._connection.execute("PRAGMA recursive_triggers=ON")
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_state (key TEXT PRIMARY KEY, value INTEGER)"
+                )
+                # Caches from before the running total start from their current size
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO cache_state "
+                    "SELECT 'size_bytes', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                )
+                self._connection.execute(
+                    """CREATE TRIGGER IF NOT EXISTS embeddings_inserted AFTER INSERT ON embeddings BEGIN
+                        UPDATE cache_state SET value = value + LENGTH(NEW.vector) WHERE key = 'size_bytes';
+                    END"""
+                )
+                self._connection.execute(
+                    """CREATE TRIGGER IF NOT EXISTS embeddings_deleted AFTER DELETE ON embeddings BEGIN
+                        UPDATE cache_state SET value = value - LENGTH(OLD.vector) WHERE key = 'size_bytes';
+                    END"""
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def get(
+        self, model: str, dimensions: Optional[int], text: str
+    ) -> Optional[np.ndarray]:
+        return self.get_many(model, dimensions, [text])[0]
+
+    def get_many(
+        self, model: str, dimensions: Optional[int], texts: List[str]
+    ) -> List[Optional[np.ndarray]]:
+        """Look up several texts at once. Misses are returned as None."""
+        keys = [text_sha256(text) for text in texts]
+        found = {}
+        with self._lock:
+            for batch_start in range(0, len(keys), 500):
+                batch = list(set(keys[batch_start : batch_start + 500]))
+                rows = self._connection.execute(
+                    f"""SELECT text_sha256, vector FROM embeddings
+                    WHERE model = ? AND dimensions = ? AND text_sha256 IN ({",".join("?" * len(batch))})""",
+                    (model, dimensions or 0, *batch),
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND dimensions = ? AND text_sha256 = ?",
+                    [(now, model, dimensions or 0, key) for key in found],
+                )
+
+        vectors = [
+            np.frombuffer(found[key], dtype=np.float32) if key in found else None
+            for key in keys
+        ]
+        hits = sum(vector is not None for vector in vectors)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put(self, model: str, dimensions: Optional[int], text: str, vector: np.ndarray):
+        self.put_many(model, dimensions, [(text, vector)])
+
+    def put_many(
+        self,
+        model: str,
+        dimensions: Optional[int],
+        items: Iterable[Tuple[str, np.ndarray]],
+    ):
+        now = time.time()
+        rows = [
+            (
+                model,
+                dimensions or 0,
+                text_sha256(text),
+                np.asarray(vector, dtype=np.float32).tobytes(),
+                now,
+            )
+            for text, vector in items
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            # One transaction for the whole batch and its eviction
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows
+                )
+                if self.max_size_bytes is not None:
+                    self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._size_bytes()
+
+    def _size_bytes(self) -> int:
+        (size,) = self._connection.execute(
+            "SELECT value FROM cache_state WHERE key = 'size_bytes'"
+        ).fetchone()
+        return size
+
+    def _evict(self):
+        excess = self._size_bytes() - self.max_size_bytes
+        if excess <= 0:
+            return
+
+        evicted = 0
+        freed = 0
+        while freed < excess:
+            oldest = self._connection.execute(
+                "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not oldest:
+                break
+            for rowid, nbytes in oldest:
+                if freed >= excess:
+                    break
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE rowid = ?", (rowid,)
+                )
+                freed += nbytes
+                evicted += 1
+        logger.debug(f"Evicted {evicted} embeddings ({freed} bytes) from the cache")
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
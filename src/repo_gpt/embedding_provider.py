@@ -0,0 +1,172 @@
+import re
+import zlib
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+EmbeddingInputType = Union[str, Sequence[int]]
+# Indexes written before embedding providers existed hold OpenAI embeddings
+LEGACY_INDEX_PROVIDER = "openai"
+
+
+class EmbeddingProvider(ABC):
+    """
+    Something that turns text into embedding vectors.
+
+    `tokenize` and the limits tell `CodeProcessor` how to chunk and pack blocks into requests; `embed` accepts raw
+    strings (e.g. search queries) or token sequences produced by `tokenize`. Every vector in an index is tagged
+    with the provider `name` and `model` that produced it, so vectors from different providers are never compared.
+    """
+
+    name: str
+    model: str
+    # Requested output dimension, None for the model's native dimension
+    dimensions: Optional[int] = None
+    native_dimensions: Optional[int] = None
+    max_input_tokens: int
+    max_batch_inputs: int
+    max_batch_tokens: int
+    price_per_million_tokens: Optional[float] = None
+
+    @property
+    def output_dimensions(self) -> Optional[int]:
+        """Length of the vectors `embed` returns, None if unknown until the first call."""
+        return self.dimensions or self.native_dimensions
+
+    @abstractmethod
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        pass
+
+    @abstractmethod
+    def embed(self, inputs: List[EmbeddingInputType]) -> List[np.ndarray]:
+        pass
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Fully local CPU embeddings: signed feature hashing of identifier-aware word unigrams and bigrams.
+
+    Identifiers are split on snake_case and camelCase boundaries (and kept whole), so `getUserName` and
+    `get_user_name` share features. Term counts are dampened with log(1 + tf) and the result is L2-normalised, so
+    cosine similarity behaves like the API embeddings for search. No network, model download or extra dependency is
+    needed, which makes it usable on air-gapped build machines.
+    """
+
+    name = "local"
+    model = "hashed-ngrams-v1"
+    max_input_tokens = 8191
+    max_batch_inputs = 2048
+    max_batch_tokens = 1_000_000
+    price_per_million_tokens = 0.0
+
+    native_dimensions = 768
+    WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+    SUBWORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+    def __init__(self, dimensions: Optional[int] = None):
+        self.dimensions = dimensions or self.native_dimensions
+
+    @staticmethod
+    def _token_id(word: str) -> int:
+        return zlib.crc32(word.encode("utf-8"))
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        return [self._tokenize(text) for text in texts]
+
+    def _tokenize(self, text: str) -> List[int]:
+        tokens = []
+        for word in self.WORD_PATTERN.findall(text):
+            subwords = self.SUBWORD_PATTERN.findall(word)
+            tokens.append(self._token_id(word.lower()))
+            if len(subwords) > 1:
+                tokens.extend(self._token_id(subword.lower()) for subword in subwords)
+        return tokens
+
+    def embed(self, inputs: List[EmbeddingInputType]) -> List[np.ndarray]:
+        return [
+            self._embed_tokens(self._tokenize(item) if isinstance(item, str) else item)
+            for item in inputs
+        ]
+
+    def _embed_tokens(self, tokens: Sequence[int]) -> np.ndarray:
+        unigrams = np.asarray(tokens, dtype=np.uint64)
+        bigrams = unigrams[:-1] * np.uint64(1_000_003) + unigrams[1:]
+        features = np.concatenate([unigrams, bigrams])
+
+        # Two independent hashes pick the bucket and the sign, so collisions cancel out on average
+        bucket_hashes = features * np.uint64(2_654_435_761) % np.uint64(2**32)
+        buckets = (bucket_hashes % np.uint64(self.dimensions)).astype(np.int64)
+        signs = np.where(
+            (features * np.uint64(40_503) >> np.uint64(7)) & np.uint64(1), 1.0, -1.0
+        )
+
+        counts = np.bincount(buckets, weights=signs, minlength=self.dimensions)
+        embedding = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+
+def embedding_space_mismatch(
+    df: pd.DataFrame, provider: EmbeddingProvider
+) -> Optional[str]:
+    """
+    Describe how the embeddings in an index differ from what `provider` produces, or return None if query vectors
+    from `provider` can be compared against them.
+    """
+    index_providers = (
+        set(df["embedding_provider"].unique())
+        if "embedding_provider" in df.columns
+        else {LEGACY_INDEX_PROVIDER}
+    )
+    if index_providers != {provider.name}:
+        return f"embedding provider {', '.join(sorted(index_providers))}, not {provider.name}"
+
+    if "embedding_model" not in df.columns:
+        return "an unknown embedding model"
+    index_models = set(df["embedding_model"].unique())
+    if index_models != {provider.model}:
+        return (
+            f"embedding model {', '.join(sorted(index_models))}, not {provider.model}"
+        )
+
+    if "embedding_dimensions" in df.columns:
+        index_dimensions = set(df["embedding_dimensions"].unique())
+        if provider.output_dimensions is not None and index_dimensions != {
+            provider.output_dimensions
+        }:
+            return (
+                f"{', '.join(str(d) for d in sorted(index_dimensions))} dimensions, "
+                f"not {provider.output_dimensions}"
+            )
+    elif provider.dimensions is not None:
+        # Older indexes always hold the model's native dimension
+        return f"native dimensions, not {provider.dimensions}"
+    return None
+
+
+def in_embedding_space(df: pd.DataFrame, provider: EmbeddingProvider) -> pd.Series:
+    """Which rows of an index hold vectors that query vectors from `provider` can be compared against."""
+    index_providers = (
+        # Categorical when read from an index, which can't be filled with a new category
+        df["embedding_provider"].astype(object).fillna(LEGACY_INDEX_PROVIDER)
+        if "embedding_provider" in df.columns
+        else pd.Series(LEGACY_INDEX_PROVIDER, index=df.index)
+    )
+    matches = index_providers.eq(provider.name)
+    if "embedding_model" not in df.columns:
+        return matches & False
+    matches &= df["embedding_model"].eq(provider.model)
+
+    if "embedding_dimensions" in df.columns:
+        index_dimensions = df["embedding_dimensions"]
+        if provider.output_dimensions is not None:
+            matches &= index_dimensions.eq(provider.output_dimensions) | (
+                # Older rows always hold the model's native dimension
+                index_dimensions.isna()
+                & (provider.dimensions is None)
+            )
+    elif provider.dimensions is not None:
+        return matches & False
+    return matches
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from typing import List, Tuple, TypeVar, Union
@@ -33,6 +33,9 @@ class ParsedCode:
     filepath: str = None
     file_checksum: str = None
     embedding_model: str = EMBEDDING_MODEL
+    # Byte range of `code` in the file's UTF-8 text, for blocks that are one contiguous span of it
+    code_start: Union[int, None] = field(default=None, compare=False)
+    code_end: Union[int, None] = field(default=None, compare=False)
 
     def __lt__(self, other: "ParsedCode"):
         return self.code < other.code
@@ -276,6 +276,8 @@ class GenericCodeFileHandler(AbstractHandler):
             summary=None,
             inputs=input_params,
             outputs=output_params,
+            code_start=function_node.start_byte,
+            code_end=function_node.end_byte,
         )
 
     def get_class_parsed_code(self, class_node) -> ParsedCode:
@@ -304,6 +306,8 @@ class GenericCodeFileHandler(AbstractHandler):
             summary="\n".join(class_summary),
             inputs=parent_classes,
             outputs=None,
+            code_start=class_node.start_byte,
+            code_end=class_node.end_byte,
         )
 
     def get_parent_classes(self, class_node) -> Tuple[str, ...]:
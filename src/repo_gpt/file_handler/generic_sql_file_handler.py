@@ -86,6 +86,8 @@ class GenericSQLFileHandler(AbstractHandler):
                         inputs=None,
                         summary=None,
                         outputs=None,
+                        code_start=node.start_byte,
+                        code_end=node.end_byte,
                     )
                 )
         return parsed_nodes
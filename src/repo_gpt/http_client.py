@@ -0,0 +1,155 @@
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import DEFAULT_MAX_RETRIES, AsyncOpenAI, OpenAI
+
+# Enough for MAX_CONCURRENCY embedding requests plus chat calls running alongside them
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 32
+KEEPALIVE_EXPIRY_SECONDS = 90.0
+CONNECT_TIMEOUT_SECONDS = 10.0
+# Large embedding batches and long chat completions take minutes to come back
+READ_TIMEOUT_SECONDS = 300.0
+WRITE_TIMEOUT_SECONDS = 60.0
+# How long a request waits for a free connection when the pool is saturated
+POOL_TIMEOUT_SECONDS = 60.0
+
+
+@dataclass(frozen=True)
+class HttpClientSettings:
+    # None uses OPENAI_BASE_URL or the OpenAI API, like the openai client
+    base_url: Optional[str] = None
+    max_connections: int = MAX_CONNECTIONS
+    max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS
+    keepalive_expiry: float = KEEPALIVE_EXPIRY_SECONDS
+    connect_timeout: float = CONNECT_TIMEOUT_SECONDS
+    read_timeout: float = READ_TIMEOUT_SECONDS
+    write_timeout: float = WRITE_TIMEOUT_SECONDS
+    pool_timeout: float = POOL_TIMEOUT_SECONDS
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+
+class SharedHttpClient(httpx.Client):
+    # autogen deep-copies its llm_config; every copy should keep using the same connection pool
+    def __deepcopy__(self, memo):
+        return self
+
+
+class SharedAsyncHttpClient(httpx.AsyncClient):
+    def __deepcopy__(self, memo):
+        return self
+
+
+_lock = threading.Lock()
+_settings = HttpClientSettings()
+_http_client: Optional[SharedHttpClient] = None
+_async_http_client: Optional[SharedAsyncHttpClient] = None
+_openai_clients: Dict[Tuple[type, Optional[str], int], OpenAI] = {}
+
+
+def configure_http_client(**settings) -> HttpClientSettings:
+    """
+    Change the settings of the shared HTTP client, e.g. `base_url` to point every OpenAI call at a local stand-in
+    server for load testing. Clients created before are closed; call this before making requests.
+    """
+    global _settings, _http_client, _async_http_client
+    with _lock:
+        _settings = replace(_settings, **settings)
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        # An async client can only be closed from its event loop; dropping it lets its connections be collected
+        _async_http_client = None
+        _openai_clients.clear()
+    return _settings
+
+
+def http_client_settings() -> HttpClientSettings:
+    return _settings
+
+
+def http_client() -> SharedHttpClient:
+    """The connection pool every synchronous OpenAI call shares, so connections and TLS sessions are reused."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = SharedHttpClient(
+                limits=_settings.limits, timeout=_settings.timeout
+            )
+        return _http_client
+
+
+def async_http_client() -> SharedAsyncHttpClient:
+    """
+    The connection pool shared by asynchronous OpenAI calls. Its connections belong to the event loop that first
+    uses them, so use it from a single event loop.
+    """
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = SharedAsyncHttpClient(
+                limits=_settings.limits, timeout=_settings.timeout
+            )
+        return _async_http_client
+
+
+def _cached_openai_client(client_class, api_key, max_retries, http_client_factory):
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    key = (client_class, api_key, max_retries)
+    client = _openai_clients.get(key)
+    if client is None:
+        client = client_class(
+            api_key=api_key,
+            base_url=_settings.base_url,
+            max_retries=max_retries,
+            http_client=http_client_factory(),
+        )
+        _openai_clients[key] = client
+    return client
+
+
+def openai_client(
+    api_key: Optional[str] = None, max_retries: int = DEFAULT_MAX_RETRIES
+) -> OpenAI:
+    """
+    An OpenAI client on the shared connection pool, using OPENAI_API_KEY unless `api_key` is given. Callers that
+    retry themselves pass `max_retries=0`, so the client doesn't retry within their attempts.
+    """
+    return _cached_openai_client(OpenAI, api_key, max_retries, http_client)
+
+
+def async_openai_client(
+    api_key: Optional[str] = None, max_retries: int = DEFAULT_MAX_RETRIES
+) -> AsyncOpenAI:
+    return _cached_openai_client(AsyncOpenAI, api_key, max_retries, async_http_client)
+
+
+def autogen_config(model: str, api_key: Optional[str] = None) -> dict:
+    """An autogen `config_list` entry whose OpenAI client uses the shared connection pool and base URL."""
+    config = {
+        "model": model,
+        "api_key": api_key or os.environ.get("OPENAI_API_KEY"),
+        "http_client": http_client(),
+    }
+    if _settings.base_url is not None:
+        config["base_url"] = _settings.base_url
+    return config
@@ -1,7 +1,11 @@
 # Set your OpenAI API key as an environment variable
+import base64
+import functools
 import json
 import logging
 import os
+import sqlite3
+from typing import Iterable, List, Union
 
 import numpy as np
 import openai as openai
@@ -13,18 +17,56 @@ from tenacity import (  # for exponential backoff
     wait_random_exponential,
 )
 
+from repo_gpt.embedding_cache import EmbeddingCache
+from repo_gpt.embedding_provider import (
+    EmbeddingInputType,
+    EmbeddingProvider,
+    HashingEmbeddingProvider,
+)
+from repo_gpt.http_client import openai_client
+from repo_gpt.rate_limiter import AdaptiveConcurrencyLimiter
+from repo_gpt.singleflight import SingleFlight
 from repo_gpt.utils import Singleton
 
 MAX_RETRIES = 3
 GPT_MODEL = "gpt-4.1-mini"
+EMBEDDING_PROVIDER = "openai"
 EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = None  # None means the model's native dimension, e.g. 1536
+EMBEDDING_ENCODING = "cl100k_base"
+# Per-input and per-request limits of the embeddings endpoint
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_MAX_BATCH_INPUTS = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 300_000
 TEMPERATURE = (
     0.4  # temperature = 0 can sometimes get stuck in repetitive loops, so we use 0.4
 )
+TOKENIZER_THREADS = min(8, os.cpu_count() or 1)
+MIN_PARALLEL_TOKENIZE_BATCH = 64
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_or_encoding: str = GPT_MODEL) -> tiktoken.Encoding:
+    """
+    Return the tiktoken encoding for a model or encoding name (e.g. "gpt-4" or "cl100k_base").
+
+    Encodings are cached per name, so hot paths don't repeat tiktoken's model lookup on every call.
+    """
+    try:
+        return tiktoken.encoding_for_model(model_or_encoding)
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding(model_or_encoding)
+    except ValueError:
+        logger.warning("Warning: model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
 def num_tokens_from_messages(messages, model=GPT_MODEL):
     """
     Return the number of tokens used by a list of messages.
@@ -36,12 +78,6 @@ def num_tokens_from_messages(messages, model=GPT_MODEL):
     Returns:
         int: Number of tokens used
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.warning("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-
     # Models with tokens_per_message = 3
     if model in {
         "gpt-3.5-turbo-0613",
@@ -88,30 +124,35 @@ def num_tokens_from_messages(messages, model=GPT_MODEL):
             f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
 
-    # Count tokens
-    num_tokens = 0
+    # Count tokens, encoding every message value in one batch
+    values = [json.dumps(value) for message in messages for value in message.values()]
+    num_tokens = sum(num_tokens_from_strings(values, model))
     for message in messages:
         num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(json.dumps(value)))
-            if key == "name":
-                num_tokens += tokens_per_name
+        if "name" in message:
+            num_tokens += tokens_per_name
 
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
 
 def tokens_from_string(string, model=GPT_MODEL):
-    """Return the number of tokens used by a string."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.warn("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    """Return the tokens of a string."""
+    return get_encoding(model).encode(string, disallowed_special=())
 
-    tokens = encoding.encode(string)
 
-    return tokens
+def tokens_from_strings(
+    strings: Iterable[str], model=GPT_MODEL, num_threads: int = TOKENIZER_THREADS
+) -> List[List[int]]:
+    """Return the tokens of many strings, encoded in parallel by tiktoken's native batch encoder."""
+    encoding = get_encoding(model)
+    strings = list(strings)
+    if len(strings) < MIN_PARALLEL_TOKENIZE_BATCH:
+        # Not worth spinning up tiktoken's thread pool
+        return [encoding.encode(string, disallowed_special=()) for string in strings]
+    return encoding.encode_batch(
+        strings, num_threads=num_threads, disallowed_special=()
+    )
 
 
 def num_tokens_from_string(prompt, model=GPT_MODEL):
@@ -119,6 +160,26 @@ def num_tokens_from_string(prompt, model=GPT_MODEL):
     return len(tokens_from_string(prompt, model=model))
 
 
+def num_tokens_from_strings(
+    strings: Iterable[str], model=GPT_MODEL, num_threads: int = TOKENIZER_THREADS
+) -> List[int]:
+    """Return the number of tokens used by each of many strings."""
+    return [
+        len(tokens)
+        for tokens in tokens_from_strings(strings, model, num_threads=num_threads)
+    ]
+
+
+def decode_embedding(data: Union[str, List[float]]) -> np.ndarray:
+    """
+    Turn an embedding from the API into a float32 array. Base64 payloads are little-endian float32 bytes and are
+    decoded straight into the array's buffer, without building a list of Python floats first.
+    """
+    if isinstance(data, str):
+        return np.frombuffer(base64.b64decode(data), dtype="<f4")
+    return np.asarray(data, dtype=np.float32)
+
+
 def handle_after_retry(retry_state):
     if retry_state.attempt_number < 6:
         print(f"Attempt {retry_state.attempt_number} failed. Retrying...")
@@ -128,14 +189,165 @@ def handle_after_retry(retry_state):
         print(f"Final attempt failed after {retry_state.attempt_number} retries.")
 
 
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API, sent through the service's rate-limited client."""
+
+    name = "openai"
+    max_input_tokens = EMBEDDING_MAX_INPUT_TOKENS
+    max_batch_inputs = EMBEDDING_MAX_BATCH_INPUTS
+    max_batch_tokens = EMBEDDING_MAX_BATCH_TOKENS
+
+    # USD per million input tokens
+    PRICES_PER_MILLION_TOKENS = {
+        "text-embedding-3-small": 0.02,
+        "text-embedding-3-large": 0.13,
+        "text-embedding-ada-002": 0.10,
+    }
+    NATIVE_DIMENSIONS = {
+        "text-embedding-3-small": 1536,
+        "text-embedding-3-large": 3072,
+        "text-embedding-ada-002": 1536,
+    }
+
+    def __init__(
+        self,
+        openai_service: "OpenAIService",
+        model: str = EMBEDDING_MODEL,
+        dimensions: Union[int, None] = EMBEDDING_DIMENSIONS,
+    ):
+        self.openai_service = openai_service
+        self.model = model
+        self.dimensions = dimensions
+        self.native_dimensions = self.NATIVE_DIMENSIONS.get(model)
+        self.price_per_million_tokens = self.PRICES_PER_MILLION_TOKENS.get(model)
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        return tokens_from_strings(texts, EMBEDDING_ENCODING)
+
+    def request_params(self, inputs: List[EmbeddingInputType]) -> dict:
+        """Parameters of an embeddings request, shared by live requests and batch job files."""
+        params = {
+            "input": [item if isinstance(item, str) else list(item) for item in inputs],
+            "model": self.model,
+            # Asking for base64 explicitly stops the client from expanding it into Python floats for us
+            "encoding_format": "base64",
+        }
+        if self.dimensions:
+            # text-embedding-3 models return shortened vectors when asked; older models reject the parameter
+            params["dimensions"] = self.dimensions
+        return params
+
+    @retry(wait=wait_random_exponential(min=0.2, max=60), stop=stop_after_attempt(6))
+    def embed(self, inputs: List[EmbeddingInputType]) -> List[np.ndarray]:
+        """
+        Embed a batch of texts or token arrays in a single API request.
+
+        The batch must respect `max_input_tokens` per input, and `max_batch_inputs` and `max_batch_tokens` per
+        request.
+        """
+        try:
+            response = self.openai_service._create_with_rate_limit(
+                self.openai_service.client.embeddings, **self.request_params(inputs)
+            )
+        except openai.OpenAIError as e:
+            raise RuntimeError(f"OpenAI API error: {e}") from e
+
+        # Defensive checks
+        try:
+            data = sorted(response.data, key=lambda item: item.index)
+            if len(data) != len(inputs):
+                raise IndexError(f"expected {len(inputs)} embeddings, got {len(data)}")
+            return [decode_embedding(item.embedding) for item in data]
+        except (AttributeError, IndexError, TypeError, ValueError) as e:
+            print("❌ Malformed OpenAI response:", response)
+            raise ValueError("Invalid OpenAI response: missing 'embedding'") from e
+
+
+EMBEDDING_PROVIDERS = {
+    OpenAIEmbeddingProvider.name: OpenAIEmbeddingProvider,
+    HashingEmbeddingProvider.name: HashingEmbeddingProvider,
+}
+
+
+def create_embedding_provider(
+    name: str,
+    openai_service: "OpenAIService",
+    dimensions: Union[int, None] = EMBEDDING_DIMENSIONS,
+    model: Union[str, None] = None,
+) -> EmbeddingProvider:
+    """Create a provider by name, for its default model unless `model` is given."""
+    if name == OpenAIEmbeddingProvider.name:
+        return OpenAIEmbeddingProvider(
+            openai_service, model or EMBEDDING_MODEL, dimensions=dimensions
+        )
+    if name == HashingEmbeddingProvider.name:
+        if model not in (None, HashingEmbeddingProvider.model):
+            raise ValueError(f"Unknown local embedding model {model!r}")
+        return HashingEmbeddingProvider(dimensions=dimensions)
+    raise ValueError(
+        f"Unknown embedding provider {name!r}, expected one of {sorted(EMBEDDING_PROVIDERS)}"
+    )
+
+
 class OpenAIService(metaclass=Singleton):
     GENERAL_SYSTEM_PROMPT = "You are a world-class software engineer and technical writer specializing in understanding code + architecture + tradeoffs and explaining them clearly and in detail. You are helpful and answer questions the user asks. You organize your explanations in easy to read markdown."
     ANALYSIS_SYSTEM_PROMPT = "You are a world-class developer with an eagle eye for unintended bugs and edge cases. You carefully explain code with great detail and accuracy. You organize your explanations in markdown-formatted, bulleted lists."
 
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=os.environ.get("OPENAI_API_KEY"),
+    def __init__(
+        self,
+        *,
+        openai_api_key: Union[str, None] = None,
+        min_concurrency: int = MIN_CONCURRENCY,
+        max_concurrency: int = MAX_CONCURRENCY,
+        embedding_cache: Union[EmbeddingCache, None] = None,
+        use_embedding_cache: bool = True,
+        embedding_provider: Union[str, EmbeddingProvider] = EMBEDDING_PROVIDER,
+        embedding_dimensions: Union[int, None] = EMBEDDING_DIMENSIONS,
+    ):
+        self.openai_api_key = openai_api_key
+        self._client = None
+        # Shared by embedding and chat calls, so both back off when either gets throttled
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(4, max_concurrency),
+            min_limit=min_concurrency,
+            max_limit=max_concurrency,
         )
+        if embedding_cache is None and use_embedding_cache:
+            try:
+                embedding_cache = EmbeddingCache()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(
+                    f"Embedding cache unavailable, continuing without it: {e}"
+                )
+        self.embedding_cache = embedding_cache
+        self.embedding_requests = SingleFlight()
+        self.embedding_provider = (
+            create_embedding_provider(embedding_provider, self, embedding_dimensions)
+            if isinstance(embedding_provider, str)
+            else embedding_provider
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        # Created on first use, so the local embedding provider works without an API key
+        if self._client is None:
+            # Rate limit errors must reach the concurrency limiter, which backs off before requests are retried
+            self._client = openai_client(self.openai_api_key, max_retries=0)
+        return self._client
+
+    def _create_with_rate_limit(self, create, **kwargs):
+        """
+        Call an OpenAI `create` method with its raw response so the rate limit headers can drive the concurrency
+        limiter, and return the parsed response.
+        """
+        with self.concurrency_limiter.slot():
+            try:
+                raw_response = create.with_raw_response.create(**kwargs)
+            except openai.RateLimitError as e:
+                self.concurrency_limiter.on_throttle(e.response.headers)
+                raise
+            self.concurrency_limiter.on_success(raw_response.headers)
+        return raw_response.parse()
 
     @retry(wait=wait_random_exponential(min=0.2, max=60), stop=stop_after_attempt(6))
     def get_answer(
@@ -147,7 +359,8 @@ class OpenAIService(metaclass=Singleton):
         ```
         Question: {query}"""
 
-        response = self.client.chat.completions.create(
+        response = self._create_with_rate_limit(
+            self.client.chat.completions,
             messages=[
                 {
                     "role": "system",
@@ -166,7 +379,8 @@ class OpenAIService(metaclass=Singleton):
         after=lambda retry_state: handle_after_retry(retry_state),
     )
     def query_stream(self, query: str, system_prompt: str = GENERAL_SYSTEM_PROMPT):
-        api_response = self.client.chat.completions.create(
+        api_response = self._create_with_rate_limit(
+            self.client.chat.completions,
             messages=[
                 {
                     "role": "system",
@@ -185,19 +399,37 @@ class OpenAIService(metaclass=Singleton):
                 content = delta.content
                 print(content, end="")
 
-    @retry(wait=wait_random_exponential(min=0.2, max=60), stop=stop_after_attempt(6))
-    def get_embedding(self, text: str):
-        try:
-            response = self.client.embeddings.create(
-                input=[text], model=EMBEDDING_MODEL
+    def get_embedding(self, text: str, embedding_provider: EmbeddingProvider = None):
+        """
+        Embed a single text, reusing a cached vector for the same model and text when there is one, or the result of
+        an identical request already in flight. Uses the configured provider unless another is given, e.g. to search
+        an index still built with a previous model.
+        """
+        provider = embedding_provider or self.embedding_provider
+        use_cache = self.embedding_cache is not None and isinstance(text, str)
+        if use_cache:
+            cached_embedding = self.embedding_cache.get(
+                provider.model, provider.dimensions, text
             )
-        except openai.OpenAIError as e:
-            raise RuntimeError(f"OpenAI API error: {e}") from e
+            if cached_embedding is not None:
+                return cached_embedding
 
-        # Defensive checks
-        try:
-            embedding = response.data[0].embedding
-            return np.asarray(embedding, dtype=np.float32)
-        except (AttributeError, IndexError) as e:
-            print("❌ Malformed OpenAI response:", response)
-            raise ValueError("Invalid OpenAI response: missing 'embedding'") from e
+        def request_embedding():
+            embedding = provider.embed([text])[0]
+            if use_cache:
+                self.embedding_cache.put(
+                    provider.model, provider.dimensions, text, embedding
+                )
+            return embedding
+
+        if not isinstance(text, str):
+            return request_embedding()
+        # Agents often search for the same thing from several threads at once; only one of them asks the API
+        return self.embedding_requests.do(
+            (provider.name, provider.model, provider.dimensions, text),
+            request_embedding,
+        )
+
+    def create_embeddings(self, inputs: List[EmbeddingInputType]) -> List[np.ndarray]:
+        """Embed a batch of texts or token arrays with the configured provider, bypassing the embedding cache."""
+        return self.embedding_provider.embed(inputs)
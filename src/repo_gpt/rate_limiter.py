@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional, Union
+
+from .logging_config import VERBOSE_INFO
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the per-window quota below which we stop growing and start backing off
+LOW_REMAINING_RATIO = 0.1
+
+
+def _parse_int(value: Union[str, None]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Return the number of seconds the server asked us to wait, if any.
+
+    Understands `retry-after-ms`, `retry-after` in seconds or as an HTTP date, and
+    OpenAI's `x-ratelimit-reset-*` durations (e.g. "1s", "6m0s", "20ms").
+    """
+    if headers is None:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max(retry_at.timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+    resets = [
+        parse_duration(headers.get("x-ratelimit-reset-requests")),
+        parse_duration(headers.get("x-ratelimit-reset-tokens")),
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def parse_duration(value: Union[str, None]) -> Optional[float]:
+    """Parse durations like "1s", "6m0s", "1h2m3.5s" or "20ms" into seconds."""
+    if not value:
+        return None
+
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    seconds = 0.0
+    number = ""
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == ".":
+            number += char
+            i += 1
+            continue
+        unit = "ms" if value.startswith("ms", i) else char
+        if unit not in units or not number:
+            return None
+        seconds += float(number) * units[unit]
+        number = ""
+        i += len(unit)
+
+    if number:
+        # A bare number is treated as seconds
+        seconds += float(number)
+    return seconds
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limit the number of in-flight OpenAI requests using AIMD (additive increase, multiplicative decrease).
+
+    Every successful response grows the limit by `increase_step / limit`, i.e. by roughly `increase_step` once a
+    full window of requests succeeds. A 429, or response headers showing the remaining request/token quota is
+    nearly exhausted, shrinks the limit by `decrease_factor`, at most once per `decrease_interval` so a burst of
+    throttled responses to requests that were already in flight only counts once. When the server sends `retry-after` (or the quota is
+    fully spent) new requests are held back until the reset time instead of hammering the API.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        increase_step: float = 1.0,
+        decrease_factor: float = 0.5,
+        decrease_interval: float = 1.0,
+    ):
+        if min_limit < 1:
+            raise ValueError("min_limit must be at least one")
+        if max_limit < min_limit:
+            raise ValueError("max_limit must be greater than or equal to min_limit")
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._cooldown_until = 0.0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current effective number of requests allowed in flight."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                cooldown = self._cooldown_until - time.monotonic()
+                if cooldown > 0:
+                    self._condition.wait(cooldown)
+                elif self._in_flight < self.limit:
+                    self._in_flight += 1
+                    return
+                else:
+                    self._condition.wait()
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, headers: Mapping[str, str] = None):
+        """Grow the limit unless the rate limit headers say the quota is running out."""
+        headers = headers or {}
+        remaining_ratio = self._remaining_ratio(headers)
+
+        with self._condition:
+            if remaining_ratio is not None and remaining_ratio <= 0:
+                self._start_cooldown(parse_retry_after(headers))
+                self._decrease()
+            elif remaining_ratio is not None and remaining_ratio < LOW_REMAINING_RATIO:
+                self._decrease()
+            else:
+                self._set_limit(self._limit + self.increase_step / self._limit)
+            self._condition.notify_all()
+
+    def on_throttle(self, headers: Mapping[str, str] = None):
+        """Shrink the limit and respect `retry-after` after the API throttled a request."""
+        with self._condition:
+            self._start_cooldown(parse_retry_after(headers or {}))
+            self._decrease()
+            self._condition.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self._set_limit(self._limit * self.decrease_factor)
+
+    def _start_cooldown(self, seconds: Optional[float]):
+        if seconds:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+
+    def _set_limit(self, new_limit: float):
+        old_limit = self.limit
+        self._limit = min(max(new_limit, float(self.min_limit)), float(self.max_limit))
+        if self.limit != old_limit:
+            logger.log(
+                VERBOSE_INFO,
+                f"⚙️  OpenAI concurrency limit {old_limit} → {self.limit} ({self._in_flight} in flight)",
+            )
+
+    @staticmethod
+    def _remaining_ratio(headers: Mapping[str, str]) -> Optional[float]:
+        ratios = []
+        for kind in ("requests", "tokens"):
+            remaining = _parse_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            limit = _parse_int(headers.get(f"x-ratelimit-limit-{kind}"))
+            if remaining is None:
+                continue
+            if limit:
+                ratios.append(remaining / limit)
+            elif remaining == 0:
+                ratios.append(0.0)
+        return min(ratios) if ratios else None
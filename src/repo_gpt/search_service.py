@@ -1,6 +1,5 @@
 import json
 import logging
-import pickle
 from enum import Enum
 from pathlib import Path, PosixPath
 from typing import Union
@@ -9,15 +8,39 @@ import numpy as np
 import pandas as pd
 from Levenshtein import distance as levenshtein_distance
 from rich.markdown import Markdown
-from tqdm.auto import tqdm
 
+from .code_manager.code_processor import BLOCK_WINDOW_INDEX
+from .code_manager.embedding_migration import split_embedding_spaces
+from .code_manager.index_catalog import IndexCatalog
+from .code_manager.index_store import (
+    CODE_COLUMN,
+    EMBEDDING_COLUMN,
+    IndexSnapshot,
+    is_legacy_index,
+)
+from .code_manager.source_store import (
+    CODE_END_COLUMN,
+    CODE_START_COLUMN,
+    SourceStore,
+    resolve_code,
+)
 from .console import console, pretty_print_code, verbose_print
+from .embedding_provider import embedding_space_mismatch
 from .file_handler.abstract_handler import ParsedCode
 from .openai_service import OpenAIService
 from .utils import Singleton
 
 logger = logging.getLogger(__name__)
 
+# What reading a block's code takes, whether the index holds the code itself or a reference to it
+CODE_REFERENCE_COLUMNS = [
+    CODE_COLUMN,
+    CODE_START_COLUMN,
+    CODE_END_COLUMN,
+    "filepath",
+    "file_checksum",
+]
+
 
 class CustomCodeEmbeddingDFEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -41,7 +64,9 @@ def convert_search_df_to_json(
         "filepath",
     ],
 ):
-    df_dict = df[selected_columns].to_dict(orient="records")
+    df = df[selected_columns].astype(object)
+    # Missing values of categorical columns come back as NaN, which isn't JSON
+    df_dict = df.where(df.notna(), None).to_dict(orient="records")
     return json.dumps(df_dict, cls=CustomCodeEmbeddingDFEncoder)
 
 
@@ -55,23 +80,93 @@ class SearchService(metaclass=Singleton):
         self.pickle_path = (
             pickle_path if isinstance(pickle_path, Path) else Path(pickle_path)
         )
+        self.openai_service = openai_service
+        # Embeds queries for the vectors being searched: the configured provider, or the previous one while the
+        # index is being re-embedded
+        self.embedding_provider = openai_service.embedding_provider
+        # Sub-rows holding the window embeddings of oversized blocks, linked to their block by `block_id`
+        self.window_df = None
+        # The matrices holding the searched embeddings, usually the index's memory-mapped files, with the rows of
+        # each that belong to `searched_index`, the ids of every block and window
+        self.embedding_matrices = []
+        self.searched_index = None
+        # Indexed lookups by name, valid for the rows of `df` while the index keeps `catalog_version`
+        self.catalog = None
+        self.catalog_version = None
+        # The version of the index searches read, pinned so writers don't delete it
+        self.snapshot = None
         if self.pickle_path is not None and self.pickle_path.exists():
             self.refresh_df()
-        self.openai_service = openai_service
         self.language = language
 
     def refresh_df(self):
-        with open(self.pickle_path, "rb") as f:
-            self.df = pickle.load(f)
-            if self.df is None or self.df.empty:
-                raise Exception(
-                    "Dataframe is empty. Run `repo-gpt setup` to populate it."
-                )
+        # Searches read this version of the index until the next refresh, however the index changes meanwhile
+        snapshot = IndexSnapshot(self.pickle_path)
+        if self.snapshot is not None:
+            self.snapshot.release()
+        self.snapshot = snapshot
+        if self.catalog is None and not is_legacy_index(self.pickle_path):
+            self.catalog = IndexCatalog(self.pickle_path)
+        if self.catalog is not None:
+            self.catalog_version = self.catalog.sync(snapshot)
+        # Code text is only read for the rows a search returns, and embeddings are searched in their mapped matrix
+        self.df = snapshot.read(exclude_columns=[CODE_COLUMN, EMBEDDING_COLUMN])
+        if self.df is None or self.df.empty:
+            raise Exception("Dataframe is empty. Run `repo-gpt setup` to populate it.")
+        self._select_embedding_space()
+        self.embedding_matrices = self.snapshot.embedding_matrices(self.df)
+        self.searched_index = self.df.index
+
+        if "window_index" in self.df.columns:
+            is_window = self.df["window_index"].fillna(BLOCK_WINDOW_INDEX).ge(0)
+            self.window_df = self.df[is_window]
+            self.df = self.df[~is_window]
+        else:
+            self.window_df = None
+
+    def _select_embedding_space(self):
+        """
+        Search the rows query vectors can be compared against: the configured provider's, or the previous
+        provider's while the index is being re-embedded. Refuse to search vectors from any other embedding space.
+        """
+        mismatch = embedding_space_mismatch(
+            self.df, self.openai_service.embedding_provider
+        )
+        self.embedding_provider = self.openai_service.embedding_provider
+        if mismatch is None:
+            return
+
+        spaces = split_embedding_spaces(self.df, self.openai_service)
+        if spaces.serving is None:
+            raise Exception(
+                f"The index was built with {mismatch}. Use the embedding settings it was built with or re-run "
+                f"`repo-gpt setup`."
+            )
+        self.df = spaces.serving
+        if spaces.migrating:
+            self.embedding_provider = spaces.previous_provider
+
+    def _with_code(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the code text of `df`'s rows, read from the index on demand, or from the indexed files for code stored
+        by reference.
+        """
+        if CODE_COLUMN in df.columns:
+            return df
+        code = resolve_code(
+            self.snapshot.read_rows(df.index, CODE_REFERENCE_COLUMNS),
+            SourceStore(self.pickle_path),
+        )
+        return df.assign(**{CODE_COLUMN: code.reindex(df.index)})
 
     def simple_search(self, query: str):
         # Simple query logic: print the rows where 'code' column contains the query string
-        matches = self.df[self.df["code"].str.contains(query)]
-        print(matches)
+        code = resolve_code(
+            self.snapshot.read(CODE_REFERENCE_COLUMNS),
+            SourceStore(self.pickle_path),
+        )
+        matches = self.df[code.reindex(self.df.index).str.contains(query, na=False)]
+        print(self._with_code(matches))
 
     def semantic_search(self, code_query: str):
         similar_code_df = self.semantic_search_similar_code(code_query)
@@ -88,22 +183,34 @@ class SearchService(metaclass=Singleton):
         class_name = class_name or ""
         function_name = function_name or ""
 
+        # Exact matches come straight from the catalog's name indexes
+        if (
+            self.catalog is not None
+            and self.catalog.index_version() == self.catalog_version
+        ):
+            exact_rows = self.catalog.rows_named(
+                function_name, class_name, snapshot=self.snapshot
+            )
+            exact_rows = exact_rows[exact_rows.isin(self.df.index)]
+            if len(exact_rows) >= matches_to_return:
+                return self._with_code(self.df.loc[exact_rows[:matches_to_return]])
+
         # Concatenate class_name and function_name for comparison
         search_name = f"{class_name}{function_name}"
 
-        # Calculate the Levenshtein distance for the concatenated names without modifying self.df
-        name_distances = self.df.apply(
-            lambda row: levenshtein_distance(
-                search_name, f"{row['class_name'] or ''}{row['function_name'] or ''}"
-            ),
-            axis=1,
-        )
+        # Calculate the Levenshtein distance once per distinct name rather than once per row
+        class_names = self.df["class_name"].astype(object).fillna("")
+        names = class_names + self.df["function_name"].fillna("")
+        distances = {
+            name: levenshtein_distance(search_name, name) for name in names.unique()
+        }
+        name_distances = names.map(distances)
 
         # Get the indices of the smallest distances
         closest_indices = np.argsort(name_distances)[:matches_to_return]
 
         # Return the top matches using the indices to index into the original DataFrame
-        return self.df.iloc[closest_indices]
+        return self._with_code(self.df.iloc[closest_indices])
 
     # def find_function_match(
     #         self, function_name: str, class_name: str = None, matches_to_return: int = 3
@@ -146,25 +253,44 @@ class SearchService(metaclass=Singleton):
     #     )
 
     def semantic_search_similar_code(self, query: str, matches_to_return: int = 3):
-        embedding = self.openai_service.get_embedding(query)
+        embedding = self.openai_service.get_embedding(query, self.embedding_provider)
+        if self.openai_service.embedding_cache is not None:
+            logger.verbose_info(
+                f"Embedding cache: {self.openai_service.embedding_cache.stats()}"
+            )
+        logger.verbose_info(
+            f"Query embeddings: {self.openai_service.embedding_requests.stats()}"
+        )
         logger.verbose_info("Searching for similar code...")
 
-        # Calculate similarities as a separate series instead of a DataFrame column
-        if logger.getEffectiveLevel() < logging.INFO:
-            tqdm.pandas(desc="Processing")
-            similarities = self.df["code_embedding"].progress_apply(
-                lambda x: x.dot(embedding)
+        # One matrix-vector product per matrix scores every block and window; rows of other embedding spaces or
+        # deleted rows sharing a matrix are scored too and ignored, which is cheaper than gathering the rows first
+        scores = np.empty(len(self.searched_index))
+        for matrix, matrix_rows, positions in self.embedding_matrices:
+            scores[positions] = (matrix @ np.asarray(embedding, dtype=matrix.dtype))[
+                matrix_rows
+            ]
+        scores = pd.Series(scores, index=self.searched_index)
+        similarities = scores[self.df.index]
+
+        if self.window_df is not None and not self.window_df.empty:
+            # A windowed block scores as well as its best-matching window
+            window_similarities = (
+                scores[self.window_df.index].groupby(self.window_df["block_id"]).max()
+            )
+            similarities = np.fmax(
+                similarities, self.df["block_id"].map(window_similarities)
             )
-        else:
-            similarities = self.df["code_embedding"].apply(lambda x: x.dot(embedding))
 
         # Attach similarities as a column
         df_with_scores = self.df.copy()
         df_with_scores["similarities"] = similarities
 
         # Sort and return top matches
-        return df_with_scores.sort_values("similarities", ascending=False).head(
-            matches_to_return
+        return self._with_code(
+            df_with_scores.sort_values("similarities", ascending=False).head(
+                matches_to_return
+            )
         )
 
     def question_answer(self, question: str):
@@ -2,18 +2,17 @@ import asyncio
 import dataclasses
 import os
 import pathlib
-import pickle
 import sys
 import textwrap
 from pathlib import Path
 from typing import List, Optional, Tuple
 
-import pandas as pd
 import pytest
 from multilspy.multilspy_logger import MultilspyLogger
 from multilspy.multilspy_utils import FileUtils
 
 from repo_gpt.code_manager.abstract_extractor import Language
+from repo_gpt.code_manager.index_store import read_index
 
 
 @dataclasses.dataclass(frozen=True)
@@ -128,7 +127,7 @@ def setup_pickle_factory(tmp_path_factory):
             return cache[code_language]
 
         base_tmp = tmp_path_factory.mktemp("pickles", numbered=True)
-        pickle_path = base_tmp / f"{code_language.value}_repogpt.pickle"
+        pickle_path = base_tmp / f"{code_language.value}_repogpt.parquet"
 
         base_cache_dir = tmp_path_factory.getbasetemp()
         logger = MultilspyLogger()
@@ -168,8 +167,7 @@ def setup_pickle_factory(tmp_path_factory):
         assert process.returncode == 0
         assert pickle_path.exists()
 
-        with pickle_path.open("rb") as f:
-            data = pickle.load(f)
+        data = read_index(pickle_path)
 
         expected_columns = {
             "function_name",
@@ -184,11 +182,8 @@ def setup_pickle_factory(tmp_path_factory):
             "code_embedding",
         }
 
-        if isinstance(data, pd.DataFrame):
-            missing = expected_columns - set(data.columns)
-            assert not missing, f"❌ Missing columns: {missing}"
-        else:
-            raise TypeError("❌ Pickle did not contain a DataFrame.")
+        missing = expected_columns - set(data.columns)
+        assert not missing, f"❌ Missing columns: {missing}"
 
         repo_paths = RepoPaths(code_source_path, Path(pickle_path))
 
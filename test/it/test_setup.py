@@ -1,10 +1,11 @@
-import pickle
 from test.it.conftest import LANGUAGE_REPOS, LANGUAGES_TO_TEST, RepoPaths
 
 import pandas as pd
 import pytest
 from multilspy.multilspy_config import Language
 
+from repo_gpt.code_manager.index_store import read_index
+
 pytest_plugins = ("pytest_asyncio",)
 
 
@@ -15,14 +16,11 @@ async def test_cli_setup(pickle_factory, code_language: Language):
 
     assert (
         repo_paths.pickle_path.exists()
-    ), f"❌ [{code_language.name}] Pickle file not found at {repo_paths}"
-
-    with repo_paths.pickle_path.open("rb") as f:
-        data = pickle.load(f)
+    ), f"❌ [{code_language.name}] Index file not found at {repo_paths}"
 
-    assert isinstance(data, pd.DataFrame), f"❌ [{code_language.name}] Not a DataFrame"
+    data = read_index(repo_paths.pickle_path)
 
-    # print(f"\n🧾 [{code_language.name}] Columns in the pickled DataFrame:")
+    # print(f"\n🧾 [{code_language.name}] Columns in the index DataFrame:")
     # for col in data.columns:
     #     print(f"  - {col}")
 
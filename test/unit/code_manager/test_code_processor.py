@@ -0,0 +1,181 @@
+import numpy as np
+import pytest
+
+from repo_gpt.code_manager.code_processor import BLOCK_WINDOW_INDEX, CodeProcessor
+from repo_gpt.code_manager.embedding_checkpoint import EmbeddingCheckpoint
+from repo_gpt.embedding_provider import EmbeddingProvider
+from repo_gpt.file_handler.abstract_handler import CodeType, ParsedCode
+from repo_gpt.rate_limiter import AdaptiveConcurrencyLimiter
+
+
+class FakeEmbeddingProvider(EmbeddingProvider):
+    name = "fake"
+    model = "fake-model"
+    max_input_tokens = 8191
+    max_batch_inputs = 2048
+    max_batch_tokens = 300_000
+    price_per_million_tokens = 1.0
+
+    def __init__(self):
+        self.requests = []
+
+    def tokenize(self, texts):
+        # Stands in for tiktoken so the tests don't need to download BPE files
+        return [[len(word) for word in text.split()] for text in texts]
+
+    def embed(self, inputs):
+        self.requests.append(inputs)
+        # Deterministic, non-normalised vectors derived from the input length
+        return [np.array([len(tokens), 1.0], dtype=np.float32) for tokens in inputs]
+
+
+class FakeOpenAIService:
+    def __init__(self, embedding_provider=None):
+        self.embedding_cache = None
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter()
+        self.embedding_provider = embedding_provider or FakeEmbeddingProvider()
+
+    @property
+    def requests(self):
+        return self.embedding_provider.requests
+
+
+def _block(code):
+    return ParsedCode(
+        function_name="f",
+        class_name=None,
+        code_type=CodeType.FUNCTION,
+        code=code,
+        summary=None,
+        inputs=None,
+        outputs=None,
+    )
+
+
+def test_blocks_are_packed_into_few_requests():
+    service = FakeOpenAIService()
+    processor = CodeProcessor("/", service)
+
+    df = processor.process([_block(f"def f{i}(): return {i}") for i in range(50)])
+
+    assert len(service.requests) == 1
+    assert len(df) == 50
+    for embedding in df["code_embedding"]:
+        assert np.isclose(np.linalg.norm(embedding), 1.0)
+
+
+def test_blocks_are_tagged_with_their_embedding_provider():
+    df = CodeProcessor("/", FakeOpenAIService()).process([_block("def f(): pass")])
+
+    assert df["embedding_provider"].tolist() == ["fake"]
+    assert df["embedding_model"].tolist() == ["fake-model"]
+    assert df["embedding_dimensions"].tolist() == [2]
+
+
+def test_oversized_blocks_are_embedded_as_overlapping_windows():
+    service = FakeOpenAIService()
+    processor = CodeProcessor("/", service, window_tokens=4, window_overlap_tokens=2)
+
+    df = processor.process([_block("a b c d e f g h i j"), _block("x")])
+
+    input_sizes = sorted(
+        len(tokens) for request in service.requests for tokens in request
+    )
+    assert input_sizes == [1, 4, 4, 4, 4]
+    blocks = df[df["window_index"] == BLOCK_WINDOW_INDEX]
+    windows = df[df["window_index"] >= 0]
+    assert len(blocks) == 2
+    assert windows["window_index"].tolist() == [0, 1, 2, 3]
+    assert set(windows["block_id"]) == {blocks["block_id"].iloc[0]}
+    for embedding in df["code_embedding"]:
+        assert np.isclose(np.linalg.norm(embedding), 1.0)
+
+
+def test_windows_never_exceed_the_provider_input_limit():
+    service = FakeOpenAIService()
+    service.embedding_provider.max_input_tokens = 3
+
+    CodeProcessor("/", service).process([_block("a b c d e f g")])
+
+    assert max(len(tokens) for request in service.requests for tokens in request) == 3
+
+
+def test_duplicate_blocks_are_embedded_once():
+    service = FakeOpenAIService()
+
+    df = CodeProcessor("/", service).process([_block("def f(): pass")] * 3)
+
+    assert sum(len(request) for request in service.requests) == 1
+    assert len(df) == 3
+
+
+def test_interrupted_run_resumes_from_checkpoint(tmp_path):
+    checkpoint_path = tmp_path / "code_embeddings.checkpoint"
+    blocks = [_block(f"def f{i}(): return {i}") for i in range(4)]
+
+    class FlakyEmbeddingProvider(FakeEmbeddingProvider):
+        max_batch_inputs = 1
+
+        def embed(self, inputs):
+            if len(self.requests) == 2:
+                raise RuntimeError("network blip")
+            return super().embed(inputs)
+
+    failing_service = FakeOpenAIService(FlakyEmbeddingProvider())
+    failing_service.concurrency_limiter = AdaptiveConcurrencyLimiter(max_limit=1)
+    with pytest.raises(RuntimeError):
+        CodeProcessor("/", failing_service).process(
+            blocks, EmbeddingCheckpoint(checkpoint_path, "model", every_blocks=100)
+        )
+
+    service = FakeOpenAIService(FlakyEmbeddingProvider())
+    df = CodeProcessor("/", service).process(
+        blocks, EmbeddingCheckpoint(checkpoint_path, "model")
+    )
+
+    assert len(service.requests) == 2
+    assert df["code_embedding"].notna().all()
+
+
+def test_estimate_counts_blocks_tokens_and_requests_without_calling_the_api():
+    service = FakeOpenAIService()
+    blocks = [_block("a b c"), _block("d e"), _block("f")]
+    blocks[0].filepath = "/repo/src/app/main.py"
+    blocks[1].filepath = "/repo/src/app/queries.sql"
+    blocks[2].filepath = "/repo/setup.py"
+
+    estimate = CodeProcessor("/repo", service).estimate(
+        blocks, requests_per_minute=60, tokens_per_minute=60
+    )
+
+    assert service.requests == []
+    assert (estimate.num_blocks, estimate.num_tokens, estimate.num_requests) == (
+        3,
+        6,
+        1,
+    )
+    assert estimate.by_language["python"].tokens == 4
+    assert estimate.by_language["sql"].blocks == 1
+    assert estimate.by_directory["src/app"].blocks == 2
+    assert estimate.by_directory["."].blocks == 1
+    # 6 tokens at 60 TPM binds before 1 request at 60 RPM
+    assert estimate.seconds == 6
+    assert estimate.cost == 6 / 1_000_000
+
+
+def test_chunks_are_averaged_by_token_weight_per_block():
+    rng = np.random.default_rng(0)
+    chunk_matrix = rng.normal(size=(5, 8)).astype(np.float32)
+    block_indices = np.array([2, 0, 2, 2, 3])
+    chunk_tokens = np.array([10, 4, 20, 5, 7], dtype=np.float32)
+
+    block_matrix = CodeProcessor._combine_chunks(
+        chunk_matrix, block_indices, chunk_tokens, 4
+    )
+
+    expected = np.average(chunk_matrix[[0, 2, 3]], axis=0, weights=[10, 20, 5])
+    assert block_matrix.dtype == np.float32
+    assert np.allclose(block_matrix[2], expected / np.linalg.norm(expected), atol=1e-6)
+    assert np.allclose(np.linalg.norm(block_matrix[[0, 2, 3]], axis=1), 1.0)
+    # Blocks without chunks stay zero
+    assert not block_matrix[1].any()
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from repo_gpt.code_manager.dimension_tradeoff import (
+    measure_dimension_tradeoff,
+    truncate_embeddings,
+)
+
+
+def test_truncated_embeddings_are_renormalised():
+    embeddings = np.array([[3.0, 4.0, 12.0], [0.0, 0.0, 1.0]])
+
+    truncated = truncate_embeddings(embeddings, 2)
+
+    assert np.allclose(truncated, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_tradeoff_reports_recall_and_size_per_method():
+    # Low-rank data: a few directions carry all the signal, so PCA keeps recall where truncation can't
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(100, 4)) @ rng.normal(size=(4, 32))
+
+    results = measure_dimension_tradeoff(embeddings, [4, 64], k=5, num_queries=20)
+
+    by_method = {(r.method, r.dimensions): r for r in results}
+    assert set(by_method) == {("full", 32), ("truncate", 4), ("pca", 4)}
+    assert by_method["full", 32].recall == 1.0
+    assert by_method["pca", 4].recall > 0.95
+    assert by_method["truncate", 4].index_bytes == 100 * 4 * 4
+
+
+def test_tradeoff_needs_neighbours():
+    with pytest.raises(ValueError):
+        measure_dimension_tradeoff(np.ones((1, 8)))
@@ -0,0 +1,145 @@
+import json
+
+import numpy as np
+import pytest
+
+from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.code_processor import CodeProcessor
+from repo_gpt.code_manager.embedding_batch_job import read_batch_results
+from repo_gpt.code_manager.index_store import INDEX_FILE_NAME, read_index
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.file_handler.abstract_handler import CodeType, ParsedCode
+from repo_gpt.openai_service import OpenAIEmbeddingProvider
+from repo_gpt.rate_limiter import AdaptiveConcurrencyLimiter
+from repo_gpt.utils import Singleton
+
+from .test_code_processor import FakeOpenAIService
+
+
+class WhitespaceOpenAIEmbeddingProvider(OpenAIEmbeddingProvider):
+    def tokenize(self, texts):
+        # Stands in for tiktoken so the tests don't need to download BPE files
+        return [[len(word) for word in text.split()] for text in texts]
+
+    def embed(self, inputs):
+        raise AssertionError("batch mode must not call the API")
+
+
+class BatchOpenAIService:
+    def __init__(self):
+        self.embedding_cache = None
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter()
+        self.embedding_provider = WhitespaceOpenAIEmbeddingProvider(self)
+
+
+def _block(code, filepath):
+    return ParsedCode(
+        function_name="f",
+        class_name=None,
+        code_type=CodeType.FUNCTION,
+        code=code,
+        summary=None,
+        inputs=None,
+        outputs=None,
+        filepath=filepath,
+        file_checksum=filepath,
+    )
+
+
+def _result_line(request, embedding=None, error=None):
+    if error:
+        return {
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 400, "body": {"error": {"message": error}}},
+            "error": None,
+        }
+    return {
+        "custom_id": request["custom_id"],
+        "response": {
+            "status_code": 200,
+            "body": {"data": [{"index": 0, "embedding": embedding}]},
+        },
+        "error": None,
+    }
+
+
+@pytest.fixture
+def blocks():
+    return [
+        _block("def a(): pass", "a.py"),
+        _block("def b(): pass", "a.py"),
+        _block("def c(): pass", "c.py"),
+        _block("def d(): pass", "d.py"),
+    ]
+
+
+def test_export_writes_one_request_per_input_with_stable_ids(tmp_path, blocks):
+    processor = CodeProcessor("/", BatchOpenAIService())
+
+    assert processor.export_batch(blocks, tmp_path / "first.jsonl") == 4
+    processor.export_batch(blocks[::-1], tmp_path / "second.jsonl")
+
+    first = [json.loads(line) for line in open(tmp_path / "first.jsonl")]
+    second = [json.loads(line) for line in open(tmp_path / "second.jsonl")]
+    assert {r["custom_id"] for r in first} == {r["custom_id"] for r in second}
+    assert first[0]["url"] == "/v1/embeddings"
+    assert first[0]["body"]["model"] == "text-embedding-3-small"
+    assert first[0]["body"]["input"] == [[3, 4, 4]]
+
+
+def test_ingest_merges_results_and_reports_missing_and_failed(tmp_path, blocks):
+    processor = CodeProcessor("/", BatchOpenAIService())
+    processor.export_batch(blocks, tmp_path / "requests.jsonl")
+    requests = [json.loads(line) for line in open(tmp_path / "requests.jsonl")]
+    request_for = dict(zip(["a", "b", "c", "d"], requests))
+
+    with open(tmp_path / "results.jsonl", "w") as file:
+        for name, embedding in (("a", [3.0, 4.0]), ("b", [0.0, 2.0])):
+            file.write(json.dumps(_result_line(request_for[name], embedding)) + "\n")
+        file.write(json.dumps(_result_line(request_for["c"], error="bad input")))
+        file.write("\nnot json\n")
+
+    df, report = processor.ingest_batch(
+        blocks, read_batch_results(tmp_path / "results.jsonl")
+    )
+
+    assert df["filepath"].tolist() == ["a.py", "a.py"]
+    assert np.allclose(df["code_embedding"][0], [0.6, 0.8])
+    assert df["embedding_model"].tolist() == ["text-embedding-3-small"] * 2
+    assert report.num_embedded == 2
+    assert report.missing == [request_for["d"]["custom_id"]]
+    assert report.failed == {request_for["c"]["custom_id"]: "bad input"}
+    assert report.skipped_files == ["c.py", "d.py"]
+
+
+def test_export_needs_the_openai_provider(tmp_path, blocks):
+    with pytest.raises(ValueError):
+        CodeProcessor("/", FakeOpenAIService()).export_batch(
+            blocks, tmp_path / "requests.jsonl"
+        )
+
+
+def test_ingesting_without_complete_files_keeps_the_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    root = tmp_path / "repo"
+    root.mkdir()
+    (root / "m.py").write_text("def f():\n    return 0\n")
+    (tmp_path / "results.jsonl").write_text("")
+    path = tmp_path / "index" / INDEX_FILE_NAME
+
+    def manager():
+        return CodeManager(
+            path, root, FakeOpenAIService(HashingEmbeddingProvider(dimensions=8))
+        )
+
+    # Nothing to store on a fresh index
+    assert manager().batch_ingest(tmp_path / "results.jsonl").skipped_files
+    assert not path.exists()
+
+    # A changed file keeps its old rows until its blocks are ingested
+    manager().setup()
+    (root / "m.py").write_text("def g():\n    return 0\n")
+    report = manager().batch_ingest(tmp_path / "results.jsonl")
+
+    assert report.num_embedded == 0
+    assert read_index(path)["function_name"].dropna().tolist() == ["f"]
@@ -0,0 +1,39 @@
+import pytest
+
+from repo_gpt.code_manager.embedding_batcher import (
+    EmbeddingInput,
+    pack_embedding_inputs,
+    packing_report,
+)
+
+
+def _inputs(*sizes):
+    return [EmbeddingInput(index, [0] * size) for index, size in enumerate(sizes)]
+
+
+def test_batches_never_exceed_token_or_input_limits():
+    batches = pack_embedding_inputs(
+        _inputs(5, 90, 40, 60, 10, 10, 10, 30), max_batch_tokens=100, max_batch_inputs=3
+    )
+
+    assert all(batch.num_tokens <= 100 for batch in batches)
+    assert all(len(batch.inputs) <= 3 for batch in batches)
+    assert sorted(i.block_index for b in batches for i in b.inputs) == list(range(8))
+
+
+def test_first_fit_decreasing_fills_requests():
+    # 255 tokens fit in three 100-token requests; packing in arrival order would need four
+    batches = pack_embedding_inputs(
+        _inputs(40, 60, 45, 55, 50, 5), max_batch_tokens=100, max_batch_inputs=10
+    )
+
+    assert len(batches) == 3
+    report = packing_report(batches, max_batch_tokens=100, max_batch_inputs=10)
+    assert report.min_requests == 3
+    assert report.efficiency == 1.0
+    assert report.fill_ratio == pytest.approx(255 / 300)
+
+
+def test_oversized_input_is_rejected():
+    with pytest.raises(ValueError):
+        pack_embedding_inputs(_inputs(101), max_batch_tokens=100, max_batch_inputs=10)
@@ -0,0 +1,64 @@
+import numpy as np
+
+from repo_gpt.code_manager.embedding_checkpoint import EmbeddingCheckpoint
+
+MODEL = "text-embedding-3-small"
+
+
+def test_saves_every_n_blocks(tmp_path):
+    path = tmp_path / "code_embeddings.checkpoint"
+    checkpoint = EmbeddingCheckpoint(path, MODEL, every_blocks=2, every_seconds=3600)
+
+    checkpoint.add("a", np.ones(2))
+    assert not path.exists()
+    checkpoint.add("b", np.ones(2))
+    checkpoint.add("c", np.ones(2))
+
+    recovered = EmbeddingCheckpoint(path, MODEL)
+    assert len(recovered) == 2
+    assert recovered.get("a") is not None and recovered.get("c") is None
+
+
+def test_saves_are_appended_and_reloaded(tmp_path):
+    path = tmp_path / "code_embeddings.checkpoint"
+    checkpoint = EmbeddingCheckpoint(path, MODEL, every_blocks=1)
+    checkpoint.add("a", np.ones(2))
+    checkpoint.add("b", np.zeros(2))
+
+    resumed = EmbeddingCheckpoint(path, MODEL, every_blocks=1)
+    resumed.add("c", np.ones(2))
+
+    assert len(EmbeddingCheckpoint(path, MODEL)) == 3
+
+
+def test_torn_final_frame_is_ignored(tmp_path):
+    path = tmp_path / "code_embeddings.checkpoint"
+    checkpoint = EmbeddingCheckpoint(path, MODEL, every_blocks=1)
+    checkpoint.add("a", np.ones(2))
+    checkpoint.add("b", np.ones(2))
+    path.write_bytes(path.read_bytes()[:-10])
+
+    recovered = EmbeddingCheckpoint(path, MODEL, every_blocks=1)
+    assert recovered.get("a") is not None and recovered.get("b") is None
+
+    # The damaged file is rewritten rather than appended to
+    recovered.add("b", np.ones(2))
+    assert len(EmbeddingCheckpoint(path, MODEL)) == 2
+
+
+def test_checkpoint_from_another_model_is_ignored(tmp_path):
+    path = tmp_path / "code_embeddings.checkpoint"
+    EmbeddingCheckpoint(path, "old-model", every_blocks=1).add("a", np.ones(2))
+
+    assert len(EmbeddingCheckpoint(path, MODEL)) == 0
+
+
+def test_clear_removes_the_file(tmp_path):
+    path = tmp_path / "code_embeddings.checkpoint"
+    checkpoint = EmbeddingCheckpoint(path, MODEL, every_blocks=1)
+    checkpoint.add("a", np.ones(2))
+
+    checkpoint.clear()
+
+    assert not path.exists()
+    assert len(checkpoint) == 0
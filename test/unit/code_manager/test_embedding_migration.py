@@ -0,0 +1,76 @@
+import os
+
+import pandas as pd
+
+from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.embedding_migration import split_embedding_spaces
+from repo_gpt.code_manager.index_store import INDEX_FILE_NAME, read_index
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.search_service import SearchService
+from repo_gpt.utils import Singleton
+
+from .test_code_processor import FakeOpenAIService
+
+
+def _local_service(dimensions):
+    return FakeOpenAIService(HashingEmbeddingProvider(dimensions=dimensions))
+
+
+def _rows(filepaths, dimensions):
+    return pd.DataFrame(
+        {
+            "filepath": filepaths,
+            "embedding_provider": "local",
+            "embedding_model": HashingEmbeddingProvider.model,
+            "embedding_dimensions": dimensions,
+        }
+    )
+
+
+def test_the_more_complete_previous_space_keeps_serving():
+    df = pd.concat(
+        [_rows(["a.py", "b.py", "c.py"], 16), _rows(["a.py"], 32)], ignore_index=True
+    )
+
+    spaces = split_embedding_spaces(df, _local_service(32))
+
+    assert spaces.migrating
+    assert spaces.current["filepath"].tolist() == ["a.py"]
+    assert spaces.serving["filepath"].tolist() == ["a.py", "b.py", "c.py"]
+    assert spaces.previous_provider.dimensions == 16
+
+    # Switching back to the complete space drops the partial one
+    spaces = split_embedding_spaces(df, _local_service(16))
+    assert not spaces.migrating
+    assert len(spaces.current) == 3
+
+
+def test_setup_switches_embedding_spaces_once_every_file_is_re_embedded(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    root = tmp_path / "repo"
+    root.mkdir()
+    for i in range(3):
+        (root / f"m{i}.py").write_text(f"def f{i}():\n    return {i}\n")
+        os.utime(root / f"m{i}.py", (1_000 + i, 1_000 + i))
+    index_path = tmp_path / "index" / INDEX_FILE_NAME
+    CodeManager(index_path, root, _local_service(16)).setup()
+
+    manager = CodeManager(index_path, root, _local_service(32), first_commit_blocks=1)
+    assert not manager.setup(max_commits=1)
+
+    index = read_index(index_path)
+    assert index.groupby("embedding_dimensions")["filepath"].nunique().to_dict() == {
+        16: 3,
+        32: 1,
+    }
+    search_service = SearchService(_local_service(32), index_path)
+    assert search_service.embedding_provider.dimensions == 16
+    assert set(search_service.df["embedding_dimensions"]) == {16}
+
+    assert CodeManager(index_path, root, _local_service(32)).setup()
+
+    assert set(read_index(index_path)["embedding_dimensions"]) == {32}
+    search_service.refresh_df()
+    assert search_service.embedding_provider.dimensions == 32
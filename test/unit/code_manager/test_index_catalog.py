@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from repo_gpt.code_manager import index_catalog
+from repo_gpt.code_manager.index_catalog import IndexCatalog
+from repo_gpt.code_manager.index_store import (
+    INDEX_FILE_NAME,
+    IndexSnapshot,
+    append_index_segment,
+    compact_index,
+    write_index,
+)
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.file_handler.abstract_handler import CodeType
+
+
+def _blocks(names, filepath, checksum, dimensions=4):
+    return pd.DataFrame(
+        {
+            "function_name": [name.split(".")[-1] for name in names],
+            "class_name": [
+                name.split(".")[0] if "." in name else None for name in names
+            ],
+            "code_type": [
+                CodeType.METHOD if "." in name else CodeType.FUNCTION for name in names
+            ],
+            "code": [f"def {name}(): pass" for name in names],
+            "filepath": Path(filepath),
+            "file_checksum": checksum,
+            "embedding_provider": "local",
+            "embedding_model": HashingEmbeddingProvider.model,
+            "embedding_dimensions": dimensions,
+            "code_embedding": [np.ones(dimensions, dtype=np.float32)] * len(names),
+        }
+    )
+
+
+def test_lookups_follow_appended_segments_and_compaction(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(
+        pd.concat(
+            [
+                _blocks(["f", "A.run", "A.stop"], "/r/a.py", "c1"),
+                _blocks(["g"], "/r/b.py", "c2"),
+            ],
+            ignore_index=True,
+        ),
+        path,
+    )
+    catalog = IndexCatalog(path)
+
+    assert catalog.rows_for_files(filepaths=[Path("/r/a.py")]).tolist() == [0, 1, 2]
+    assert catalog.rows_named(class_name="A", code_type=CodeType.METHOD).tolist() == [
+        1,
+        2,
+    ]
+    assert catalog.rows_named("f", "").tolist() == [0]
+
+    # a.py changes: its rows are replaced by a segment
+    append_index_segment(
+        path, _blocks(["A.run"], "/r/a.py", "c3"), deleted_rows=[0, 1, 2]
+    )
+    assert catalog.checksums_by_filepath() == {
+        Path("/r/a.py"): "c3",
+        Path("/r/b.py"): "c2",
+    }
+    assert catalog.rows_for_files(checksums=["c3"]).tolist() == [4]
+
+    compact_index(path)
+    assert catalog.rows_named("run", "A").tolist() == [1]
+
+
+def test_lookups_can_be_limited_to_an_embedding_space(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(
+        pd.concat(
+            [
+                _blocks(["f"], "/r/a.py", "c1", dimensions=4),
+                _blocks(["g"], "/r/b.py", "c2", dimensions=8),
+            ],
+            ignore_index=True,
+        ),
+        path,
+    )
+    catalog = IndexCatalog(path)
+    provider = HashingEmbeddingProvider(dimensions=8)
+
+    assert catalog.checksums_by_filepath(provider) == {Path("/r/b.py"): "c2"}
+    assert catalog.rows_for_files([Path("/r/a.py")], provider=provider).empty
+
+
+def test_each_lookup_syncs_once_with_the_given_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_catalog, "MAX_PARAMETERS", 1)
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(
+        pd.concat(
+            [_blocks(["f"], "/r/a.py", "c1"), _blocks(["g"], "/r/b.py", "c2")],
+            ignore_index=True,
+        ),
+        path,
+    )
+    catalog = IndexCatalog(path)
+    synced = []
+    sync = catalog._sync
+    monkeypatch.setattr(
+        catalog, "_sync", lambda snapshot: synced.append(snapshot) or sync(snapshot)
+    )
+
+    with IndexSnapshot(path) as snapshot:
+        append_index_segment(path, _blocks(["h"], "/r/c.py", "c3"), deleted_rows=[0])
+        rows = catalog.rows_for_files(
+            [Path("/r/a.py"), Path("/r/b.py"), Path("/r/c.py")], snapshot=snapshot
+        )
+
+    assert rows.tolist() == [0, 1]
+    assert synced == [snapshot]
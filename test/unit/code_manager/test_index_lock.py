@@ -0,0 +1,103 @@
+import os
+import stat
+import threading
+
+import pandas as pd
+import pytest
+
+from repo_gpt.code_manager.atomic_file import atomic_write
+from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.index_lock import IndexLock, IndexLockedError
+from repo_gpt.code_manager.index_store import (
+    INDEX_FILE_NAME,
+    LEGACY_INDEX_FILE_NAME,
+    read_index,
+    write_index,
+)
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.utils import Singleton
+
+from .test_code_processor import FakeOpenAIService
+
+
+def test_an_interrupted_write_leaves_the_old_file(tmp_path):
+    path = tmp_path / "index.json"
+    path.write_text("old")
+
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_write(path, "w") as file:
+            file.write("partial")
+            raise KeyboardInterrupt
+
+    assert path.read_text() == "old"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_writes_keep_the_replaced_file_mode_or_follow_the_umask(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        with atomic_write(tmp_path / "new.json", "w") as file:
+            file.write("new")
+        (tmp_path / "shared.json").write_text("old")
+        os.chmod(tmp_path / "shared.json", 0o664)
+        with atomic_write(tmp_path / "shared.json", "w") as file:
+            file.write("new")
+    finally:
+        os.umask(umask)
+
+    assert stat.S_IMODE((tmp_path / "new.json").stat().st_mode) == 0o644
+    assert stat.S_IMODE((tmp_path / "shared.json").stat().st_mode) == 0o664
+
+
+def test_one_writer_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    root = tmp_path / "repo"
+    root.mkdir()
+    (root / "a.py").write_text("def a():\n    return 1\n")
+    index_path = tmp_path / "index" / INDEX_FILE_NAME
+    openai_service = FakeOpenAIService(HashingEmbeddingProvider(dimensions=16))
+    waiting = CodeManager(index_path, root, openai_service)
+    # Another process commits after `waiting` loaded the index
+    CodeManager(index_path, root, openai_service).setup()
+
+    lock = IndexLock(index_path)
+    lock.acquire()
+    with pytest.raises(IndexLockedError):
+        CodeManager(index_path, root, openai_service).setup(wait=False)
+    setup = threading.Thread(target=waiting.setup)
+    setup.start()
+    setup.join(timeout=0.5)
+    assert setup.is_alive()
+    lock.release()
+    setup.join()
+
+    # The waiting writer picked up the other's commit rather than embedding a.py again
+    assert read_index(index_path)["function_name"].dropna().tolist() == ["a"]
+    assert waiting.code_df["function_name"].dropna().tolist() == ["a"]
+
+
+def test_legacy_indexes_are_converted_by_one_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    root = tmp_path / "repo"
+    root.mkdir()
+    index_path = tmp_path / "index" / INDEX_FILE_NAME
+    index_path.parent.mkdir()
+    pd.DataFrame({"function_name": ["old"]}).to_pickle(
+        index_path.with_name(LEGACY_INDEX_FILE_NAME)
+    )
+    openai_service = FakeOpenAIService(HashingEmbeddingProvider(dimensions=16))
+
+    lock = IndexLock(index_path)
+    lock.acquire()
+    starting = threading.Thread(
+        target=CodeManager, args=(index_path, root, openai_service)
+    )
+    starting.start()
+    starting.join(timeout=0.5)
+    assert starting.is_alive() and not index_path.exists()
+    # Another process converts the index while holding the lock
+    write_index(pd.DataFrame({"function_name": ["converted"]}), index_path)
+    lock.release()
+    starting.join()
+
+    assert read_index(index_path)["function_name"].tolist() == ["converted"]
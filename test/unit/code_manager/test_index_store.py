@@ -0,0 +1,248 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from repo_gpt.code_manager import index_store
+from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.index_segments import MANIFEST_FILE_NAME, segments_directory
+from repo_gpt.code_manager.index_store import (
+    INDEX_FILE_NAME,
+    LEGACY_INDEX_FILE_NAME,
+    IndexSnapshot,
+    append_index_segment,
+    compact_index,
+    embedding_matrix_paths,
+    index_needs_compaction,
+    index_write_id,
+    read_embedding_matrices,
+    read_index,
+    read_index_rows,
+    version_path,
+    write_index,
+)
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.file_handler.abstract_handler import CodeType
+from repo_gpt.utils import Singleton
+
+from .test_code_processor import FakeOpenAIService
+
+
+def _local_service():
+    return FakeOpenAIService(HashingEmbeddingProvider(dimensions=8))
+
+
+def _index(num_rows, dimensions=4):
+    return pd.DataFrame(
+        {
+            "function_name": [f"f{i}" for i in range(num_rows)],
+            "code_type": CodeType.FUNCTION,
+            "code": [f"def f{i}(): pass" for i in range(num_rows)],
+            "inputs": [("a", "b")] * num_rows,
+            "outputs": ["int"] * num_rows,
+            "filepath": [Path(f"/repo/m{i}.py") for i in range(num_rows)],
+            "code_embedding": [
+                np.full(dimensions, i, dtype=np.float32) for i in range(num_rows)
+            ],
+        }
+    )
+
+
+def test_index_round_trips_through_parquet(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(3), path)
+
+    df = read_index(path)
+
+    assert df["code_type"].tolist() == [CodeType.FUNCTION] * 3
+    assert df["filepath"].tolist() == [Path(f"/repo/m{i}.py") for i in range(3)]
+    assert df["inputs"].tolist() == [("a", "b")] * 3
+    assert df["outputs"].tolist() == ["int"] * 3
+    assert df["code_embedding"][2].tolist() == [2.0] * 4
+    # Every row is a view into one contiguous matrix
+    assert all(row.base is df["code_embedding"][0].base for row in df["code_embedding"])
+
+
+def test_embeddings_are_memory_mapped_from_one_matrix(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(3), path)
+    old_df = read_index(path)
+
+    write_index(_index(5), path)
+    df = read_index(path, exclude_columns=["code_embedding"])
+    ((matrix, rows, positions),) = read_embedding_matrices(path, df)
+
+    assert isinstance(matrix.base, np.memmap)
+    assert matrix.shape == (5, 4) and rows.tolist() == [0, 1, 2, 3, 4]
+    # Each write maps a new matrix file; rows read before it keep their embeddings
+    assert len(embedding_matrix_paths(path)) == 1
+    assert old_df["code_embedding"][2].tolist() == [2.0] * 4
+
+
+def test_columns_are_read_on_demand(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_store, "ROW_GROUP_ROWS", 2)
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(7), path)
+
+    df = read_index(path, exclude_columns=["code"])
+    rows = read_index_rows(path, [5, 1], ["code"])
+
+    assert "code" not in df.columns
+    assert rows["code"].to_dict() == {1: "def f1(): pass", 5: "def f5(): pass"}
+
+
+def test_text_is_stored_in_compressed_frames(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_store, "ROW_GROUP_ROWS", 3)
+    monkeypatch.setattr(index_store, "TEXT_FRAME_ROWS", 4)
+    path = tmp_path / INDEX_FILE_NAME
+    df = _index(10)
+    df.loc[[2, 7], "code"] = None
+    df["summary"] = [None] * 9 + ["Résumé"]
+    write_index(df, path)
+
+    stored = pq.read_table(path, columns=["code"]).column("code")
+    assert pa.types.is_binary(stored.type)
+    assert stored.is_valid().to_pylist() == [i % 4 == 0 for i in range(10)]
+
+    expected = df[["code", "summary"]].replace({np.nan: None})
+    assert read_index(path, ["code", "summary"]).equals(expected)
+    # Rows are read from frames that straddle row groups
+    assert read_index_rows(path, [9, 7, 3], ["summary", "code"]).equals(
+        expected.loc[[3, 7, 9], ["summary", "code"]]
+    )
+
+
+def test_repeated_metadata_is_loaded_as_categoricals(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(3).assign(file_checksum="abc"), path)
+    append_index_segment(path, _index(2).assign(file_checksum="def"), deleted_rows=[])
+
+    df = read_index(path)
+
+    for column in ["filepath", "code_type", "file_checksum"]:
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    assert df["file_checksum"].tolist() == ["abc"] * 3 + ["def"] * 2
+    # Each distinct value is decoded once
+    assert df["filepath"].cat.categories.tolist() == [
+        Path(f"/repo/m{i}.py") for i in range(3)
+    ]
+    assert df["code_type"].tolist() == [CodeType.FUNCTION] * 5
+
+
+def test_embeddings_of_two_dimensions_can_share_an_index(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(pd.concat([_index(2, 4), _index(1, 8)], ignore_index=True), path)
+
+    df = read_index(path, ["code_embedding"])
+
+    assert [len(row) for row in df["code_embedding"]] == [4, 4, 8]
+    assert len(embedding_matrix_paths(path)) == 2
+
+
+def test_pickled_indexes_are_converted(tmp_path):
+    _index(2).to_pickle(tmp_path / LEGACY_INDEX_FILE_NAME)
+    (tmp_path / "repo").mkdir()
+
+    CodeManager(tmp_path / INDEX_FILE_NAME, tmp_path / "repo", FakeOpenAIService())
+
+    assert (tmp_path / INDEX_FILE_NAME).exists()
+    assert read_index(tmp_path / INDEX_FILE_NAME)["function_name"].tolist() == [
+        "f0",
+        "f1",
+    ]
+
+
+def test_segments_append_and_delete_rows_until_compacted(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(3), path)
+    base_write_id = index_write_id(path)
+
+    appended = append_index_segment(path, _index(2, 8), deleted_rows=[1])
+    append_index_segment(path, None, deleted_rows=[3])
+
+    assert appended.index.tolist() == [3, 4]
+    assert index_write_id(path) == base_write_id
+    df = read_index(path)
+    assert df.index.tolist() == [0, 2, 4]
+    assert [len(e) for e in df["code_embedding"]] == [4, 4, 8]
+    assert read_index_rows(path, [4, 0], ["code"])["code"].to_dict() == {
+        0: "def f0(): pass",
+        4: "def f1(): pass",
+    }
+    assert len(read_embedding_matrices(path, df.loc[[0, 2]])) == 1
+    assert len(read_embedding_matrices(path, df.loc[[4]])) == 1
+
+    assert compact_index(path) == 3
+    assert not segments_directory(path, base_write_id).exists()
+    assert read_index(path)["function_name"].tolist() == ["f0", "f2", "f1"]
+
+
+def test_segments_of_a_replaced_base_file_are_ignored(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(3), path)
+    append_index_segment(path, _index(2), deleted_rows=[0])
+    manifest = (
+        segments_directory(path, index_write_id(path)) / MANIFEST_FILE_NAME
+    ).read_text()
+
+    # A manifest that doesn't record the current base file
+    write_index(_index(1), path)
+    segments_directory(path, index_write_id(path)).mkdir()
+    (segments_directory(path, index_write_id(path)) / MANIFEST_FILE_NAME).write_text(
+        manifest
+    )
+
+    assert read_index(path)["function_name"].tolist() == ["f0"]
+
+
+def test_a_snapshot_reads_its_version_until_released(tmp_path):
+    path = tmp_path / INDEX_FILE_NAME
+    write_index(_index(3), path)
+    append_index_segment(path, _index(2, 8), deleted_rows=[1])
+
+    with IndexSnapshot(path) as snapshot:
+        old_write_id = snapshot.write_id
+        compact_index(path)
+        write_index(_index(1), path)
+
+        df = snapshot.read(exclude_columns=["code_embedding"])
+        assert df.index.tolist() == [0, 2, 3, 4]
+        assert snapshot.read_rows([4], ["code"])["code"].tolist() == ["def f1(): pass"]
+        (matrix, rows, _) = snapshot.embedding_matrices(df.loc[[3, 4]])[0]
+        assert matrix[rows].shape == (2, 8)
+        assert version_path(path, old_write_id).exists()
+
+    # Writers collect versions once no snapshot pins them
+    append_index_segment(path, _index(1), deleted_rows=[])
+    assert not version_path(path, old_write_id).exists()
+    assert not segments_directory(path, old_write_id).exists()
+    assert len(embedding_matrix_paths(path)) == 1
+    assert read_index(path)["function_name"].tolist() == ["f0", "f0"]
+
+
+def test_setup_appends_changed_files_as_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    root = tmp_path / "repo"
+    root.mkdir()
+    for i in range(4):
+        (root / f"m{i}.py").write_text(f"def f{i}():\n    return {i}\n")
+    path = tmp_path / "index" / INDEX_FILE_NAME
+    CodeManager(path, root, _local_service()).setup()
+    base_write_id = index_write_id(path)
+
+    (root / "m0.py").write_text("def g():\n    return 0\n")
+    CodeManager(path, root, _local_service()).setup()
+
+    assert index_write_id(path) == base_write_id
+    assert not index_needs_compaction(path)
+    names = set(read_index(path)["function_name"].dropna())
+    assert names == {"g", "f1", "f2", "f3"}
+
+    # Changes are appended until the segments hold more rows than the base, which compacts the index
+    for i in range(1, 4):
+        (root / f"m{i}.py").write_text(f"def h{i}():\n    return {i}\n")
+        CodeManager(path, root, _local_service()).setup()
+    assert index_write_id(path) != base_write_id
+    assert set(read_index(path)["function_name"].dropna()) == {"g", "h1", "h2", "h3"}
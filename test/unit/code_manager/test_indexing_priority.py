@@ -0,0 +1,69 @@
+import os
+
+from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.index_progress import IndexProgress
+from repo_gpt.code_manager.index_store import INDEX_FILE_NAME, read_index
+from repo_gpt.code_manager.indexing_priority import prioritise_files
+
+from .test_code_processor import FakeOpenAIService
+
+
+def _write(path, text, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_recently_changed_directories_come_first_outside_git(tmp_path):
+    _write(tmp_path / "old" / "a.py", "", 1_000)
+    _write(tmp_path / "old" / "b.py", "", 2_000)
+    _write(tmp_path / "hot" / "c.py", "", 1_500)
+    _write(tmp_path / "hot" / "d.py", "", 3_000)
+
+    ordered = prioritise_files(tmp_path, sorted(tmp_path.glob("*/*.py")))
+
+    assert [path.name for path in ordered] == ["d.py", "c.py", "b.py", "a.py"]
+
+
+def test_progress_banner_tells_running_from_interrupted(tmp_path):
+    progress = IndexProgress(tmp_path / "index.progress.json")
+    assert progress.banner() is None
+
+    progress.update(25, 100)
+    assert progress.is_running()
+    assert "25/100" in progress.banner()
+    assert "background" in progress.banner()
+
+    # No process has this pid
+    progress.update(25, 100, pid=2**22 + 1)
+    assert not progress.is_running()
+    assert "interrupted" in progress.banner()
+
+    progress.clear()
+    assert progress.banner() is None
+
+
+def test_setup_commits_the_index_in_prioritised_increments(tmp_path):
+    root = tmp_path / "repo"
+    for i in range(4):
+        _write(root / f"m{i}.py", f"def f{i}():\n    return {i}\n", 1_000 + i)
+    index_path = tmp_path / "index" / INDEX_FILE_NAME
+
+    manager = CodeManager(index_path, root, FakeOpenAIService(), first_commit_blocks=1)
+    assert not manager.setup(max_commits=1)
+
+    partial = read_index(index_path)
+    # Increments hold whole files, so m3.py's function and file-level blocks go in together
+    assert set(partial["filepath"].map(lambda path: path.name)) == {"m3.py"}
+    assert manager.progress.read()["indexed_blocks"] == len(partial)
+
+    manager = CodeManager(index_path, root, FakeOpenAIService(), first_commit_blocks=1)
+    assert manager.setup()
+
+    assert set(read_index(index_path)["function_name"].dropna()) == {
+        "f0",
+        "f1",
+        "f2",
+        "f3",
+    }
+    assert manager.progress.read() is None
@@ -0,0 +1,59 @@
+import pytest
+
+from repo_gpt.code_manager.code_manager import CodeManager
+from repo_gpt.code_manager.index_store import INDEX_FILE_NAME, compact_index, read_index
+from repo_gpt.code_manager.source_store import sources_directory
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.file_handler.generic_code_file_handler import PythonFileHandler
+from repo_gpt.search_service import SearchService
+from repo_gpt.utils import Singleton
+
+from .test_code_processor import FakeOpenAIService
+
+SOURCE = 'x = "é"\r\n\r\nclass Greeter:\r\n    def greet(self):\r\n        return "héllo"\r\n'
+
+
+def test_byte_ranges_locate_each_block_in_its_file(tmp_path):
+    filepath = tmp_path / "greeter.py"
+    filepath.write_bytes(SOURCE.encode("utf-8"))
+
+    blocks = [
+        block
+        for block in PythonFileHandler().extract_code(filepath)
+        if block.code_start is not None
+    ]
+
+    assert blocks
+    with open(filepath, encoding="utf-8") as file:
+        text = file.read().encode("utf-8")
+    for block in blocks:
+        assert text[block.code_start : block.code_end].decode("utf-8") == block.code
+
+
+# Appending changes mustn't pass missing or empty frames to pd.concat
+@pytest.mark.filterwarnings("error::FutureWarning")
+def test_code_stored_by_reference_outlives_changes_to_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    root = tmp_path / "repo"
+    root.mkdir()
+    (root / "greeter.py").write_bytes(SOURCE.encode("utf-8"))
+    index_path = tmp_path / "index" / INDEX_FILE_NAME
+    openai_service = FakeOpenAIService(HashingEmbeddingProvider(dimensions=16))
+    CodeManager(index_path, root, openai_service, code_by_reference=True).setup()
+
+    index = read_index(index_path)
+    assert index.loc[index["code_start"].notna(), "code"].isna().all()
+
+    search_service = SearchService(openai_service, index_path)
+    expected = 'def greet(self):\n        return "héllo"'
+    assert search_service.find_function_match("greet")["code"].iloc[0] == expected
+
+    # The edit isn't indexed yet, so the code comes from the copy taken at indexing
+    (root / "greeter.py").write_text("def other():\n    pass\n")
+    assert search_service.find_function_match("greet")["code"].iloc[0] == expected
+
+    CodeManager(index_path, root, openai_service, code_by_reference=True).setup()
+    # The search's snapshot still reads the old copy, until it lets go of it
+    search_service.snapshot.release()
+    compact_index(index_path)
+    assert len(list(sources_directory(index_path).iterdir())) == 1
@@ -0,0 +1,51 @@
+from argparse import Namespace
+from pathlib import Path
+
+from repo_gpt.cli import background_command
+
+
+def test_background_setup_gets_the_setup_options_of_the_search(tmp_path):
+    args = Namespace(
+        pickle_path="index.parquet",
+        code_root_path=str(tmp_path),
+        max_concurrency=4,
+        embedding_provider="local",
+        max_connections=8,
+        openai_base_url="http://localhost:8000/v1",
+        embedding_dimensions=256,
+        embedding_cache_dir=str(tmp_path / "cache"),
+        embedding_cache_max_mb=64.0,
+        no_embedding_cache=False,
+        code_by_reference=True,
+        checkpoint_every_blocks=100,
+        checkpoint_every_seconds=5.0,
+    )
+
+    assert background_command(args, "setup")[1:] == [
+        "-m",
+        "repo_gpt.cli",
+        "--pickle_path",
+        str(Path("index.parquet").absolute()),
+        "--code_root_path",
+        str(tmp_path),
+        "--max_concurrency",
+        "4",
+        "--embedding_provider",
+        "local",
+        "--max_connections",
+        "8",
+        "--checkpoint_every_blocks",
+        "100",
+        "--checkpoint_every_seconds",
+        "5.0",
+        "--openai_base_url",
+        "http://localhost:8000/v1",
+        "--embedding_dimensions",
+        "256",
+        "--embedding_cache_dir",
+        str(tmp_path / "cache"),
+        "--embedding_cache_max_mb",
+        "64.0",
+        "--code_by_reference",
+        "setup",
+    ]
@@ -0,0 +1,75 @@
+import numpy as np
+
+from repo_gpt.embedding_cache import EmbeddingCache
+
+MODEL = "text-embedding-3-small"
+
+
+def test_put_and_get_round_trip(tmp_path):
+    cache = EmbeddingCache(tmp_path)
+    vector = np.array([0.1, 0.2, 0.3], dtype=np.float32)
+
+    cache.put(MODEL, None, "def foo(): pass", vector)
+
+    np.testing.assert_array_equal(cache.get(MODEL, None, "def foo(): pass"), vector)
+    assert cache.hits == 1
+    assert cache.misses == 0
+
+
+def test_key_includes_model_and_dimensions(tmp_path):
+    cache = EmbeddingCache(tmp_path)
+    cache.put(MODEL, None, "code", np.ones(3, dtype=np.float32))
+
+    assert cache.get("another-model", None, "code") is None
+    assert cache.get(MODEL, 256, "code") is None
+    assert cache.misses == 2
+
+
+def test_cache_is_shared_across_instances(tmp_path):
+    EmbeddingCache(tmp_path).put(MODEL, None, "code", np.ones(3, dtype=np.float32))
+
+    assert EmbeddingCache(tmp_path).get(MODEL, None, "code") is not None
+
+
+def test_get_many_preserves_order_and_reports_misses(tmp_path):
+    cache = EmbeddingCache(tmp_path)
+    cache.put_many(
+        MODEL,
+        None,
+        [("a", np.zeros(2, dtype=np.float32)), ("c", np.ones(2, dtype=np.float32))],
+    )
+
+    a, b, c = cache.get_many(MODEL, None, ["a", "b", "c"])
+
+    assert a[0] == 0 and b is None and c[0] == 1
+    assert cache.stats() == "2 hits, 1 misses (67% hit rate)"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    vector = np.zeros(64 * 1024, dtype=np.float32)  # 256KB
+    cache = EmbeddingCache(tmp_path, max_size_mb=0.6)
+
+    cache.put(MODEL, None, "old", vector)
+    cache.put(MODEL, None, "recent", vector)
+    cache.get(MODEL, None, "old")  # touch "old" so "recent" becomes the LRU entry
+    cache.put(MODEL, None, "newest", vector)
+
+    assert cache.size_bytes() <= 0.6 * 1024 * 1024
+    assert cache.get(MODEL, None, "recent") is None
+    assert cache.get(MODEL, None, "old") is not None
+    assert cache.get(MODEL, None, "newest") is not None
+
+
+def test_size_is_kept_as_a_running_total(tmp_path):
+    cache = EmbeddingCache(tmp_path, max_size_mb=0.6)
+    vector = np.zeros(64 * 1024, dtype=np.float32)  # 256KB
+
+    cache.put_many(MODEL, None, [("a", vector), ("b", vector)])
+    cache.put(MODEL, None, "a", vector)  # replacing a vector doesn't count it twice
+    assert cache.size_bytes() == 2 * vector.nbytes
+
+    cache.put(MODEL, None, "c", vector)
+    (actual,) = cache._connection.execute(
+        "SELECT SUM(LENGTH(vector)) FROM embeddings"
+    ).fetchone()
+    assert cache.size_bytes() == actual == 2 * vector.nbytes
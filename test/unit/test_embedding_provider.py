@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from repo_gpt.embedding_provider import (
+    HashingEmbeddingProvider,
+    embedding_space_mismatch,
+)
+
+
+def _similarity(provider, a, b):
+    embedding_a, embedding_b = provider.embed([a, b])
+    return float(embedding_a.dot(embedding_b))
+
+
+def test_embeddings_are_normalised_and_deterministic():
+    provider = HashingEmbeddingProvider(dimensions=64)
+
+    first, second = provider.embed(["def add(a, b): return a + b"] * 2)
+
+    assert first.shape == (64,)
+    assert first.dtype == np.float32
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert np.array_equal(first, second)
+
+
+def test_token_inputs_embed_like_their_text():
+    provider = HashingEmbeddingProvider()
+    text = "class UserRepository: pass"
+
+    (from_text,) = provider.embed([text])
+    (from_tokens,) = provider.embed(provider.tokenize([text]))
+
+    assert np.array_equal(from_text, from_tokens)
+
+
+def test_identifier_styles_share_features():
+    provider = HashingEmbeddingProvider()
+
+    related = _similarity(provider, "get_user_name", "getUserName")
+    unrelated = _similarity(provider, "get_user_name", "parse_http_header")
+
+    assert related > unrelated
+
+
+def test_empty_text_embeds_to_zero_vector():
+    (embedding,) = HashingEmbeddingProvider(dimensions=16).embed([""])
+
+    assert not embedding.any()
+
+
+def test_indexes_from_other_embedding_spaces_are_detected():
+    provider = HashingEmbeddingProvider(dimensions=256)
+    df = pd.DataFrame(
+        {
+            "embedding_provider": ["local"],
+            "embedding_model": [provider.model],
+            "embedding_dimensions": [256],
+        }
+    )
+
+    assert embedding_space_mismatch(df, provider) is None
+    assert "dimensions" in embedding_space_mismatch(df, HashingEmbeddingProvider())
+    # Indexes from before providers were recorded hold OpenAI embeddings
+    legacy_df = df.drop(columns=["embedding_provider"])
+    assert "provider" in embedding_space_mismatch(legacy_df, provider)
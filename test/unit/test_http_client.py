@@ -0,0 +1,58 @@
+import copy
+
+import openai
+import pytest
+
+from repo_gpt import http_client
+from repo_gpt.openai_service import OpenAIService
+from repo_gpt.utils import Singleton
+
+
+@pytest.fixture(autouse=True)
+def default_settings(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(Singleton, "_instances", {})
+    yield
+    http_client.configure_http_client(**vars(http_client.HttpClientSettings()))
+
+
+def test_every_openai_client_shares_one_connection_pool():
+    shared = http_client.http_client()
+
+    assert http_client.openai_client()._client is shared
+    assert http_client.openai_client("sk-other")._client is shared
+    assert OpenAIService(use_embedding_cache=False).client._client is shared
+    assert http_client.async_openai_client()._client is (
+        http_client.async_http_client()
+    )
+
+
+def test_base_url_and_pool_size_are_configurable():
+    http_client.configure_http_client(
+        base_url="http://127.0.0.1:8000/v1", max_connections=4
+    )
+
+    client = http_client.openai_client()
+
+    assert str(client.base_url) == "http://127.0.0.1:8000/v1/"
+    assert client._client._transport._pool._max_connections == 4
+
+
+def test_autogen_config_keeps_the_shared_pool_through_deep_copies():
+    http_client.configure_http_client(base_url="http://127.0.0.1:8000/v1")
+
+    # autogen deep-copies llm_config when it builds an agent
+    config = copy.deepcopy(
+        {"config_list": [http_client.autogen_config("gpt-4.1-mini")]}
+    )
+
+    (entry,) = config["config_list"]
+    assert entry["http_client"] is http_client.http_client()
+    assert entry["base_url"] == "http://127.0.0.1:8000/v1"
+    assert entry["api_key"] == "sk-test"
+
+
+def test_rate_limited_requests_are_left_to_the_concurrency_limiter():
+    # The service retries itself once the limiter has backed off; the client retrying too would hide 429s from it
+    assert OpenAIService(use_embedding_cache=False).client.max_retries == 0
+    assert http_client.openai_client().max_retries == openai.DEFAULT_MAX_RETRIES
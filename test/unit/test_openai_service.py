@@ -0,0 +1,167 @@
+import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import pytest
+from openai import OpenAI
+
+from repo_gpt import openai_service
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.utils import Singleton
+
+
+class FakeEncoding:
+    def __init__(self):
+        self.batch_calls = 0
+
+    def encode(self, text, disallowed_special=None):
+        return [len(word) for word in text.split()]
+
+    def encode_batch(self, texts, num_threads=1, disallowed_special=None):
+        self.batch_calls += 1
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture
+def fake_tiktoken(monkeypatch):
+    calls = []
+    encoding = FakeEncoding()
+
+    def encoding_for_model(model):
+        calls.append(model)
+        if model.startswith("gpt"):
+            return encoding
+        raise KeyError(model)
+
+    monkeypatch.setattr(
+        openai_service.tiktoken, "encoding_for_model", encoding_for_model
+    )
+    monkeypatch.setattr(openai_service.tiktoken, "get_encoding", lambda name: encoding)
+    openai_service.get_encoding.cache_clear()
+    yield calls, encoding
+    openai_service.get_encoding.cache_clear()
+
+
+def test_encodings_are_looked_up_once_per_name(fake_tiktoken):
+    calls, _ = fake_tiktoken
+
+    for _ in range(3):
+        openai_service.num_tokens_from_string("def foo(): pass", model="gpt-4")
+
+    assert calls == ["gpt-4"]
+
+
+def test_encoding_names_resolve_like_model_names(fake_tiktoken):
+    _, encoding = fake_tiktoken
+
+    assert openai_service.get_encoding("cl100k_base") is encoding
+
+
+def test_large_batches_use_the_parallel_encoder(fake_tiktoken):
+    _, encoding = fake_tiktoken
+    strings = ["a bb ccc"] * openai_service.MIN_PARALLEL_TOKENIZE_BATCH
+
+    counts = openai_service.num_tokens_from_strings(strings, model="gpt-4")
+
+    assert counts == [3] * len(strings)
+    assert encoding.batch_calls == 1
+
+
+def test_small_batches_encode_serially(fake_tiktoken):
+    _, encoding = fake_tiktoken
+
+    assert openai_service.tokens_from_strings(["a bb", "c"], model="gpt-4") == [
+        [1, 2],
+        [1],
+    ]
+    assert encoding.batch_calls == 0
+
+
+@pytest.fixture
+def embeddings_server(monkeypatch):
+    """An OpenAIService whose client talks to an in-process stand-in for the embeddings endpoint."""
+    requests = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        requests.append(body)
+        data = [
+            {
+                "object": "embedding",
+                "index": index,
+                "embedding": base64.b64encode(
+                    np.full(4, index, dtype="<f4").tobytes()
+                ).decode(),
+            }
+            for index in range(len(body["input"]))
+        ]
+        return httpx.Response(
+            200,
+            json={
+                "object": "list",
+                "data": data[::-1],
+                "model": body["model"],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+    monkeypatch.setattr(Singleton, "_instances", {})
+    service = openai_service.OpenAIService(use_embedding_cache=False)
+    service._client = OpenAI(
+        api_key="test",
+        http_client=httpx.Client(transport=httpx.MockTransport(handler)),
+    )
+    return service, requests
+
+
+def test_embeddings_are_requested_and_decoded_as_base64(embeddings_server):
+    service, requests = embeddings_server
+
+    embeddings = service.create_embeddings(["a", "b", "c"])
+
+    assert requests[0]["encoding_format"] == "base64"
+    for index, embedding in enumerate(embeddings):
+        assert embedding.dtype == np.float32
+        assert embedding.tolist() == [index] * 4
+
+
+def test_float_embeddings_still_decode():
+    embedding = openai_service.decode_embedding([0.5, 0.25])
+
+    assert embedding.dtype == np.float32
+    assert embedding.tolist() == [0.5, 0.25]
+
+
+def test_concurrent_identical_queries_share_one_request(monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    provider = HashingEmbeddingProvider(dimensions=8)
+    service = openai_service.OpenAIService(
+        use_embedding_cache=False, embedding_provider=provider
+    )
+    calls = []
+    release = threading.Event()
+    embed = provider.embed
+
+    def slow_embed(inputs):
+        calls.append(inputs)
+        release.wait(timeout=5)
+        return embed(inputs)
+
+    monkeypatch.setattr(provider, "embed", slow_embed)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(service.get_embedding, "parse config") for _ in range(4)
+        ]
+        while service.embedding_requests.coalesced < 3:
+            time.sleep(0.01)
+        release.set()
+        embeddings = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(embedding is embeddings[0] for embedding in embeddings)
+    assert service.embedding_requests.stats() == "1 requests, 3 coalesced"
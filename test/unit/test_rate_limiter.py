@@ -0,0 +1,98 @@
+import pytest
+
+from repo_gpt.rate_limiter import (
+    AdaptiveConcurrencyLimiter,
+    parse_duration,
+    parse_retry_after,
+)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("1s", 1.0),
+        ("6m0s", 360.0),
+        ("1h2m3.5s", 3723.5),
+        ("20ms", 0.02),
+        ("2", 2.0),
+        ("", None),
+        ("abc", None),
+    ],
+)
+def test_parse_duration(value, expected):
+    assert parse_duration(value) == expected
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"retry-after": "3"}, 3.0),
+        ({"x-ratelimit-reset-requests": "2s", "x-ratelimit-reset-tokens": "5s"}, 5.0),
+        ({}, None),
+    ],
+)
+def test_parse_retry_after(headers, expected):
+    assert parse_retry_after(headers) == expected
+
+
+def test_limit_grows_additively_on_success():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=4)
+
+    # Roughly one full window of successes grows the limit by one
+    limiter.on_success({})
+    limiter.on_success({})
+    assert limiter.limit == 2
+    limiter.on_success({})
+    assert limiter.limit == 3
+
+    for _ in range(20):
+        limiter.on_success({})
+    assert limiter.limit == 4
+
+
+def test_limit_shrinks_multiplicatively_on_throttle():
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=16, max_limit=16, decrease_interval=0
+    )
+
+    limiter.on_throttle({})
+    assert limiter.limit == 8
+    limiter.on_throttle({})
+    assert limiter.limit == 4
+
+
+def test_burst_of_throttles_only_decreases_once_per_interval():
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=16, max_limit=16, decrease_interval=60
+    )
+
+    for _ in range(5):
+        limiter.on_throttle({})
+    assert limiter.limit == 8
+
+
+def test_low_remaining_quota_shrinks_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, max_limit=8)
+
+    limiter.on_success(
+        {"x-ratelimit-remaining-requests": "5", "x-ratelimit-limit-requests": "100"}
+    )
+    assert limiter.limit == 4
+
+
+def test_limit_never_drops_below_min():
+    limiter = AdaptiveConcurrencyLimiter(
+        initial_limit=2, min_limit=2, decrease_interval=0
+    )
+
+    limiter.on_throttle({})
+    assert limiter.limit == 2
+
+
+def test_slot_tracks_in_flight_requests():
+    limiter = AdaptiveConcurrencyLimiter()
+
+    with limiter.slot():
+        assert limiter.in_flight == 1
+    assert limiter.in_flight == 0
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from repo_gpt.code_manager.code_processor import BLOCK_WINDOW_INDEX
+from repo_gpt.code_manager.index_store import (
+    INDEX_FILE_NAME,
+    LEGACY_INDEX_FILE_NAME,
+    write_index,
+)
+from repo_gpt.embedding_provider import HashingEmbeddingProvider
+from repo_gpt.search_service import SearchService
+from repo_gpt.singleflight import SingleFlight
+from repo_gpt.utils import Singleton
+
+
+class FakeOpenAIService:
+    embedding_cache = None
+    embedding_requests = SingleFlight()
+    embedding_provider = HashingEmbeddingProvider(dimensions=2)
+
+    def get_embedding(self, query, embedding_provider=None):
+        return np.array([0.0, 1.0])
+
+
+def _row(block_id, window_index, embedding, code=None):
+    return {
+        "code": code,
+        "filepath": "a.py",
+        "block_id": block_id,
+        "window_index": window_index,
+        "code_embedding": np.array(embedding),
+        "embedding_provider": "local",
+        "embedding_model": HashingEmbeddingProvider.model,
+        "embedding_dimensions": 2,
+    }
+
+
+@pytest.mark.parametrize("index_file_name", [INDEX_FILE_NAME, LEGACY_INDEX_FILE_NAME])
+def test_windowed_blocks_score_as_their_best_window(
+    tmp_path, monkeypatch, index_file_name
+):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    pickle_path = tmp_path / index_file_name
+    index = pd.DataFrame(
+        [
+            _row("small", BLOCK_WINDOW_INDEX, [0.6, 0.8], "def small(): pass"),
+            # The big block's average points away from the query but one window matches it exactly
+            _row("big", BLOCK_WINDOW_INDEX, [1.0, 0.0], "class Big: ..."),
+            _row("big", 0, [1.0, 0.0]),
+            _row("big", 1, [0.0, 1.0]),
+        ]
+    )
+    write_index(index, pickle_path)
+
+    search_service = SearchService(FakeOpenAIService(), pickle_path)
+    results = search_service.semantic_search_similar_code("query", 2)
+
+    assert len(search_service.df) == 2
+    assert results["code"].tolist() == ["class Big: ...", "def small(): pass"]
+    assert np.allclose(results["similarities"], [1.0, 0.8])
+
+
+def test_functions_are_found_by_exact_name_or_closest_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(Singleton, "_instances", {})
+    index_path = tmp_path / INDEX_FILE_NAME
+    index = pd.DataFrame(
+        [
+            _row("a", BLOCK_WINDOW_INDEX, [1.0, 0.0], "def load(): ..."),
+            _row("b", BLOCK_WINDOW_INDEX, [1.0, 0.0], "def save(): ..."),
+        ]
+    ).assign(function_name=["load", "save"], class_name=[None, "Store"])
+    write_index(index, index_path)
+
+    search_service = SearchService(FakeOpenAIService(), index_path)
+
+    assert search_service.find_function_match("load", matches_to_return=1)[
+        "code"
+    ].tolist() == ["def load(): ..."]
+    assert search_service.find_function_match("sav", "Store", 1)["code"].tolist() == [
+        "def save(): ..."
+    ]
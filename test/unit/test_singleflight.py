@@ -0,0 +1,56 @@
+import threading
+import time
+
+from repo_gpt.singleflight import SingleFlight
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_call():
+        started.set()
+        release.wait(timeout=5)
+        raise RuntimeError("rate limited")
+
+    errors = []
+
+    def waiter():
+        try:
+            single_flight.do("key", lambda: "unused")
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader_errors = []
+
+    def lead():
+        try:
+            single_flight.do("key", failing_call)
+        except RuntimeError as e:
+            leader_errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=waiter)
+    follower.start()
+    while single_flight.coalesced < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert errors == leader_errors
+    # The failure isn't cached: the next call runs again
+    assert single_flight.do("key", lambda: "ok") == "ok"
+    assert single_flight.executed == 2
+
+
+def test_calls_with_different_keys_are_not_coalesced():
+    single_flight = SingleFlight()
+
+    assert single_flight.do("a", lambda: 1) == 1
+    assert single_flight.do("b", lambda: 2) == 2
+    assert single_flight.do("a", lambda: 3) == 3
+    assert single_flight.stats() == "3 requests, 0 coalesced"